@@ -0,0 +1,158 @@
+"""
+Fuzz e vazao do leitor da lista de estabelecimentos de calcular_distancias_carro
+(estabelecimentos.interpretar).
+
+- fuzz: listas aleatorias no formato chave=valor do agente, com nomes contendo
+  virgulas, chaves, '=' e "lat=", campos extras, o alias `long`, espacos variados
+  e colchetes opcionais, precisam voltar exatamente aos valores gerados; depois
+  cada texto e mutilado (cortes, insercoes e remocoes de caracteres) e o leitor
+  precisa devolver uma lista ou levantar ErroFormato com posicao dentro do texto,
+  nunca outra excecao;
+- vazao: listas de N estabelecimentos, em estabelecimentos/s e MB/s, com
+  json.loads da lista equivalente em JSON como referencia; o tempo por byte
+  constante entre os tamanhos mostra que a leitura e linear.
+
+Termina com erro se algum caso do fuzz falhar.
+
+Uso:
+    python benchmarks/bench_estabelecimentos.py [--casos N] [--mutacoes M] [--tamanhos N ...] [--semente S]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "get_services", "tools", "calculate_driving_distance"))
+
+from estabelecimentos import COORDENADAS, ErroFormato, interpretar  # noqa: E402
+
+PEDACOS = ["CAPS", "UBS", "Clínica", "São José", "Centro", ",", ", ", "{", "}", "{2}", "=", "lat=", "lng=",
+           " lat=", "Dr.", "Av. Brasil, 100", "(24h)", "nº 5", "ã", "ç", "-", "'", '"', "[", "]"]
+CAMPO_NO_NOME = re.compile(r",\s*([A-Za-z_][A-Za-z0-9_]*)\s*=\s*(\S?)")
+FECHA_OBJETO = re.compile(r"\}\s*(?:,\s*\{|\]|$)")
+
+
+def nome_valido(nome):
+    # Fora da regra documentada: ", campo=" vira um novo campo (em coordenadas, se seguido de numero)
+    # e "}" seguido de ", {" ou "]" fecha o objeto
+    if not nome or nome != nome.strip() or FECHA_OBJETO.search(nome) or nome.endswith(","):
+        return False
+    for achado in CAMPO_NO_NOME.finditer(nome):
+        if achado.group(1) not in COORDENADAS or not achado.group(2) or achado.group(2) in "+-.0123456789":
+            return False
+    return True
+
+
+def gerar_nome(sorteio):
+    while True:
+        nome = "".join(sorteio.choice(PEDACOS) + sorteio.choice(["", " "]) for _ in range(sorteio.randint(1, 6)))
+        nome = nome.strip()
+        if nome_valido(nome):
+            return nome
+
+
+def gerar_estabelecimento(sorteio):
+    esperado = {"name": gerar_nome(sorteio),
+                "lat": f"{sorteio.uniform(-33.7, 5.3):.6f}",
+                "lng": f"{sorteio.uniform(-73.9, -34.8):.6f}"}
+    campos = [("name", esperado["name"]), ("lat", esperado["lat"]),
+              (sorteio.choice(["lng", "long"]), esperado["lng"])]
+    for _ in range(sorteio.randint(0, 2)):
+        chave = sorteio.choice(["tipo", "telefone", "bairro", "x_1"])
+        if chave not in esperado:
+            valor = "".join(sorteio.choice(string.ascii_letters + " ()-/") for _ in range(sorteio.randint(1, 12)))
+            valor = valor.strip() or "a"
+            esperado[chave] = valor
+            campos.insert(sorteio.randint(1, len(campos)), (chave, valor))
+    return esperado, campos
+
+
+def formatar(sorteio, objetos):
+    def espaco():
+        return sorteio.choice(["", "", " ", "  ", "\n"])
+
+    textos = []
+    for campos in objetos:
+        textos.append("{" + espaco() + ("," + espaco()).join(
+            f"{chave}{sorteio.choice(['', ' '])}={espaco()}{valor}" for chave, valor in campos) + espaco() + "}")
+    corpo = ("," + espaco()).join(textos)
+    if objetos and sorteio.random() < 0.1:
+        return corpo
+    return "[" + espaco() + corpo + espaco() + "]"
+
+
+def mutilar(sorteio, texto):
+    posicao = sorteio.randint(0, len(texto))
+    operacao = sorteio.choice(["cortar", "inserir", "remover"])
+    if operacao == "cortar":
+        return texto[:posicao]
+    if operacao == "inserir":
+        return texto[:posicao] + sorteio.choice("{}[],= ab1") + texto[posicao:]
+    return texto[:posicao] + texto[posicao + sorteio.randint(1, 5):]
+
+
+def fuzz(casos, mutacoes, sorteio):
+    falhas = 0
+    for _ in range(casos):
+        gerados = [gerar_estabelecimento(sorteio) for _ in range(sorteio.randint(0, 6))]
+        texto = formatar(sorteio, [campos for _, campos in gerados])
+        esperado = [e for e, _ in gerados]
+        try:
+            obtido = interpretar(texto)
+        except ErroFormato as e:
+            obtido = e
+        if obtido != esperado:
+            falhas += 1
+            if falhas <= 5:
+                print(f"divergencia:\n  texto:    {texto!r}\n  esperado: {esperado}\n  obtido:   {obtido}")
+
+        for _ in range(mutacoes):
+            mutilado = mutilar(sorteio, texto)
+            try:
+                resultado = interpretar(mutilado)
+                ok = isinstance(resultado, list)
+            except ErroFormato as e:
+                ok = 0 <= e.posicao <= len(mutilado)
+            except Exception as e:  # qualquer outra excecao e falha do leitor
+                ok = False
+                print(f"excecao {type(e).__name__}: {e} em {mutilado!r}")
+            falhas += not ok
+    return falhas
+
+
+def vazao(tamanhos, sorteio):
+    print(f"{'N':>6} {'KB':>8} {'kv (ms)':>9} {'estab/s':>10} {'MB/s':>7} {'ns/byte':>8} {'json (ms)':>10}")
+    for n in tamanhos:
+        gerados = [gerar_estabelecimento(sorteio) for _ in range(n)]
+        texto = formatar(sorteio, [campos for _, campos in gerados])
+        texto_json = json.dumps([e for e, _ in gerados], ensure_ascii=False)
+        repeticoes = max(3, 20000 // max(n, 1))
+        kv = min(timeit.repeat(lambda: interpretar(texto), number=repeticoes, repeat=3)) / repeticoes
+        js = min(timeit.repeat(lambda: json.loads(texto_json), number=repeticoes, repeat=3)) / repeticoes
+        tamanho = len(texto.encode("utf-8"))
+        print(f"{n:>6} {tamanho / 1024:>8.1f} {kv * 1000:>9.3f} {n / kv:>10.0f} {tamanho / kv / 1e6:>7.1f} "
+              f"{kv / tamanho * 1e9:>8.1f} {js * 1000:>10.3f}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--casos", type=int, default=2000)
+    parser.add_argument("--mutacoes", type=int, default=10, help="textos mutilados por caso")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[10, 100, 500, 1000, 5000])
+    parser.add_argument("--semente", type=int, default=25)
+    args = parser.parse_args(argv[1:])
+    sorteio = random.Random(args.semente)
+
+    falhas = fuzz(args.casos, args.mutacoes, sorteio)
+    print(f"fuzz: {args.casos} listas, {args.casos * args.mutacoes} mutacoes, {falhas} falhas")
+    vazao(args.tamanhos, sorteio)
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
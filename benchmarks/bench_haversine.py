@@ -0,0 +1,59 @@
+"""
+Micro-benchmark: haversine vetorizado (geo.haversine_km) contra a versao escalar
+com math (a antiga FilterNearbyCities.haversine), uma origem contra N pontos.
+
+Uso:
+    python benchmarks/bench_haversine.py [N ...]
+"""
+import math
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "location_analyzer", "tools", "filter_nearby_cities"))
+
+from geo import haversine_km  # noqa: E402
+
+
+def haversine_escalar(lat1, lon1, lat2, lon2):
+    R = 6371
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    delta_phi = math.radians(lat2 - lat1)
+    delta_lambda = math.radians(lon2 - lon1)
+
+    a = math.sin(delta_phi / 2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    return R * c
+
+
+def main(argv):
+    tamanhos = [int(n) for n in argv[1:]] or [10, 100, 1000, 5570, 50000]
+    random.seed(42)
+    origem = (-23.5015, -47.4526)
+
+    print(f"{'N':>7} {'escalar (ms)':>13} {'numpy (ms)':>11} {'speedup':>8} {'erro max (m)':>13}")
+    for n in tamanhos:
+        lats = [random.uniform(-33.7, 5.3) for _ in range(n)]
+        lngs = [random.uniform(-73.9, -34.8) for _ in range(n)]
+
+        def escalar():
+            return [haversine_escalar(origem[0], origem[1], la, lo) for la, lo in zip(lats, lngs)]
+
+        def vetorizado():
+            return haversine_km(origem[0], origem[1], lats, lngs)
+
+        repeticoes = max(1, 20000 // n)
+        t_escalar = min(timeit.repeat(escalar, number=repeticoes, repeat=5)) / repeticoes * 1000
+        t_numpy = min(timeit.repeat(vetorizado, number=repeticoes, repeat=5)) / repeticoes * 1000
+        erro = max(abs(a - b) for a, b in zip(escalar(), vetorizado())) * 1000
+
+        print(f"{n:>7} {t_escalar:>13.3f} {t_numpy:>11.3f} {t_escalar / t_numpy:>7.1f}x {erro:>13.6f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
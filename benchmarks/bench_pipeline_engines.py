@@ -0,0 +1,187 @@
+"""
+Vazao do pipeline de FilterNearbyCities: motor com threads contra motor asyncio.
+
+Sobe um servidor local (aiohttp, em outro processo) que imita Overpass, Mapa Saude
+Mental e Google Routes com latencia fixa, aponta a tool para ele e dispara N conversas com C
+execucoes simultaneas de execute() (como os workers da plataforma fariam),
+medindo conversas/s, latencia p50/p95 e o pico de threads do processo.
+
+Cada conversa usa coordenadas, municipios e servicos proprios, entao os caches
+(celula do Overpass, Mapa e rotas) nao mascaram a rede; o CEP e semeado no
+cache de CEP para nao depender do ViaCEP. O cache persistente vai para um
+diretorio temporario e a linha de trace por execucao fica desligada.
+
+Uso:
+    python benchmarks/bench_pipeline_engines.py [--conversas N] [--concorrencia C ...]
+        [--latencia-overpass S] [--latencia-mapa S] [--latencia-rotas S]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("VITA_ALERE_CACHE_DIR", tempfile.mkdtemp(prefix="bench_pipeline_"))
+os.environ.setdefault("VITA_ALERE_TRACE_LOG", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "location_analyzer", "tools", "filter_nearby_cities"))
+
+from aiohttp import web  # noqa: E402
+from weni.context import Context  # noqa: E402
+
+import main  # noqa: E402
+from main import CEP_CACHE, FilterNearbyCities  # noqa: E402
+
+
+def servidor(latencias):
+    """
+    Aplicacao aiohttp que imita os upstreams; cada resposta e unica por cidade/coordenada
+    """
+    async def overpass(request):
+        await asyncio.sleep(latencias["overpass"])
+        form = await request.post()
+        prefixo = str(abs(hash(form.get("data", ""))))[:8]
+        elementos = [
+            {"tags": {"name": f"Cidade {prefixo}-{k}", "ISO3166-2": "BR-SP", "population": str(100000 - k)},
+             "center": {"lat": -23.5 + k * 0.05, "lon": -46.6 + k * 0.05}}
+            for k in range(12)
+        ]
+        return web.json_response({"elements": elementos})
+
+    async def mapa(request):
+        await asyncio.sleep(latencias["mapa"])
+        cidade = request.query.get("cidade", "")
+        locations = [
+            {"name": f"CAPS {cidade} {k}", "lat": str(-23.5 + random.random()), "long": str(-46.6 + random.random()),
+             "cidade": cidade, "estado": "SP", "tipo": "caps", "formato": "presencial"}
+            for k in range(3)
+        ]
+        return web.json_response({"status": "success", "locations": locations})
+
+    async def rotas(request):
+        await asyncio.sleep(latencias["rotas"])
+        await request.json()
+        return web.json_response({"routes": [{"distanceMeters": random.randint(1000, 60000),
+                                              "duration": f"{random.randint(300, 4000)}s"}]})
+
+    app = web.Application()
+    app.router.add_post("/overpass", overpass)
+    app.router.add_get("/mapa", mapa)
+    app.router.add_post("/rotas", rotas)
+    return app
+
+
+def _servir(latencias, fila):
+    async def subir():
+        runner = web.AppRunner(servidor(latencias), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0, backlog=1024)
+        await site.start()
+        fila.put(site._server.sockets[0].getsockname()[1])
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(subir())
+    loop.run_forever()
+
+
+def iniciar_servidor(latencias):
+    """
+    Sobe os upstreams falsos em outro processo, para nao disputar o GIL com a tool medida
+    """
+    fila = multiprocessing.Queue()
+    multiprocessing.Process(target=_servir, args=(latencias, fila), daemon=True).start()
+    return f"http://127.0.0.1:{fila.get(timeout=30)}"
+
+
+def semear_ceps(n, sementes):
+    # Um CEP por conversa, cada um em uma celula diferente do cache do Overpass
+    ceps = []
+    for i in range(n):
+        cep = f"{sementes + i:08d}"
+        CEP_CACHE.set(cep, {"cidade": f"Origem {cep}", "uf": "SP",
+                            "lat": -20.0 - (sementes + i) * 0.11, "lng": -44.0 - (sementes + i) * 0.07})
+        ceps.append(cep)
+    return ceps
+
+
+def rodar(motor_async, ceps, concorrencia):
+    FilterNearbyCities.ASYNC_ENGINE = motor_async
+    latencias = []
+    pico_threads = threading.active_count()
+    parar = threading.Event()
+
+    def amostrar_threads():
+        nonlocal pico_threads
+        while not parar.is_set():
+            pico_threads = max(pico_threads, threading.active_count())
+            time.sleep(0.005)
+
+    def conversa(cep):
+        contexto = Context(credentials={"places_apikey": "x", "test_apikey": "y"}, parameters={"cep": cep},
+                           globals={}, contact={}, project={}, constants={})
+        inicio = time.perf_counter()
+        resposta = FilterNearbyCities(contexto)
+        latencias.append(time.perf_counter() - inicio)
+        return resposta
+
+    amostrador = threading.Thread(target=amostrar_threads, daemon=True)
+    amostrador.start()
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as pool:
+        respostas = list(pool.map(conversa, ceps))
+    total = time.perf_counter() - inicio
+    parar.set()
+    amostrador.join()
+
+    # A Tool devolve (resultado, ...) com o payload em resultado["result"]
+    ok = sum(1 for r in respostas if isinstance(r[0].get("result"), dict))
+    latencias.sort()
+    return {
+        "vazao": len(ceps) / total,
+        "p50": statistics.median(latencias),
+        "p95": latencias[int(0.95 * (len(latencias) - 1))],
+        "threads": pico_threads,
+        "ok": ok,
+    }
+
+
+def main_bench(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversas", type=int, default=200)
+    parser.add_argument("--concorrencia", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--latencia-overpass", type=float, default=0.3)
+    parser.add_argument("--latencia-mapa", type=float, default=0.2)
+    parser.add_argument("--latencia-rotas", type=float, default=0.1)
+    args = parser.parse_args(argv[1:])
+
+    base = iniciar_servidor({"overpass": args.latencia_overpass, "mapa": args.latencia_mapa,
+                             "rotas": args.latencia_rotas})
+    FilterNearbyCities.OVERPASS_ENDPOINTS = [f"{base}/overpass"]
+    FilterNearbyCities.MAPA_URL = f"{base}/mapa"
+    FilterNearbyCities.ROUTES_URL = f"{base}/rotas"
+    if not main.ASYNC_HTTP.disponivel():
+        print("aiohttp nao instalado: o motor asyncio nao pode ser medido")
+        return 1
+
+    print(f"{args.conversas} conversas; latencias overpass={args.latencia_overpass}s "
+          f"mapa={args.latencia_mapa}s rotas={args.latencia_rotas}s")
+    print(f"{'C':>4} {'motor':>8} {'conv/s':>8} {'p50 (s)':>8} {'p95 (s)':>8} {'threads':>8} {'ok':>5}")
+    sementes = 1
+    for concorrencia in args.concorrencia:
+        for motor_async in (False, True):
+            ceps = semear_ceps(args.conversas, sementes)
+            sementes += args.conversas
+            r = rodar(motor_async, ceps, concorrencia)
+            print(f"{concorrencia:>4} {'asyncio' if motor_async else 'threads':>8} {r['vazao']:>8.1f} "
+                  f"{r['p50']:>8.3f} {r['p95']:>8.3f} {r['threads']:>8} {r['ok']:>5}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_bench(sys.argv))
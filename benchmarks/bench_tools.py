@@ -0,0 +1,219 @@
+"""
+Benchmark offline das tres tools (buscar_cidades_proximas, get_mental_health_services
+e calcular_distancias_carro) contra os upstreams locais de benchmarks/upstreams.py,
+sem chamar os servicos pagos ou com limite de uso.
+
+Cada tool roda em um processo proprio (os modulos das tools tem os mesmos nomes),
+com cache persistente vazio em um diretorio temporario, em duas fases:
+
+- frio: cada CEP das fixtures uma vez, com os caches vazios;
+- quente: N invocacoes com CEPs sorteados pelos pesos das fixtures (capitais
+  mais frequentes), com os caches ja aquecidos pela fase fria.
+
+Para cada fase o relatorio traz vazao (invocacoes/s), latencia p50/p95/p99,
+respostas de sucesso, tamanho medio da resposta (bytes do JSON em UTF-8, ou do
+texto), chamadas a cada upstream por invocacao (contadas no servidor, incluindo
+retentativas e hedging) e chamadas recusadas pelos circuit breakers. --compacto
+liga RESPOSTA_COMPACTA nas tools que tem o formato compacto, para comparar o
+tamanho das respostas com o formato padrao. calcular_distancias_carro recebe os servicos da cidade do CEP (ate
+--destinos) no formato de string usado pelo agente. --json grava os numeros
+para comparar execucoes.
+
+Uso:
+    python benchmarks/bench_tools.py [--tools fnc gmhs cdd] [--invocacoes N] [--concorrencia C]
+        [--latencia UPSTREAM=S ...] [--jitter F] [--erro UPSTREAM=TAXA ...] [--status-erro CODIGO]
+        [--motor asyncio|threads] [--destinos N] [--compacto] [--semente S] [--json ARQUIVO]
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import upstreams
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TOOLS = {
+    "fnc": ("location_analyzer/tools/filter_nearby_cities", "FilterNearbyCities"),
+    "gmhs": ("get_services/tools/get_mental_health_services", "GetMentalHealthServices"),
+    "cdd": ("get_services/tools/calculate_driving_distance", "CalculateDrivingDistance"),
+}
+
+CREDENCIAIS = {"places_apikey": "bench", "test_apikey": "bench"}
+
+
+def configurar(classe, urls):
+    # Aponta as URLs upstream da tool (atributos de classe) para os upstreams locais
+    valores = {
+        "VIACEP_URL": urls["viacep"] + "/ws/{cep}/json/",
+        "GEOCODE_URL": urls["geocode"] + "/maps/api/geocode/json",
+        "ROUTES_URL": urls["routes"] + "/directions/v2:computeRoutes",
+        "MATRIX_URL": urls["routes"] + "/distanceMatrix/v2:computeRouteMatrix",
+        "MAPA_URL": urls["mapa"] + "/wp-json/latlng/v1/latlng-results",
+        "BASE_URL": urls["mapa"] + "/wp-json/latlng/v1/latlng-results",
+        "OVERPASS_ENDPOINTS": [url + "/api/interpreter" for url in urls["overpass"]],
+    }
+    for atributo, valor in valores.items():
+        if hasattr(classe, atributo):
+            setattr(classe, atributo, valor)
+
+
+def estabelecimentos(fixtures, cep, limite):
+    # Servicos da cidade do CEP (ou da primeira cidade com servicos, para CEPs inexistentes) no formato do agente
+    dados = fixtures["viacep"].get(cep, {})
+    chave = f"{dados.get('uf', '').lower()}/{upstreams.normalizar(dados.get('localidade', ''))}"
+    servicos = fixtures["mapa"].get(chave) or next(lista for lista in fixtures["mapa"].values() if lista)
+    return "[" + ", ".join(
+        f"{{name={s['name']}, lat={s['lat']}, lng={s['long']}}}" for s in servicos[:limite]
+    ) + "]"
+
+
+def sucesso(nome, payload):
+    if nome == "cdd":
+        return isinstance(payload, str) and payload.startswith("Distancias de carro")
+    return isinstance(payload, dict) and payload.get("status") == "success"
+
+
+def tamanho(payload):
+    texto = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+    return len(texto.encode("utf-8"))
+
+
+def percentil(valores, q):
+    return valores[max(0, math.ceil(q * len(valores)) - 1)]
+
+
+def _medir_tool(nome, urls, args, fila):
+    # Processo filho: cache vazio, modulos da tool no sys.path e as duas fases medidas
+    os.environ["VITA_ALERE_CACHE_DIR"] = tempfile.mkdtemp(prefix=f"bench_tools_{nome}_")
+    os.environ["VITA_ALERE_TRACE_LOG"] = "0"
+    pasta, classe_nome = TOOLS[nome]
+    sys.path.insert(0, os.path.join(RAIZ, pasta))
+
+    import main
+    from circuit_breaker import DISJUNTORES
+
+    classe = getattr(main, classe_nome)
+    configurar(classe, urls)
+    if hasattr(classe, "ASYNC_ENGINE"):
+        classe.ASYNC_ENGINE = args.motor == "asyncio"
+    if hasattr(classe, "RESPOSTA_COMPACTA"):
+        classe.RESPOSTA_COMPACTA = args.compacto
+
+    fixtures = upstreams.carregar_fixtures()
+    sorteio = random.Random(args.semente)
+    ceps = [entrada["cep"] for entrada in fixtures["ceps"]]
+    pesos = [entrada["peso"] for entrada in fixtures["ceps"]]
+    fases = [("frio", ceps), ("quente", sorteio.choices(ceps, weights=pesos, k=args.invocacoes))]
+
+    def invocar(cep):
+        parametros = {"cep": cep}
+        if nome == "cdd":
+            parametros["establishments"] = estabelecimentos(fixtures, cep, args.destinos)
+        contexto = main.Context(credentials=CREDENCIAIS, parameters=parametros, globals={}, contact={},
+                                project={}, constants={})
+        inicio = time.perf_counter()
+        resposta = classe(contexto)
+        # A Tool devolve (resultado, ...) com o payload em resultado["result"]
+        payload = resposta[0].get("result")
+        return time.perf_counter() - inicio, sucesso(nome, payload), tamanho(payload)
+
+    def rejeitadas():
+        return sum(breaker["rejeitadas"] for breaker in DISJUNTORES.snapshot().values())
+
+    linhas = []
+    for fase, lista in fases:
+        antes, rejeitadas_antes = upstreams.contagem(urls), rejeitadas()
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concorrencia) as pool:
+            medidas = list(pool.map(invocar, lista))
+        total = time.perf_counter() - inicio
+        depois = upstreams.contagem(urls)
+
+        latencias = sorted(latencia for latencia, _, _ in medidas)
+        linhas.append({
+            "tool": nome,
+            "fase": fase,
+            "invocacoes": len(lista),
+            "vazao": len(lista) / total,
+            "p50": percentil(latencias, 0.50),
+            "p95": percentil(latencias, 0.95),
+            "p99": percentil(latencias, 0.99),
+            "ok": sum(1 for _, ok, _ in medidas if ok),
+            "bytes": sum(bytes_ for _, _, bytes_ in medidas) / len(medidas),
+            "chamadas": {
+                upstream: (depois[upstream]["chamadas"] - antes[upstream]["chamadas"]) / len(lista)
+                for upstream in upstreams.UPSTREAMS
+            },
+            "erros_injetados": sum(depois[u]["erros"] - antes[u]["erros"] for u in upstreams.UPSTREAMS),
+            "rejeitadas": rejeitadas() - rejeitadas_antes,
+        })
+    fila.put(linhas)
+
+
+def pares(valores, tipo):
+    resultado = {}
+    for valor in valores or []:
+        nome, _, numero = valor.partition("=")
+        if nome not in upstreams.UPSTREAMS or not numero:
+            raise argparse.ArgumentTypeError(f"esperado UPSTREAM=valor com UPSTREAM em {', '.join(upstreams.UPSTREAMS)}")
+        resultado[nome] = tipo(numero)
+    return resultado
+
+
+def main_bench(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tools", nargs="+", choices=sorted(TOOLS), default=["fnc", "gmhs", "cdd"])
+    parser.add_argument("--invocacoes", type=int, default=100)
+    parser.add_argument("--concorrencia", type=int, default=8)
+    parser.add_argument("--latencia", nargs="+", metavar="UPSTREAM=S",
+                        help="latencia mediana por upstream (padrao: %s)" % " ".join(
+                            f"{k}={v}" for k, v in upstreams.LATENCIAS_PADRAO.items()))
+    parser.add_argument("--jitter", type=float, default=0.3, help="sigma do fator lognormal da latencia")
+    parser.add_argument("--erro", nargs="+", metavar="UPSTREAM=TAXA", help="fracao de respostas com --status-erro")
+    parser.add_argument("--status-erro", type=int, default=503)
+    parser.add_argument("--motor", choices=["asyncio", "threads"], default="asyncio")
+    parser.add_argument("--destinos", type=int, default=10)
+    parser.add_argument("--compacto", action="store_true", help="respostas no formato compacto (RESPOSTA_COMPACTA)")
+    parser.add_argument("--semente", type=int, default=19)
+    parser.add_argument("--json", metavar="ARQUIVO")
+    args = parser.parse_args(argv[1:])
+    try:
+        latencias, erros = pares(args.latencia, float), pares(args.erro, float)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    urls = upstreams.iniciar(latencias, jitter=args.jitter, erros=erros, status_erro=args.status_erro,
+                             semente=args.semente)
+    print(f"concorrencia={args.concorrencia} invocacoes={args.invocacoes} motor={args.motor} jitter={args.jitter} "
+          f"erros={erros or '-'} compacto={args.compacto}")
+    print(f"{'tool':>5} {'fase':>7} {'inv':>5} {'inv/s':>7} {'p50 (s)':>8} {'p95 (s)':>8} {'p99 (s)':>8} {'ok':>5} {'bytes':>7} "
+          + " ".join(f"{u:>8}" for u in upstreams.UPSTREAMS) + f" {'recusas':>8}")
+    resultados = []
+    for nome in args.tools:
+        fila = multiprocessing.Queue()
+        processo = multiprocessing.Process(target=_medir_tool, args=(nome, urls, args, fila))
+        processo.start()
+        linhas = fila.get()
+        processo.join()
+        for r in linhas:
+            print(f"{r['tool']:>5} {r['fase']:>7} {r['invocacoes']:>5} {r['vazao']:>7.1f} {r['p50']:>8.3f} "
+                  f"{r['p95']:>8.3f} {r['p99']:>8.3f} {r['ok']:>5} {r['bytes']:>7.0f} "
+                  + " ".join(f"{r['chamadas'][u]:>8.2f}" for u in upstreams.UPSTREAMS) + f" {r['rejeitadas']:>8}")
+        resultados.extend(linhas)
+
+    print("(colunas de upstream: chamadas por invocacao)")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"parametros": vars(args), "resultados": resultados}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_bench(sys.argv))
@@ -0,0 +1,215 @@
+"""
+Upstreams locais para os benchmarks: imitam ViaCEP, Google Geocode, Google Routes
+(computeRoutes e computeRouteMatrix), Overpass e Mapa da Saude Mental a partir
+das fixtures em benchmarks/fixtures/upstreams.json, no formato das respostas reais.
+
+- ViaCEP responde os CEPs das fixtures ({"erro": true} para os demais).
+- Geocode e Overpass respondem a partir da tabela de municipios (centroide e
+  populacao); o Overpass devolve os municipios dentro do raio do `around` da query.
+- Mapa da Saude Mental devolve os servicos da cidade, filtrados por tipo e formato.
+- Routes calcula a rota a partir das coordenadas: distancia em linha reta vezes
+  FATOR_ROTA, a VELOCIDADE_KMH.
+
+Cada upstream escuta em uma porta propria (e cada mirror do Overpass tambem),
+pois os circuit breakers e os pools de conexao das tools sao por host. Cada
+resposta espera `latencias[nome] * lognormal(0, jitter)` segundos (a mediana fica
+na latencia configurada e o jitter alonga a cauda) e, com probabilidade
+`erros[nome]`, responde HTTP `status_erro` no lugar do conteudo. GET /_contagem
+em qualquer porta devolve as chamadas e os erros injetados por upstream.
+
+Os nomes aceitos em latencias/erros sao os de UPSTREAMS; rotas e matriz sao os
+dois endpoints do Routes.
+"""
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import unicodedata
+import urllib.request
+
+from aiohttp import web
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "upstreams.json")
+
+UPSTREAMS = ("viacep", "geocode", "overpass", "mapa", "rotas", "matriz")
+
+LATENCIAS_PADRAO = {"viacep": 0.08, "geocode": 0.12, "overpass": 1.5, "mapa": 0.6, "rotas": 0.25, "matriz": 0.4}
+
+FATOR_ROTA = 1.3
+VELOCIDADE_KMH = 40
+
+AROUND = re.compile(r"around:(\d+(?:\.\d+)?),\s*(-?\d+(?:\.\d+)?),\s*(-?\d+(?:\.\d+)?)")
+
+
+def normalizar(texto):
+    texto = unicodedata.normalize("NFKD", str(texto).replace("+", " ").strip().lower())
+    return " ".join("".join(ch for ch in texto if not unicodedata.combining(ch)).split())
+
+
+def distancia_km(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin(math.radians(lat2 - lat1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2)
+    return 2 * 6371 * math.asin(math.sqrt(a))
+
+
+def carregar_fixtures(path=FIXTURES):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def rota(origem, destino):
+    # (distanceMeters, duration) de um par de waypoints {"location": {"latLng": {...}}}
+    o, d = origem["location"]["latLng"], destino["location"]["latLng"]
+    metros = int(distancia_km(o["latitude"], o["longitude"], d["latitude"], d["longitude"]) * 1000 * FATOR_ROTA)
+    return metros, f"{int(metros / (VELOCIDADE_KMH / 3.6))}s"
+
+
+def aplicacao(fixtures, latencias, jitter=0.0, erros=None, status_erro=503, semente=None):
+    """
+    Aplicacao aiohttp com todos os upstreams (cada porta serve as mesmas rotas)
+    """
+    erros = erros or {}
+    sorteio = random.Random(semente)
+    contagem = {nome: {"chamadas": 0, "erros": 0} for nome in UPSTREAMS}
+    municipios = fixtures["municipios"]
+    por_nome = {(normalizar(m["nome"]), m["uf"]): m for m in municipios}
+
+    def upstream(nome):
+        def decorador(handler):
+            async def atender(request):
+                contagem[nome]["chamadas"] += 1
+                try:
+                    latencia = latencias.get(nome, 0.0)
+                    if latencia > 0:
+                        await asyncio.sleep(latencia * (sorteio.lognormvariate(0, jitter) if jitter else 1.0))
+                    if sorteio.random() < erros.get(nome, 0.0):
+                        contagem[nome]["erros"] += 1
+                        return web.json_response({"erro": "falha injetada"}, status=status_erro)
+                    return await handler(request)
+                except (ConnectionResetError, asyncio.CancelledError):
+                    # Cliente desistiu (perdedora do hedge, prazo esgotado): nada a responder nem a logar
+                    return web.Response(status=499)
+            return atender
+        return decorador
+
+    @upstream("viacep")
+    async def viacep(request):
+        return web.json_response(fixtures["viacep"].get(request.match_info["cep"], {"erro": True}))
+
+    @upstream("geocode")
+    async def geocode(request):
+        partes = [p.strip() for p in request.query.get("address", "").split(",")]
+        municipio = por_nome.get((normalizar(partes[0]), partes[1].upper())) if len(partes) >= 2 else None
+        if municipio is None:
+            return web.json_response({"results": [], "status": "ZERO_RESULTS"})
+        return web.json_response({"status": "OK", "results": [{
+            "formatted_address": f"{municipio['nome']} - {municipio['uf']}, Brasil",
+            "geometry": {"location": {"lat": municipio["lat"], "lng": municipio["lng"]},
+                         "location_type": "APPROXIMATE"},
+            "types": ["administrative_area_level_2", "political"],
+        }]})
+
+    @upstream("overpass")
+    async def overpass(request):
+        form = await request.post()
+        achado = AROUND.search(form.get("data", ""))
+        if not achado:
+            return web.Response(status=400, text="query sem around")
+        raio_km = float(achado.group(1)) / 1000
+        lat, lng = float(achado.group(2)), float(achado.group(3))
+        elementos = [
+            {"type": "relation", "id": 300000 + i,
+             "center": {"lat": m["lat"], "lon": m["lng"]},
+             "tags": {"name": m["nome"], "ISO3166-2": f"BR-{m['uf']}", "admin_level": "8",
+                      "boundary": "administrative", "population": str(m["populacao"])}}
+            for i, m in enumerate(municipios)
+            if distancia_km(lat, lng, m["lat"], m["lng"]) <= raio_km
+        ]
+        return web.json_response({"version": 0.6, "generator": "Overpass API (local)", "elements": elementos})
+
+    @upstream("mapa")
+    async def mapa(request):
+        chave = f"{request.query.get('estado', '').lower()}/{normalizar(request.query.get('cidade', ''))}"
+        locations = fixtures["mapa"].get(chave, [])
+        tipos = {normalizar(t) for t in request.query.get("tipo", "").split(",") if t.strip()}
+        formato = normalizar(request.query.get("formato", ""))
+        locations = [
+            loc for loc in locations
+            if (not tipos or normalizar(loc["tipo"]) in tipos) and (not formato or normalizar(loc["formato"]) == formato)
+        ]
+        if not locations:
+            return web.json_response({"status": "error", "message": "No locations found"})
+        return web.json_response({"status": "success", "locations": locations})
+
+    @upstream("rotas")
+    async def rotas(request):
+        corpo = await request.json()
+        metros, duracao = rota(corpo["origin"], corpo["destination"])
+        return web.json_response({"routes": [{"distanceMeters": metros, "duration": duracao,
+                                              "polyline": {"encodedPolyline": ""}}]})
+
+    @upstream("matriz")
+    async def matriz(request):
+        corpo = await request.json()
+        elementos = []
+        for i, origem in enumerate(corpo["origins"]):
+            for k, destino in enumerate(corpo["destinations"]):
+                metros, duracao = rota(origem["waypoint"], destino["waypoint"])
+                elementos.append({"originIndex": i, "destinationIndex": k, "status": {},
+                                  "condition": "ROUTE_EXISTS", "distanceMeters": metros, "duration": duracao})
+        return web.json_response(elementos)
+
+    async def ver_contagem(request):
+        return web.json_response(contagem)
+
+    app = web.Application()
+    app.router.add_get("/ws/{cep}/json/", viacep)
+    app.router.add_get("/maps/api/geocode/json", geocode)
+    app.router.add_post("/api/interpreter", overpass)
+    app.router.add_get("/wp-json/latlng/v1/latlng-results", mapa)
+    app.router.add_post("/directions/v2:computeRoutes", rotas)
+    app.router.add_post("/distanceMatrix/v2:computeRouteMatrix", matriz)
+    app.router.add_get("/_contagem", ver_contagem)
+    return app
+
+
+def _servir(config, hosts, fila):
+    async def subir():
+        runner = web.AppRunner(aplicacao(carregar_fixtures(config.pop("fixtures")), **config), access_log=None)
+        await runner.setup()
+        portas = []
+        for _ in range(hosts):
+            site = web.TCPSite(runner, "127.0.0.1", 0, backlog=1024)
+            await site.start()
+            portas.append(site._server.sockets[0].getsockname()[1])
+        fila.put(portas)
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(subir())
+    loop.run_forever()
+
+
+def iniciar(latencias=None, jitter=0.0, erros=None, status_erro=503, mirrors_overpass=2, semente=None,
+            fixtures=FIXTURES):
+    """
+    Sobe os upstreams em outro processo (para nao disputar o GIL com a tool medida) e
+    devolve as URLs base: {"viacep", "geocode", "routes", "mapa": url, "overpass": [url, ...]}
+    """
+    config = {"latencias": {**LATENCIAS_PADRAO, **(latencias or {})}, "jitter": jitter, "erros": erros,
+              "status_erro": status_erro, "semente": semente, "fixtures": fixtures}
+    fila = multiprocessing.Queue()
+    multiprocessing.Process(target=_servir, args=(config, 4 + mirrors_overpass, fila), daemon=True).start()
+    urls = [f"http://127.0.0.1:{porta}" for porta in fila.get(timeout=30)]
+    return {"viacep": urls[0], "geocode": urls[1], "routes": urls[2], "mapa": urls[3], "overpass": urls[4:]}
+
+
+def contagem(urls):
+    """
+    Chamadas e erros injetados por upstream desde que o servidor subiu
+    """
+    with urllib.request.urlopen(f"{urls['viacep']}/_contagem", timeout=10) as resposta:
+        return json.load(resposta)
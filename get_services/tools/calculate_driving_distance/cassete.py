@@ -0,0 +1,191 @@
+"""
+Gravacao e reproducao das respostas upstream (cassete), para rodar as tools e os
+test_definition.yaml sem rede, de forma deterministica.
+
+Com VITA_ALERE_CASSETE=<arquivo.json>, os clientes HTTP passam cada tentativa
+pela cassete:
+
+- VITA_ALERE_CASSETE_MODO=gravar: a chamada vai a rede e a resposta (status,
+  Content-Type, Retry-After e corpo) ou o erro de rede e gravado no arquivo;
+- reproduzir (padrao): nenhuma chamada vai a rede; as respostas gravadas sao
+  devolvidas na ordem em que foram gravadas para cada requisicao (a ultima se
+  repete) e requisicoes sem gravacao falham com GravacaoAusente.
+
+A requisicao e identificada pelo metodo, pela URL com a query ordenada (mais os
+`params`) e por um hash do corpo. O parametro `key` (chave do Google) fica de
+fora, e os headers nao sao gravados, entao a cassete nao guarda credenciais e
+a mesma gravacao serve com qualquer chave. Ao gravar, as requisicoes repetidas
+na sessao substituem a gravacao anterior e as demais entradas do arquivo sao
+mantidas.
+"""
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+CASSETE_ENV = "VITA_ALERE_CASSETE"
+MODO_ENV = "VITA_ALERE_CASSETE_MODO"
+
+GRAVAR = "gravar"
+REPRODUZIR = "reproduzir"
+
+# Parametros de query que nao identificam a requisicao (credencial)
+PARAMETROS_IGNORADOS = frozenset({"key"})
+HEADERS_GRAVADOS = ("Content-Type", "Retry-After")
+
+
+class GravacaoAusente(requests.exceptions.ConnectionError):
+    pass
+
+
+class RespostaGravada:
+    def __init__(self, status_code, headers, content, url):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.url = url
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+    def close(self):
+        pass
+
+
+class Cassete:
+    def __init__(self, path, modo=REPRODUZIR):
+        if modo not in (GRAVAR, REPRODUZIR):
+            raise ValueError(f"modo de cassete invalido: {modo}")
+        self.path = path
+        self.modo = modo
+        self.ausentes = []  # requisicoes sem gravacao na reproducao
+        self._posicao = {}
+        self._gravadas = set()
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                self._interacoes = json.load(f).get("interacoes", {})
+        except FileNotFoundError:
+            if modo == REPRODUZIR:
+                raise
+            self._interacoes = {}
+
+    @property
+    def reproduzindo(self):
+        return self.modo == REPRODUZIR
+
+    def chave(self, method, url, params=None, data=None, json=None, **_):
+        partes = urlsplit(url)
+        query = parse_qsl(partes.query, keep_blank_values=True)
+        if params:
+            query += list(params.items()) if isinstance(params, dict) else list(params)
+        query = sorted((k, str(v)) for k, v in query if k not in PARAMETROS_IGNORADOS)
+        chave = f"{method.upper()} {urlunsplit((partes.scheme, partes.netloc, partes.path, urlencode(query), ''))}"
+
+        if json is not None:
+            corpo = _json_canonico(json)
+        elif isinstance(data, dict):
+            corpo = urlencode(sorted((k, str(v)) for k, v in data.items()))
+        else:
+            corpo = data
+        if corpo:
+            corpo = corpo.encode("utf-8") if isinstance(corpo, str) else corpo
+            chave += " " + hashlib.sha1(corpo).hexdigest()[:12]
+        return chave
+
+    def proxima(self, method, url, **kwargs):
+        """
+        A proxima interacao gravada para a requisicao ({"status", "headers", "corpo"} ou {"erro", "mensagem"});
+        lanca GravacaoAusente se nao ha gravacao
+        """
+        chave = self.chave(method, url, **kwargs)
+        with self._lock:
+            gravadas = self._interacoes.get(chave)
+            if not gravadas:
+                self.ausentes.append(chave)
+                raise GravacaoAusente(f"sem gravacao na cassete para {chave}")
+            posicao = self._posicao.get(chave, 0)
+            self._posicao[chave] = posicao + 1
+            return gravadas[min(posicao, len(gravadas) - 1)]
+
+    def reproduzir(self, method, url, **kwargs):
+        """
+        Resposta gravada (RespostaGravada) para a requisicao, ou o erro de rede gravado
+        """
+        interacao = self.proxima(method, url, **kwargs)
+        if "erro" in interacao:
+            erro = getattr(requests.exceptions, interacao["erro"], requests.exceptions.ConnectionError)
+            raise erro(interacao.get("mensagem", ""))
+        return RespostaGravada(interacao["status"], interacao.get("headers", {}), corpo(interacao), url)
+
+    def gravar(self, method, url, resposta, **kwargs):
+        """
+        Grava a resposta (qualquer objeto com status_code, headers e content)
+        """
+        interacao = {"status": resposta.status_code,
+                     "headers": {h: resposta.headers[h] for h in HEADERS_GRAVADOS if h in resposta.headers}}
+        try:
+            interacao["corpo"] = resposta.content.decode("utf-8")
+        except UnicodeDecodeError:
+            interacao["corpo_base64"] = base64.b64encode(resposta.content).decode("ascii")
+        self._acrescentar(self.chave(method, url, **kwargs), interacao)
+
+    def gravar_erro(self, method, url, erro, **kwargs):
+        # Erro de rede (classe de requests.exceptions), reproduzido como a mesma excecao
+        self._acrescentar(self.chave(method, url, **kwargs), {"erro": type(erro).__name__, "mensagem": str(erro)})
+
+    def _acrescentar(self, chave, interacao):
+        with self._lock:
+            if chave not in self._gravadas:
+                self._gravadas.add(chave)
+                self._interacoes[chave] = []
+            self._interacoes[chave].append(interacao)
+            self._salvar()
+
+    def _salvar(self):
+        # Escrita atomica: um arquivo temporario no mesmo diretorio substitui o anterior
+        diretorio = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(diretorio, exist_ok=True)
+        fd, temporario = tempfile.mkstemp(dir=diretorio, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"versao": 1, "interacoes": dict(sorted(self._interacoes.items()))}, f,
+                      ensure_ascii=False, indent=1)
+            f.write("\n")
+        os.replace(temporario, self.path)
+
+
+def corpo(interacao):
+    if "corpo_base64" in interacao:
+        return base64.b64decode(interacao["corpo_base64"])
+    return interacao.get("corpo", "").encode("utf-8")
+
+
+def _json_canonico(valor):
+    return json.dumps(valor, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+def cassete_do_ambiente():
+    """
+    Cassete configurada por VITA_ALERE_CASSETE / VITA_ALERE_CASSETE_MODO, ou None
+    """
+    path = os.environ.get(CASSETE_ENV)
+    if not path:
+        return None
+    return Cassete(path, os.environ.get(MODO_ENV) or REPRODUZIR)
+
+
+CASSETE = cassete_do_ambiente()
@@ -0,0 +1,157 @@
+"""
+Circuit breakers por host upstream (ViaCEP, Google Geocode, Google Routes,
+cada mirror do Overpass, Mapa Saude Mental), compartilhados pelas execucoes
+do mesmo worker. Chamadas com chave de API do Google (query `key` ou header
+X-Goog-Api-Key) tem um breaker por host e chave: 403 e 429 do Google dizem
+respeito a chave (invalida, sem permissao ou sem cota), entao uma chave ruim
+abre apenas o proprio circuito, sem derrubar o host para os outros projetos.
+
+Cada host tem uma janela com o resultado das ultimas chamadas. O circuito
+abre quando, com pelo menos `min_chamadas` na janela, a taxa de falhas (erros
+de rede, timeouts e respostas em STATUS_FALHA) passa de `taxa_erro`, ou a taxa
+de chamadas lentas (acima de `lenta` segundos) passa de `taxa_lenta`. Aberto,
+as chamadas falham na hora com CircuitoAberto, sem ir a rede, e as tools caem
+nos seus fallbacks (proximo mirror, cache vencido, snapshot, mensagem de erro).
+Depois de `abertura` segundos o circuito fica meio-aberto: uma chamada de
+teste passa por vez; sucesso fecha o circuito, falha o reabre. As mudancas de
+estado sao registradas no log.
+
+O http_client e o async_http consultam DISJUNTORES em cada tentativa.
+"""
+import hashlib
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+
+# Respostas que contam como falha do host (ou da chave, no Google): limite/credencial recusados e erros do servidor
+STATUS_FALHA = frozenset({403, 429, 500, 502, 503, 504})
+
+FECHADO = "fechado"
+ABERTO = "aberto"
+MEIO_ABERTO = "meio-aberto"
+
+
+class CircuitoAberto(requests.exceptions.RequestException):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, nome, janela=20, min_chamadas=10, taxa_erro=0.5, lenta=8.0, taxa_lenta=0.8,
+                 abertura=30.0):
+        self.nome = nome
+        self.min_chamadas = min_chamadas
+        self.taxa_erro = taxa_erro
+        self.lenta = lenta
+        self.taxa_lenta = taxa_lenta
+        self.abertura = abertura
+        self.estado = FECHADO
+        self.aberto_em = 0.0
+        self.rejeitadas = 0
+        self._janela = deque(maxlen=janela)  # (sucesso, lenta) das ultimas chamadas
+        self._sondando = False
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        """
+        Libera uma chamada ou lanca CircuitoAberto; no meio-aberto, libera uma chamada de teste por vez
+        """
+        with self._lock:
+            if self.estado == ABERTO and time.monotonic() - self.aberto_em >= self.abertura:
+                self._mudar(MEIO_ABERTO, "tempo de abertura encerrado")
+            if self.estado == FECHADO or (self.estado == MEIO_ABERTO and not self._sondando):
+                self._sondando = self.estado == MEIO_ABERTO
+                return
+            self.rejeitadas += 1
+        raise CircuitoAberto(f"circuito aberto para {self.nome}")
+
+    def registrar(self, sucesso, latencia):
+        lenta = latencia > self.lenta
+        with self._lock:
+            if self.estado == MEIO_ABERTO:
+                if not self._sondando:
+                    return
+                self._sondando = False
+                if sucesso and not lenta:
+                    self._janela.clear()
+                    self._mudar(FECHADO, f"chamada de teste ok em {latencia:.2f}s")
+                else:
+                    self._abrir("chamada de teste " + ("lenta" if sucesso else "falhou"))
+                return
+            if self.estado != FECHADO:
+                return
+
+            self._janela.append((sucesso, lenta))
+            if len(self._janela) < self.min_chamadas:
+                return
+            erros = sum(1 for ok, _ in self._janela if not ok) / len(self._janela)
+            lentas = sum(1 for _, devagar in self._janela if devagar) / len(self._janela)
+            if erros >= self.taxa_erro or lentas >= self.taxa_lenta:
+                self._abrir(f"erros={erros:.0%} lentas={lentas:.0%} em {len(self._janela)} chamadas")
+
+    def descartar(self):
+        # Chamada interrompida sem resultado (ex.: cancelada): libera a vaga de teste sem contar
+        with self._lock:
+            if self.estado == MEIO_ABERTO:
+                self._sondando = False
+
+    def _abrir(self, motivo):
+        self.aberto_em = time.monotonic()
+        self._janela.clear()
+        self._mudar(ABERTO, motivo)
+
+    def _mudar(self, estado, motivo):
+        print(f"[CircuitBreaker] {self.nome}: {self.estado} -> {estado} ({motivo})")
+        self.estado = estado
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "estado": self.estado,
+                "chamadas": len(self._janela),
+                "falhas": sum(1 for ok, _ in self._janela if not ok),
+                "lentas": sum(1 for _, devagar in self._janela if devagar),
+                "rejeitadas": self.rejeitadas,
+            }
+
+
+def chave_api(params=None, headers=None):
+    """
+    Chave de API do Google enviada na chamada (query `key` ou header X-Goog-Api-Key), ou None
+    """
+    chave = params.get("key") if isinstance(params, dict) else None
+    if not chave and headers:
+        chave = next((valor for nome, valor in headers.items() if nome.lower() == "x-goog-api-key"), None)
+    return chave or None
+
+
+class Disjuntores:
+    """
+    Um CircuitBreaker por host (e por chave de API, quando informada), criado na primeira chamada;
+    `config` vale para todos
+    """
+    def __init__(self, **config):
+        self.config = config
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def para(self, url, chave=None):
+        nome = urlsplit(url).netloc.lower()
+        if chave:
+            # So um resumo da chave no nome (que aparece no log)
+            nome += "#" + hashlib.sha256(chave.encode()).hexdigest()[:8]
+        breaker = self._breakers.get(nome)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(nome, CircuitBreaker(nome, **self.config))
+        return breaker
+
+    def snapshot(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {host: breaker.snapshot() for host, breaker in breakers.items()}
+
+
+DISJUNTORES = Disjuntores()
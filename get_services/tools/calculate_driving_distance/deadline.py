@@ -0,0 +1,54 @@
+"""
+Prazo total de uma execucao de tool, repassado a todas as etapas.
+
+execute() cria um Deadline com o orcamento da tool e cada etapa usa o tempo
+que sobrou: as chamadas HTTP limitam seus timeouts (e as retentativas) ao
+restante do prazo, e as etapas com trabalho em paralelo param de esperar
+quando ele acaba, cancelando o que ainda nao comecou e devolvendo o que ja
+terminou. Esgotado o prazo, limitar() lanca PrazoEsgotado, subclasse de
+requests.exceptions.Timeout, entao os tratamentos de timeout existentes
+continuam valendo.
+"""
+import time
+
+import requests
+
+
+class PrazoEsgotado(requests.exceptions.Timeout):
+    pass
+
+
+class Deadline:
+    def __init__(self, segundos=None):
+        # segundos=None: sem prazo (chamadas fora de execute(), scripts e benchmarks)
+        self.fim = None if segundos is None else time.monotonic() + segundos
+
+    def restante(self):
+        """
+        Segundos ate o fim do prazo (0 quando esgotado), ou None se nao ha prazo
+        """
+        if self.fim is None:
+            return None
+        return max(0.0, self.fim - time.monotonic())
+
+    def expirado(self):
+        return self.fim is not None and time.monotonic() >= self.fim
+
+    def limitar(self, timeout=None):
+        """
+        O menor entre timeout e o tempo restante; lanca PrazoEsgotado se o prazo acabou
+        """
+        restante = self.restante()
+        if restante is None:
+            return timeout
+        if restante <= 0:
+            raise PrazoEsgotado("prazo da execucao esgotado")
+        return restante if timeout is None else min(timeout, restante)
+
+    def cabe(self, segundos):
+        # Se ainda ha tempo para esperar `segundos` (ex.: backoff) e tentar de novo
+        restante = self.restante()
+        return restante is None or segundos < restante
+
+
+SEM_PRAZO = Deadline()
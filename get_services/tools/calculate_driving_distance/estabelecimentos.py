@@ -0,0 +1,127 @@
+"""
+Leitura da lista de estabelecimentos no formato chave=valor usado pelo agente:
+
+    [{name=CAPS Conselheiro Lafaiete, lat=-20.672687, lng=-43.80858}, ...]
+
+Uma unica passada pelo texto, em tempo linear: o valor de um campo vai ate o
+proximo `, chave=` ou ate o `}` que fecha o objeto (seguido de `, {`, `]` ou do
+fim do texto). Assim nomes podem ter virgulas, chaves e `=`; dentro de `name`,
+`, lat=` e `, lng=` so abrem um novo campo quando seguidos de um numero. Os
+valores ficam como texto (sem espacos nas pontas), campos extras sao mantidos e
+`long`/`lon` viram `lng`. Texto mal formado levanta ErroFormato com a posicao
+exata do problema.
+"""
+import re
+
+# Nomes alternativos dos campos, convertidos para o nome usado pela tool
+ALIASES = {"long": "lng", "lon": "lng"}
+COORDENADAS = frozenset({"lat", "lng", "long", "lon"})
+
+_ESPACOS = re.compile(r"\s*")
+_CHAVE = re.compile(r"([A-Za-z_][A-Za-z0-9_]*)\s*=")
+# Em uma virgula: o inicio do proximo campo
+_SEPARADOR = re.compile(r",\s*([A-Za-z_][A-Za-z0-9_]*)\s*=")
+# Em um '}': so fecha o objeto se vier outro objeto, o fim da lista ou o fim do texto
+_FIM_OBJETO = re.compile(r"\}\s*(?:,\s*\{|\]|$)")
+_NUMERO = re.compile(r"\s*[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?\s*[,}]")
+_DELIMITADOR = re.compile(r"[,}]")
+
+
+class ErroFormato(ValueError):
+    def __init__(self, motivo, texto, posicao):
+        self.motivo = motivo
+        self.posicao = posicao
+        trecho = texto[max(0, posicao - 15):posicao + 15]
+        super().__init__(f"{motivo} na posicao {posicao} (perto de {trecho!r})")
+
+
+def normalizar_campos(estabelecimento):
+    """
+    Copia do estabelecimento com os aliases (long, lon) trocados pelo nome do campo (lng)
+    """
+    return {ALIASES.get(chave, chave): valor for chave, valor in estabelecimento.items()}
+
+
+def interpretar(texto):
+    """
+    Lista de dicts a partir do texto chave=valor; os colchetes externos sao opcionais
+    """
+    n = len(texto)
+    pos = _ESPACOS.match(texto, 0).end()
+    em_lista = pos < n and texto[pos] == "["
+    if em_lista:
+        pos = _ESPACOS.match(texto, pos + 1).end()
+
+    estabelecimentos = []
+    if not (em_lista and pos < n and texto[pos] == "]"):
+        while True:
+            if pos >= n or texto[pos] != "{":
+                raise ErroFormato("esperado '{' no inicio do estabelecimento", texto, pos)
+            estabelecimento, pos = _objeto(texto, pos + 1)
+            estabelecimentos.append(estabelecimento)
+            pos = _ESPACOS.match(texto, pos).end()
+            if pos < n and texto[pos] == ",":
+                pos = _ESPACOS.match(texto, pos + 1).end()
+                continue
+            break
+
+    if em_lista:
+        if pos >= n or texto[pos] != "]":
+            raise ErroFormato("esperado ']' no fim da lista", texto, pos)
+        pos += 1
+    pos = _ESPACOS.match(texto, pos).end()
+    if pos != n:
+        raise ErroFormato("conteudo inesperado apos a lista", texto, pos)
+    return estabelecimentos
+
+
+def _objeto(texto, pos):
+    """
+    Campos de um objeto a partir de pos (logo apos o '{'); retorna (dict, posicao apos o '}')
+    """
+    abertura = pos - 1
+    estabelecimento = {}
+    pos = _ESPACOS.match(texto, pos).end()
+    if _FIM_OBJETO.match(texto, pos):
+        return estabelecimento, pos + 1
+
+    chave = _CHAVE.match(texto, pos)
+    if not chave:
+        raise ErroFormato("esperado chave=valor", texto, pos)
+    campo, posicao_campo, inicio = chave.group(1), pos, chave.end()
+    busca = inicio
+    # Ultimo '}' que nao fechou o objeto (parte do valor, ou um fecho seguido de algo invalido)
+    ultimo_fecho = None
+    while True:
+        delimitador = _DELIMITADOR.search(texto, busca)
+        if delimitador is None:
+            if ultimo_fecho is None:
+                raise ErroFormato(f"fim do texto sem o '}}' do estabelecimento aberto na posicao {abertura}",
+                                  texto, len(texto))
+            # O objeto fecha no ultimo '}'; interpretar aponta o erro no que vem depois dele
+            # (ex.: "[{name=Foo}, bar]" ou a virgula sobrando em "[{name=Foo},]")
+            _guardar(estabelecimento, campo, texto[inicio:ultimo_fecho].strip(), texto, posicao_campo)
+            return estabelecimento, ultimo_fecho + 1
+        p = delimitador.start()
+        if texto[p] == "}":
+            if _FIM_OBJETO.match(texto, p):
+                _guardar(estabelecimento, campo, texto[inicio:p].strip(), texto, posicao_campo)
+                return estabelecimento, p + 1
+            ultimo_fecho = p
+        else:
+            proximo = _SEPARADOR.match(texto, p)
+            if proximo and (campo != "name" or proximo.group(1) not in COORDENADAS
+                            or _NUMERO.match(texto, proximo.end())):
+                _guardar(estabelecimento, campo, texto[inicio:p].strip(), texto, posicao_campo)
+                campo, posicao_campo, inicio = proximo.group(1), proximo.start(1), proximo.end()
+                busca = inicio
+                ultimo_fecho = None
+                continue
+        busca = p + 1
+
+
+def _guardar(estabelecimento, campo, valor, texto, posicao):
+    campo = ALIASES.get(campo, campo)
+    if campo in estabelecimento:
+        raise ErroFormato(f"campo '{campo}' repetido", texto, posicao)
+    estabelecimento[campo] = valor
@@ -3,11 +3,48 @@ from weni.context import Context
 from weni.responses import TextResponse
 import requests
 import json
+import math
 import re
 
+from cep_index import buscar_municipio
+from deadline import SEM_PRAZO, Deadline
+from disk_cache import DiskCache
+from estabelecimentos import ErroFormato, interpretar, normalizar_campos
+from gazetteer import coordenadas_municipio
+from http_client import HTTP_CLIENT
+from route_cache import ROUTE_CACHE
+from tracing import SEM_TRACE, Trace, anotar, medir, registrar_falha
+
+# Cache CEP -> (cidade, uf, lat, lng) compartilhado com a tool buscar_cidades_proximas
+CEP_CACHE = DiskCache("cep", ttl=30 * 24 * 3600, max_entries=50000)
 
 class CalculateDrivingDistance(Tool):
+    MATRIX_URL = "https://routes.googleapis.com/distanceMatrix/v2:computeRouteMatrix"
+    ROUTES_URL = "https://routes.googleapis.com/directions/v2:computeRoutes"
+    VIACEP_URL = "https://viacep.com.br/ws/{cep}/json/"
+    GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+    # Usa computeRouteMatrix (uma requisicao por lote) em vez de um computeRoutes por estabelecimento
+    MATRIX_MODE = True
+    # Limite de elementos (origens x destinos) por requisicao de matriz na Routes API
+    MATRIX_MAX_ELEMENTS = 625
+    # Rotas reais por execucao: so os ROTAS_MAX destinos mais proximos em linha reta (rotas ja em cache
+    # nao contam); os demais recebem uma estimativa, a linha reta vezes FATOR_DESVIO a
+    # VELOCIDADE_ESTIMADA_KMH. None calcula a rota de todos
+    ROTAS_MAX = 10
+    FATOR_DESVIO = 1.3
+    VELOCIDADE_ESTIMADA_KMH = 50
+    # Orcamento total de uma execucao; destinos sem rota quando ele acaba saem como falha de timeout
+    PRAZO_SEGUNDOS = 20
+    # Prazo da execucao atual (criado em execute); metodos chamados fora dela nao tem prazo
+    prazo = SEM_PRAZO
+    # Spans da execucao atual (tracing); a linha de log JSON sai sempre, o resumo na resposta so com esta flag
+    TIMING_NA_RESPOSTA = False
+    trace = SEM_TRACE
+
     def execute(self, context: Context) -> TextResponse:
+        self.prazo = Deadline(self.PRAZO_SEGUNDOS)
+        self.trace = Trace("CalculateDrivingDistance")
+
         # Obter parametros
         establishments_raw = context.parameters.get("establishments", [])
         api_key = context.credentials.get("test_apikey", "")
@@ -18,23 +55,23 @@ class CalculateDrivingDistance(Tool):
         if isinstance(establishments_raw, str):
             establishments = self.parse_establishments_string(establishments_raw)
             if isinstance(establishments, str):  # Se retornou string, é erro
-                return TextResponse(data=establishments)
+                return self.responder(establishments, "entrada_invalida")
         else:
             establishments = establishments_raw
         
         if not establishments:
-            return TextResponse(data="Lista de estabelecimentos e obrigatoria.")
+            return self.responder("Lista de estabelecimentos e obrigatoria.", "entrada_invalida")
         
         if not api_key:
-            return TextResponse(data="Chave da API do Google Maps nao fornecida.")
+            return self.responder("Chave da API do Google Maps nao fornecida.", "sem_chave")
 
         if not cep:
-            return TextResponse(data="CEP não fornecido.")
+            return self.responder("CEP não fornecido.", "sem_cep")
 
         cep = re.sub(r'\D', '', cep)
         coords = self.get_coordinates_by_cep(cep, places_key)
         if not coords:
-            return TextResponse(data="Nao foi possivel obter coordenadas a partir do CEP.")
+            return self.responder("Nao foi possivel obter coordenadas a partir do CEP.", "sem_coordenadas")
 
         lat = coords["lat"]
         lng = coords["lng"]
@@ -43,59 +80,145 @@ class CalculateDrivingDistance(Tool):
             user_lat = float(lat)
             user_lng = float(lng)
         except (ValueError, TypeError):
-            return TextResponse(data="Coordenadas do usuario devem ser numeros validos.")
+            return self.responder("Coordenadas do usuario devem ser numeros validos.", "sem_coordenadas")
 
         # Validar formato dos estabelecimentos
         if not isinstance(establishments, list):
-            return TextResponse(data="Estabelecimentos deve ser uma lista.")
+            return self.responder("Estabelecimentos deve ser uma lista.", "entrada_invalida")
         
         if len(establishments) == 0:
-            return TextResponse(data="Lista de estabelecimentos nao pode estar vazia.")
+            return self.responder("Lista de estabelecimentos nao pode estar vazia.", "entrada_invalida")
 
-        # Processar cada estabelecimento
-        results = []
+        # Validar cada estabelecimento; itens invalidos viram anotacoes em vez de abortar a tool
+        destinations = []
+        failures = []
         for i, establishment in enumerate(establishments):
             if not isinstance(establishment, dict):
-                return TextResponse(data=f"Estabelecimento {i+1} deve ser um objeto com 'lat', 'lng' e 'name'.")
+                failures.append(f"Estabelecimento {i+1} deve ser um objeto com 'lat', 'lng' e 'name'.")
+                continue
+            establishment = normalizar_campos(establishment)
             
             if "lat" not in establishment or "lng" not in establishment:
-                return TextResponse(data=f"Estabelecimento {i+1} deve ter 'lat' e 'lng'.")
+                failures.append(f"Estabelecimento {i+1} deve ter 'lat' e 'lng'.")
+                continue
             
             if "name" not in establishment:
-                return TextResponse(data=f"Estabelecimento {i+1} deve ter 'name'.")
+                failures.append(f"Estabelecimento {i+1} deve ter 'name'.")
+                continue
             
             try:
                 est_lat = float(establishment["lat"])
                 est_lng = float(establishment["lng"])
             except (ValueError, TypeError):
-                return TextResponse(data=f"Coordenadas do estabelecimento {i+1} devem ser numeros validos.")
+                failures.append(f"Coordenadas do estabelecimento {i+1} devem ser numeros validos.")
+                continue
 
-            # Calcular distancia usando Google Maps API
-            distance_result = self.calculate_distance(
-                user_lat, user_lng, est_lat, est_lng, establishment["name"], api_key
-            )
-            
+            destinations.append((establishment["name"], est_lat, est_lng))
+
+        # Calcular distancias usando Google Maps API (uma matriz por lote ou uma rota por destino),
+        # apenas para os destinos mais proximos; os demais ja saem com a estimativa
+        routed, results = self.selecionar_destinos_rota(user_lat, user_lng, destinations)
+        if self.MATRIX_MODE:
+            distance_results = self.calculate_distance_matrix(user_lat, user_lng, routed, api_key)
+        else:
+            distance_results = [
+                self.calculate_distance(user_lat, user_lng, est_lat, est_lng, name, api_key)
+                for name, est_lat, est_lng in routed
+            ]
+
+        for distance_result in distance_results:
             if isinstance(distance_result, str):
-                return TextResponse(data=distance_result)
-            
-            results.append(distance_result)
+                failures.append(distance_result)
+            else:
+                results.append(distance_result)
+
+        if not results:
+            return self.responder("\n".join(failures), "falha")
 
         # Ordenar por distancia
         results.sort(key=lambda x: x["distance_meters"])
         
         # Formatar resposta
         response_text = "Distancias de carro para os estabelecimentos:\n\n"
+        if self.prazo.expirado():
+            response_text = ("Resultado parcial: o tempo limite foi atingido antes de calcular todas as distancias.\n\n"
+                             + response_text)
         
         for result in results:
             response_text += f"- {result['name']}\n"
-            response_text += f"   Distancia: {result['distance_text']}\n"
-            response_text += f"   Tempo estimado: {result['duration_text']}\n\n"
+            if result.get("estimado"):
+                response_text += f"   Distancia: ~{result['distance_text']} (estimativa em linha reta)\n"
+                response_text += f"   Tempo estimado: ~{result['duration_text']}\n\n"
+            else:
+                response_text += f"   Distancia: {result['distance_text']}\n"
+                response_text += f"   Tempo estimado: {result['duration_text']}\n\n"
+
+        if failures:
+            response_text += "Nao foi possivel calcular a distancia para:\n"
+            for failure in failures:
+                response_text += f"- {failure}\n"
+
+        return self.responder(response_text, "parcial" if self.prazo.expirado() else "ok",
+                              destinos=len(destinations), falhas=len(failures),
+                              estimados=sum(1 for result in results if result.get("estimado")))
+
+    def responder(self, texto, status, **atributos):
+        """
+        Registra a linha de trace da execucao e monta a resposta (com o resumo de tempos, se ativado)
+        """
+        self.trace.log(status=status, **atributos)
+        if self.TIMING_NA_RESPOSTA:
+            # A resposta e texto: o resumo vai como JSON na ultima linha
+            texto += "\n\ntiming: " + json.dumps(self.trace.resumo())
+        return TextResponse(data=texto)
+
+    def selecionar_destinos_rota(self, origin_lat, origin_lng, destinations):
+        """
+        Percorre os destinos (nome, lat, lng) do mais proximo ao mais distante da origem em linha
+        reta: rotas em cache sao usadas direto, os ROTAS_MAX primeiros sem cache vao para a Routes
+        API e os demais recebem estimar_rota. Retorna (destinos a rotear, resultados prontos)
+        """
+        ordered = sorted(destinations, key=lambda d: self.haversine(origin_lat, origin_lng, d[1], d[2]))
+        routed, ready = [], []
+        for name, dest_lat, dest_lng in ordered:
+            cached = ROUTE_CACHE.get(origin_lat, origin_lng, dest_lat, dest_lng)
+            if cached:
+                ready.append(self.format_route_result(
+                    name, cached["distance_meters"], cached["duration_seconds"], dest_lat, dest_lng
+                ))
+            elif self.ROTAS_MAX is None or len(routed) < self.ROTAS_MAX:
+                routed.append((name, dest_lat, dest_lng))
+            else:
+                ready.append(self.estimar_rota(origin_lat, origin_lng, name, dest_lat, dest_lng))
+        anotar(rotas=len(routed), estimados=sum(1 for result in ready if result.get("estimado")))
+        return routed, ready
+
+    def estimar_rota(self, origin_lat, origin_lng, establishment_name, dest_lat, dest_lng):
+        """
+        Resultado estimado a partir da distancia em linha reta (sem chamada a Routes API), marcado com "estimado"
+        """
+        distance_meters = int(self.haversine(origin_lat, origin_lng, dest_lat, dest_lng) * 1000 * self.FATOR_DESVIO)
+        duration_seconds = int(distance_meters / (self.VELOCIDADE_ESTIMADA_KMH / 3.6))
+        result = self.format_route_result(establishment_name, distance_meters, duration_seconds, dest_lat, dest_lng)
+        result["estimado"] = True
+        return result
 
-        return TextResponse(data=response_text)
+    def haversine(self, lat1, lon1, lat2, lon2):
+        R = 6371
+        phi1 = math.radians(lat1)
+        phi2 = math.radians(lat2)
+        delta_phi = math.radians(lat2 - lat1)
+        delta_lambda = math.radians(lon2 - lon1)
+
+        a = math.sin(delta_phi / 2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2)**2
+        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+        return R * c
 
     def parse_establishments_string(self, establishments_str):
         """
-        Faz parsing manual da string de establishments que vem no formato:
+        Faz parsing da string de establishments: JSON ou o formato chave=valor do agente
+        (estabelecimentos.py), por exemplo:
         [{name=CAPS Conselheiro Lafaiete, lat=-20.672687, lng=-43.80858}, ...]
         """
         try:
@@ -103,55 +226,24 @@ class CalculateDrivingDistance(Tool):
             return json.loads(establishments_str)
         except json.JSONDecodeError:
             pass
-        
+
         try:
-            # Remove colchetes externos
-            content = establishments_str.strip()
-            if content.startswith('[') and content.endswith(']'):
-                content = content[1:-1]
-            
-            establishments = []
-            # Divide por }, { para separar os objetos
-            parts = content.split('}, {')
-            
-            for i, part in enumerate(parts):
-                # Limpa chaves extras
-                if i == 0:
-                    part = part.strip()
-                else:
-                    part = '{' + part.strip()
-                
-                if i == len(parts) - 1:
-                    part = part.strip()
-                else:
-                    part = part + '}'
-                
-                # Converte formato name=valor para "name":"valor"
-                part = part.replace('name=', '"name":"')
-                part = part.replace(', lat=', '", "lat":')
-                part = part.replace(', lng=', ', "lng":')
-                
-                # Adiciona aspas nas chaves se não tiver
-                if not part.startswith('{'):
-                    part = '{' + part
-                if not part.endswith('}'):
-                    part = part + '}'
-                
-                # Parse do objeto individual
-                establishment = json.loads(part)
-                establishments.append(establishment)
-            
-            return establishments
-            
-        except Exception as e:
+            return interpretar(establishments_str)
+        except ErroFormato as e:
             return f"Erro ao processar establishments: {str(e)}. Formato esperado: lista de objetos com name, lat, lng"
 
+    @medir("rota")
     def calculate_distance(self, origin_lat, origin_lng, dest_lat, dest_lng, establishment_name, api_key):
         """
         Calcula a distancia de carro usando a Google Maps Routes API
         """
-        url = "https://routes.googleapis.com/directions/v2:computeRoutes"
-        
+        cached = ROUTE_CACHE.get(origin_lat, origin_lng, dest_lat, dest_lng)
+        anotar(destino=establishment_name, cache="hit" if cached else "miss")
+        if cached:
+            return self.format_route_result(
+                establishment_name, cached["distance_meters"], cached["duration_seconds"], dest_lat, dest_lng
+            )
+
         headers = {
             "Content-Type": "application/json",
             "X-Goog-Api-Key": api_key,
@@ -188,58 +280,26 @@ class CalculateDrivingDistance(Tool):
         }
 
         try:
-            response = requests.post(url, headers=headers, json=payload, timeout=15)
+            response = HTTP_CLIENT.post(self.ROUTES_URL, headers=headers, json=payload, timeout=15, idempotente=True,
+                                        prazo=self.prazo)
             
             if response.status_code == 200:
                 data = response.json()
                 
                 if "routes" in data and len(data["routes"]) > 0:
                     route = data["routes"][0]
-                    
                     distance_meters = route.get("distanceMeters", 0)
-                    duration_seconds = route.get("duration", "0s")
-                    
-                    # Converter distancia para texto legivel
-                    if distance_meters >= 1000:
-                        distance_text = f"{distance_meters/1000:.1f} km"
-                    else:
-                        distance_text = f"{distance_meters} metros"
+                    duration_seconds = self.parse_duration_seconds(route.get("duration", "0s"))
+                    ROUTE_CACHE.set(origin_lat, origin_lng, dest_lat, dest_lng, distance_meters, duration_seconds)
                     
-                    # Converter duracao para texto legivel
-                    if isinstance(duration_seconds, str):
-                        duration_text = duration_seconds
-                    else:
-                        # Converter segundos para minutos
-                        minutes = duration_seconds // 60
-                        if minutes >= 60:
-                            hours = minutes // 60
-                            remaining_minutes = minutes % 60
-                            duration_text = f"{hours}h {remaining_minutes}min" if remaining_minutes > 0 else f"{hours}h"
-                        else:
-                            duration_text = f"{minutes}min"
-                    
-                    return {
-                        "name": establishment_name,
-                        "distance_meters": distance_meters,
-                        "distance_text": distance_text,
-                        "duration_text": duration_text,
-                        "lat": dest_lat,
-                        "lng": dest_lng
-                    }
+                    return self.format_route_result(
+                        establishment_name, distance_meters, duration_seconds, dest_lat, dest_lng
+                    )
                 else:
                     return f"Rota nao encontrada para {establishment_name}"
             
-            elif response.status_code == 400:
-                return f"Erro na requisicao para {establishment_name}: Parametros invalidos"
-            
-            elif response.status_code == 403:
-                return f"Erro na requisicao para {establishment_name}: Chave da API invalida ou sem permissoes"
-            
-            elif response.status_code == 429:
-                return f"Erro na requisicao para {establishment_name}: Limite de requisicoes excedido"
-            
             else:
-                return f"Erro na requisicao para {establishment_name}: HTTP {response.status_code}"
+                return f"Erro na requisicao para {establishment_name}: {self.http_error_reason(response.status_code)}"
         
         except requests.exceptions.Timeout:
             return f"Timeout ao calcular distancia para {establishment_name}"
@@ -248,40 +308,193 @@ class CalculateDrivingDistance(Tool):
             return f"Erro de conexao ao calcular distancia para {establishment_name}: {str(e)}"
         
         except Exception as e:
+            registrar_falha(e)
             return f"Erro inesperado ao calcular distancia para {establishment_name}: {str(e)}"
 
+    @medir("rotas")
+    def calculate_distance_matrix(self, origin_lat, origin_lng, destinations, api_key):
+        """
+        Calcula as distancias de carro de uma origem para varios destinos com a Google Routes API
+        (computeRouteMatrix), em lotes de ate MATRIX_MAX_ELEMENTS destinos por requisicao.
+        destinations: lista de (nome, lat, lng). Retorna uma lista alinhada com destinations
+        contendo o resultado de cada destino ou a mensagem de erro (string) daquele destino.
+        """
+        headers = {
+            "Content-Type": "application/json",
+            "X-Goog-Api-Key": api_key,
+            "X-Goog-FieldMask": "originIndex,destinationIndex,status,condition,distanceMeters,duration"
+        }
+
+        results = [None] * len(destinations)
+
+        # Destinos com rota em cache nao entram na matriz
+        pending = []
+        for i, (name, dest_lat, dest_lng) in enumerate(destinations):
+            cached = ROUTE_CACHE.get(origin_lat, origin_lng, dest_lat, dest_lng)
+            if cached:
+                results[i] = self.format_route_result(
+                    name, cached["distance_meters"], cached["duration_seconds"], dest_lat, dest_lng
+                )
+            else:
+                pending.append(i)
+        anotar(destinos=len(destinations), cache_hits=len(destinations) - len(pending))
+
+        for start in range(0, len(pending), self.MATRIX_MAX_ELEMENTS):
+            chunk_indexes = pending[start:start + self.MATRIX_MAX_ELEMENTS]
+            chunk = [destinations[i] for i in chunk_indexes]
+            payload = {
+                "origins": [
+                    {"waypoint": {"location": {"latLng": {"latitude": origin_lat, "longitude": origin_lng}}}}
+                ],
+                "destinations": [
+                    {"waypoint": {"location": {"latLng": {"latitude": dest_lat, "longitude": dest_lng}}}}
+                    for _, dest_lat, dest_lng in chunk
+                ],
+                "travelMode": "DRIVE",
+                "routingPreference": "TRAFFIC_AWARE",
+                "languageCode": "pt-BR",
+                "units": "METRIC"
+            }
+
+            # Erro do lote inteiro, aplicado a cada destino sem resultado
+            chunk_error = None
+            try:
+                with self.trace.span("matriz", destinos=len(chunk)):
+                    response = HTTP_CLIENT.post(self.MATRIX_URL, headers=headers, json=payload, timeout=15,
+                                                idempotente=True, prazo=self.prazo)
+                if response.status_code == 200:
+                    for element in response.json():
+                        k = element.get("destinationIndex", 0)
+                        if not 0 <= k < len(chunk):
+                            continue
+                        name, dest_lat, dest_lng = chunk[k]
+                        status = element.get("status") or {}
+                        if status.get("code"):
+                            results[chunk_indexes[k]] = f"Erro na requisicao para {name}: {status.get('message') or status.get('code')}"
+                        elif element.get("condition", "ROUTE_EXISTS") != "ROUTE_EXISTS":
+                            results[chunk_indexes[k]] = f"Rota nao encontrada para {name}"
+                        else:
+                            distance_meters = element.get("distanceMeters", 0)
+                            duration_seconds = self.parse_duration_seconds(element.get("duration", "0s"))
+                            ROUTE_CACHE.set(origin_lat, origin_lng, dest_lat, dest_lng, distance_meters, duration_seconds)
+                            results[chunk_indexes[k]] = self.format_route_result(
+                                name, distance_meters, duration_seconds, dest_lat, dest_lng
+                            )
+                else:
+                    chunk_error = lambda name: f"Erro na requisicao para {name}: {self.http_error_reason(response.status_code)}"
+
+            except requests.exceptions.Timeout:
+                chunk_error = lambda name: f"Timeout ao calcular distancia para {name}"
+
+            except requests.exceptions.RequestException as e:
+                chunk_error = lambda name, erro=str(e): f"Erro de conexao ao calcular distancia para {name}: {erro}"
+
+            except Exception as e:
+                chunk_error = lambda name, erro=str(e): f"Erro inesperado ao calcular distancia para {name}: {erro}"
+
+            for k, (name, _, _) in enumerate(chunk):
+                if results[chunk_indexes[k]] is None:
+                    results[chunk_indexes[k]] = chunk_error(name) if chunk_error else f"Rota nao encontrada para {name}"
+
+        return results
+
+    def format_route_result(self, establishment_name, distance_meters, duration, dest_lat, dest_lng):
+        """
+        Monta o resultado de uma rota com distancia e duracao em texto legivel
+        """
+        # Converter distancia para texto legivel
+        if distance_meters >= 1000:
+            distance_text = f"{distance_meters/1000:.1f} km"
+        else:
+            distance_text = f"{distance_meters} metros"
+
+        # Converter segundos para minutos
+        minutes = self.parse_duration_seconds(duration) // 60
+        if minutes >= 60:
+            hours = minutes // 60
+            remaining_minutes = minutes % 60
+            duration_text = f"{hours}h {remaining_minutes}min" if remaining_minutes > 0 else f"{hours}h"
+        else:
+            duration_text = f"{minutes}min"
+
+        return {
+            "name": establishment_name,
+            "distance_meters": distance_meters,
+            "distance_text": distance_text,
+            "duration_text": duration_text,
+            "lat": dest_lat,
+            "lng": dest_lng
+        }
+
+    def parse_duration_seconds(self, duration):
+        """
+        Converte a duracao da Routes API (string como "1500s") em segundos inteiros
+        """
+        if isinstance(duration, str):
+            match = re.search(r'(\d+)', duration)
+            return int(match.group(1)) if match else 0
+        return int(duration or 0)
+
+    def http_error_reason(self, status_code):
+        if status_code == 400:
+            return "Parametros invalidos"
+        if status_code == 403:
+            return "Chave da API invalida ou sem permissoes"
+        if status_code == 429:
+            return "Limite de requisicoes excedido"
+        return f"HTTP {status_code}"
+
+    @medir("cep")
     def get_coordinates_by_cep(self, cep, api_key):
-        try:
-            via_url = f"https://viacep.com.br/ws/{cep}/json/"
-            print(f"[CalculateDrivingDistance][CEP] normalized={cep} url={via_url}")
-            response = requests.get(via_url, timeout=10)
-            data = response.json()
-            print(f"[ViaCEP] status={response.status_code} data={data}")
-            if "erro" in data:
-                print("[ViaCEP] resposta indicou erro para o CEP informado")
-                return None
+        em_cache = CEP_CACHE.get(cep) if len(cep) == 8 else None
+        anotar(cache="hit" if em_cache else "miss")
+        if em_cache:
+            return {"lat": em_cache["lat"], "lng": em_cache["lng"]}
 
-            cidade = data.get("localidade", "")
-            estado = data.get("uf", "")
-            print(f"[ViaCEP] cidade={cidade} estado={estado}")
+        try:
+            municipio = buscar_municipio(cep)
+            if municipio:
+                cidade = municipio["cidade"]
+                estado = municipio["uf"]
+                anotar(fonte="indice", ibge=municipio["ibge"])
+            else:
+                cidade, estado = self.consultar_viacep(cep)
             if not cidade or not estado:
-                print("[ViaCEP] cidade/estado ausentes no retorno")
                 return None
 
-            query = f"{cidade}, {estado}, Brasil"
-            geo_url = "https://maps.googleapis.com/maps/api/geocode/json"
-            print(f"[Geocode] query='{query}' endpoint={geo_url}")
-            geo_response = requests.get(geo_url, params={"address": query, "key": api_key}, timeout=10)
-            geo_data = geo_response.json()
-            print(f"[Geocode] http_status={geo_response.status_code} api_status={geo_data.get('status')}")
-            if geo_data.get("status") == "OK":
-                location = geo_data["results"][0]["geometry"]["location"]
-                print(f"[Geocode] location={location}")
-                return {"lat": location["lat"], "lng": location["lng"]}
-            else:
-                print(f"[Geocode] falha. status={geo_data.get('status')} mensagem={geo_data.get('error_message')}")
+            location = coordenadas_municipio(cidade, estado) or self.geocodificar_municipio(cidade, estado, api_key)
+            if not location:
                 return None
-        except Exception:
-            import traceback as _traceback
-            print(f"[get_coordinates_by_cep][Exception] {repr(_traceback.format_exc())}")
+            if len(cep) == 8:
+                CEP_CACHE.set(cep, {"cidade": cidade, "uf": estado,
+                                    "lat": location["lat"], "lng": location["lng"]})
+            return {"lat": location["lat"], "lng": location["lng"]}
+        except Exception as e:
+            registrar_falha(e)
             return None
+
+    @medir("viacep")
+    def consultar_viacep(self, cep):
+        """
+        Cidade e UF do CEP pelo ViaCEP, ou (None, None) se o CEP nao existe
+        """
+        response = HTTP_CLIENT.get(self.VIACEP_URL.format(cep=cep), timeout=10, prazo=self.prazo)
+        data = response.json()
+        if "erro" in data:
+            anotar(cep_inexistente=True)
+            return None, None
+        return data.get("localidade", ""), data.get("uf", "")
+
+    @medir("geocode")
+    def geocodificar_municipio(self, cidade, estado, api_key):
+        """
+        Centroide do municipio via Google Geocode, usado quando o nome nao esta no gazetteer local
+        """
+        query = f"{cidade}, {estado}, Brasil"
+        geo_response = HTTP_CLIENT.get(self.GEOCODE_URL, params={"address": query, "key": api_key}, timeout=10,
+                                       prazo=self.prazo)
+        geo_data = geo_response.json()
+        anotar(api_status=geo_data.get("status"))
+        if geo_data.get("status") == "OK":
+            return geo_data["results"][0]["geometry"]["location"]
+        return None
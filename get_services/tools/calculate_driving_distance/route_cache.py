@@ -0,0 +1,59 @@
+"""
+Cache de rotas de carro compartilhado entre as tools (namespace "rota" do DiskCache).
+
+A chave e a origem e o destino arredondados (PRECISAO casas decimais, ~11 m)
+mais o modo de viagem; como a origem e o centroide do municipio do CEP, todos
+os usuarios da mesma cidade reaproveitam as rotas para os mesmos servicos.
+Guarda apenas distancia (m) e duracao (s); cada tool formata o texto.
+"""
+import threading
+
+from disk_cache import DiskCache
+
+PRECISAO = 4
+
+
+class RouteCache:
+    def __init__(self, ttl=24 * 3600, max_entries=20000, precisao=PRECISAO, path=None):
+        self._cache = DiskCache("rota", ttl=ttl, max_entries=max_entries, path=path)
+        self.precisao = precisao
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def chave(self, origin_lat, origin_lng, dest_lat, dest_lng, modo="DRIVE"):
+        try:
+            pontos = [round(float(v), self.precisao) for v in (origin_lat, origin_lng, dest_lat, dest_lng)]
+        except (TypeError, ValueError):
+            return None
+        return "{}|{:.{p}f},{:.{p}f}|{:.{p}f},{:.{p}f}".format(modo, *pontos, p=self.precisao)
+
+    def get(self, origin_lat, origin_lng, dest_lat, dest_lng, modo="DRIVE"):
+        """
+        Retorna {"distance_meters", "duration_seconds"} da rota em cache, ou None
+        """
+        chave = self.chave(origin_lat, origin_lng, dest_lat, dest_lng, modo)
+        valor = self._cache.get(chave) if chave else None
+        with self._lock:
+            if valor is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return valor
+
+    def set(self, origin_lat, origin_lng, dest_lat, dest_lng, distance_meters, duration_seconds, modo="DRIVE"):
+        chave = self.chave(origin_lat, origin_lng, dest_lat, dest_lng, modo)
+        if chave:
+            self._cache.set(chave, {"distance_meters": distance_meters, "duration_seconds": duration_seconds})
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+ROUTE_CACHE = RouteCache()
@@ -0,0 +1,70 @@
+"""
+Indice offline de faixas de CEP -> municipio (codigo IBGE, nome, UF).
+
+As faixas ficam em data/cep_faixas.json como arrays inteiros ordenados pelo
+inicio da faixa (gerados por scripts/build_cep_index.py) e sao carregadas uma
+unica vez por processo em arrays compactos. A busca e binaria; CEPs fora das
+faixas conhecidas retornam None para que a tool recorra ao ViaCEP. Sem o
+arquivo (ainda nao gerado), todo CEP vai ao ViaCEP e o processo avisa no log.
+"""
+import json
+import os
+import threading
+from array import array
+from bisect import bisect_right
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cep_faixas.json")
+
+
+class CepIndex:
+    def __init__(self, inicio, fim, municipio, municipios):
+        self.inicio = array("l", inicio)
+        self.fim = array("l", fim)
+        self.municipio = array("l", municipio)
+        self.municipios = [tuple(m) for m in municipios]
+
+    @classmethod
+    def carregar(cls, path=DATA_PATH):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["inicio"], data["fim"], data["municipio"], data["municipios"])
+
+    def __len__(self):
+        return len(self.inicio)
+
+    def buscar(self, cep):
+        """
+        Retorna {"ibge", "cidade", "uf"} do municipio cuja faixa contem o CEP, ou None
+        """
+        digitos = "".join(ch for ch in str(cep) if ch.isdigit())
+        if len(digitos) != 8:
+            return None
+        numero = int(digitos)
+        i = bisect_right(self.inicio, numero) - 1
+        if i < 0 or numero > self.fim[i]:
+            return None
+        ibge, nome, uf = self.municipios[self.municipio[i]]
+        return {"ibge": ibge, "cidade": nome, "uf": uf}
+
+
+_indice = None
+_lock = threading.Lock()
+
+
+def indice():
+    global _indice
+    if _indice is None:
+        with _lock:
+            if _indice is None:
+                try:
+                    _indice = CepIndex.carregar()
+                except (OSError, ValueError, KeyError):
+                    _indice = CepIndex([], [], [], [])
+                if not len(_indice):
+                    print("[CepIndex] data/cep_faixas.json ausente ou vazio: todos os CEPs serao resolvidos pelo "
+                          "ViaCEP (gere o indice com scripts/build_cep_index.py)")
+    return _indice
+
+
+def buscar_municipio(cep):
+    return indice().buscar(cep)
@@ -0,0 +1,173 @@
+"""
+Cliente HTTP compartilhado pelas tools, com conexoes persistentes.
+
+Uma requests.Session por processo (recriada apos fork) com um pool keep-alive
+por host, entao ViaCEP, Google, Overpass e Mapa Saude Mental reaproveitam as
+conexoes TCP+TLS entre chamadas e entre execucoes do mesmo worker. Todas as
+chamadas tem timeout de conexao (CONNECT_TIMEOUT) e de leitura (o `timeout` de
+cada chamada, padrao READ_TIMEOUT). Chamadas idempotentes (GET, ou
+`idempotente=True`) sao repetidas em falhas de conexao e respostas 429/5xx
+transitorias, com backoff exponencial e jitter; timeouts de leitura nao sao
+repetidos, para nao multiplicar a espera. Com `prazo` (deadline.Deadline), os
+timeouts de cada tentativa sao limitados ao tempo restante da execucao e nao ha
+nova tentativa quando o backoff nao cabe no prazo. Cada tentativa passa pelo
+circuit breaker do host, ou do host e da chave nas APIs do Google
+(circuit_breaker.DISJUNTORES): com o circuito aberto a chamada falha na hora
+com CircuitoAberto, sem nova tentativa. Status, bytes
+recebidos e erros de cada chamada sao anotados no span corrente (tracing). A
+sessao nao guarda cookies entre chamadas e pede respostas comprimidas (gzip).
+Com uma cassete (cassete.py), as tentativas sao gravadas ou reproduzidas dela;
+na reproducao nada vai a rede e os circuit breakers nao sao consultados.
+"""
+import os
+import random
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cassete import CASSETE
+from circuit_breaker import DISJUNTORES, STATUS_FALHA, chave_api
+from deadline import SEM_PRAZO
+from tracing import registrar_falha, registrar_http
+
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+# Conexoes mantidas por host; acima disso as conexoes extras sao descartadas apos o uso
+POOL_MAXSIZE = 16
+POOL_HOSTS = 16
+
+TENTATIVAS = 3
+BACKOFF = 0.25
+BACKOFF_MAX = 2.0
+STATUS_TRANSITORIOS = frozenset({429, 502, 503, 504})
+
+HEADERS_PADRAO = {
+    "Accept-Encoding": "gzip, deflate",
+    # APIs do Google so comprimem a resposta quando o User-Agent contem "gzip"
+    "User-Agent": "Vita Alere Assistant/1.0 (gzip)",
+}
+
+
+class HttpClient:
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, tentativas=TENTATIVAS,
+                 backoff=BACKOFF, pool_maxsize=POOL_MAXSIZE, disjuntores=DISJUNTORES, cassete=CASSETE):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.tentativas = tentativas
+        self.backoff = backoff
+        self.pool_maxsize = pool_maxsize
+        self.disjuntores = disjuntores
+        self.cassete = cassete
+        self._lock = threading.Lock()
+        self._sessao = None
+        self._pid = None
+
+    def sessao(self):
+        # Reabre a sessao apos fork: sockets do pool nao podem ser compartilhados entre processos
+        if self._sessao is not None and self._pid == os.getpid():
+            return self._sessao
+        with self._lock:
+            if self._sessao is not None and self._pid == os.getpid():
+                return self._sessao
+            sessao = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=self.pool_maxsize, max_retries=0)
+            sessao.mount("https://", adapter)
+            sessao.mount("http://", adapter)
+            sessao.headers.update(HEADERS_PADRAO)
+            # Sem estado entre usuarios: cookies enviados explicitamente nos headers continuam funcionando
+            sessao.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            self._sessao = sessao
+            self._pid = os.getpid()
+            return sessao
+
+    def espera(self, tentativa, resposta=None):
+        """
+        Segundos antes da proxima tentativa: Retry-After quando informado, senao backoff exponencial com jitter
+        """
+        if self.cassete is not None and self.cassete.reproduzindo:
+            # Reproducao: as retentativas gravadas seguem sem espera
+            return 0.0
+        retry_after = resposta.headers.get("Retry-After") if resposta is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), BACKOFF_MAX)
+            except ValueError:
+                pass
+        return random.uniform(0, min(BACKOFF_MAX, self.backoff * (2 ** tentativa)))
+
+    def request(self, method, url, timeout=None, idempotente=None, tentativas=None, prazo=None, **kwargs):
+        """
+        Executa a requisicao pela sessao compartilhada e retorna o requests.Response.
+        Lanca as mesmas excecoes de requests quando todas as tentativas falham
+        (deadline.PrazoEsgotado, um Timeout, quando o prazo acaba antes; CircuitoAberto
+        quando o circuito do host esta aberto).
+        """
+        if idempotente is None:
+            idempotente = method.upper() in ("GET", "HEAD", "OPTIONS")
+        total = max(1, (self.tentativas if tentativas is None else tentativas) if idempotente else 1)
+        prazo = prazo or SEM_PRAZO
+        disjuntor = self.disjuntores.para(url, chave_api(kwargs.get("params"), kwargs.get("headers")))
+
+        try:
+            for tentativa in range(total):
+                ultima = tentativa == total - 1
+                limites = (prazo.limitar(self.connect_timeout),
+                           prazo.limitar(self.read_timeout if timeout is None else timeout))
+                try:
+                    resposta = self.chamar(disjuntor, method, url, timeout=limites, **kwargs)
+                except requests.exceptions.ConnectionError:
+                    # Inclui ConnectTimeout; ReadTimeout nao e ConnectionError e sobe direto
+                    espera = self.espera(tentativa)
+                    if ultima or not prazo.cabe(espera):
+                        raise
+                    time.sleep(espera)
+                    continue
+                if resposta.status_code in STATUS_TRANSITORIOS and not ultima:
+                    espera = self.espera(tentativa, resposta)
+                    if prazo.cabe(espera):
+                        resposta.close()
+                        time.sleep(espera)
+                        continue
+                return resposta
+        except requests.exceptions.RequestException as e:
+            registrar_falha(e)
+            raise
+
+    def chamar(self, disjuntor, method, url, **kwargs):
+        """
+        Uma tentativa pela sessao, registrando sucesso/falha e latencia no circuit breaker do host
+        """
+        if self.cassete is not None and self.cassete.reproduzindo:
+            resposta = self.cassete.reproduzir(method, url, **kwargs)
+            registrar_http(resposta.status_code, len(resposta.content))
+            return resposta
+
+        disjuntor.permitir()
+        inicio = time.monotonic()
+        try:
+            resposta = self.sessao().request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            disjuntor.registrar(False, time.monotonic() - inicio)
+            if self.cassete is not None:
+                self.cassete.gravar_erro(method, url, e, **kwargs)
+            raise
+        except BaseException:
+            disjuntor.descartar()
+            raise
+        disjuntor.registrar(resposta.status_code not in STATUS_FALHA, time.monotonic() - inicio)
+        registrar_http(resposta.status_code, len(resposta.content))
+        if self.cassete is not None:
+            self.cassete.gravar(method, url, resposta, **kwargs)
+        return resposta
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+HTTP_CLIENT = HttpClient()
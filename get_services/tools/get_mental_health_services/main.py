@@ -2,18 +2,57 @@ from weni import Tool
 from weni.context import Context
 from weni.responses import TextResponse
 import requests
-from typing import Optional, Dict, Any, List
+import heapq
+import math
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Optional, Dict, Any, List, Tuple
 from urllib.parse import urlencode
 
+from cep_index import buscar_municipio
+from compacto import tabela
+from deadline import SEM_PRAZO, Deadline
+from disk_cache import DiskCache
+from gazetteer import coordenadas_municipio
+from http_client import HTTP_CLIENT
+from mapa_cache import MAPA_CACHE
+from mapa_snapshot import consultar_snapshot
+from tracing import SEM_TRACE, Trace, anotar, medir
+
+# Cache CEP -> (cidade, uf, lat, lng) compartilhado com as tools buscar_cidades_proximas e calcular_distancias_carro
+CEP_CACHE = DiskCache("cep", ttl=30 * 24 * 3600, max_entries=50000)
+
 
 class GetMentalHealthServices(Tool):
     BASE_URL = "https://mapasaudemental.com.br/wp-json/latlng/v1/latlng-results"
+    VIACEP_URL = "https://viacep.com.br/ws/{cep}/json/"
     HEADERS = {
         'Accept': '*/*',
         'User-Agent': 'Vita Alere Assistant/1.0',
         'Content-Type': 'application/json'
     }
     
+    # Limite de consultas simultaneas ao Mapa da Saúde Mental (uma por cidade)
+    MAX_WORKERS = 5
+    # Orcamento total de uma execucao; cidades nao consultadas quando ele acaba saem como erro de tempo limite
+    PRAZO_SEGUNDOS = 20
+    # Prazo da execucao atual (criado em execute); metodos chamados fora dela nao tem prazo
+    prazo = SEM_PRAZO
+    # Spans da execucao atual (tracing); a linha de log JSON sai sempre, o resumo na resposta so com esta flag
+    TIMING_NA_RESPOSTA = False
+    trace = SEM_TRACE
+
+    # Compact response (compacto.py): locations as a table (campos + linhas) without empty columns,
+    # cidade/estado once when shared by every location, and a short action instruction
+    RESPOSTA_COMPACTA = False
+    ACTION = ("com a lista de servicos de saude mental, utilize a tool calcular_distancias_carro para calcular a "
+              "distancia e tempo de viagem entre a localizacao do usuario e os servicos de saude mental passando a "
+              "lista de servicos de saude mental no formato: [{name=<servico1> Nome do estabelecimento, lat=xxxxxxx, "
+              "lng=xxxxxxx}")
+    ACTION_COMPACTA = "calcular_distancias_carro com [{name=<name>, lat=<lat>, lng=<long>}] de cada linha"
+
+    # Campos de contato usados como relevancia no modo max_results sem origem (mais preenchidos primeiro)
+    RELEVANCE_FIELDS = ('endereco', 'telefone1', 'telefone2', 'whatsapp', 'site', 'email')
+
     # Campos conforme a API atual (minúsculos) + coordenadas
     FIELDS_TO_KEEP = [
         'name', 'lat', 'long', 'cidade', 'estado', 'endereco', 'tipo',
@@ -23,6 +62,8 @@ class GetMentalHealthServices(Tool):
     ]
 
     def execute(self, context: Context) -> TextResponse:
+        self.prazo = Deadline(self.PRAZO_SEGUNDOS)
+        self.trace = Trace("GetMentalHealthServices")
         
         #urn = context.contact.get("urn","")
         
@@ -30,22 +71,48 @@ class GetMentalHealthServices(Tool):
         estado = context.parameters.get("estado")
         cidade_param = context.parameters.get("cidade")
         cep_param = context.parameters.get("cep")
+        cep_digits = "".join([c for c in str(cep_param or "") if c.isdigit()])
 
-        # Se CEP for informado, usa ViaCEP para preencher cidade e estado
-        if cep_param and (not estado or not cidade_param):
+        # Modo max_results: so os K servicos mais proximos da origem (lat/lng ou CEP) ou, sem origem, os mais completos
+        max_results = context.parameters.get("max_results")
+        if max_results not in (None, ""):
             try:
-                cep_digits = "".join([c for c in str(cep_param) if c.isdigit()])
+                max_results = int(max_results)
+            except (TypeError, ValueError):
+                max_results = 0
+            if max_results < 1:
+                return self.responder({"status": "error", "message": "O parâmetro 'max_results' deve ser um inteiro positivo"})
+        else:
+            max_results = None
+        origem = None
+        if max_results and (context.parameters.get("lat") not in (None, "") or context.parameters.get("lng") not in (None, "")):
+            try:
+                origem = (float(context.parameters.get("lat")), float(context.parameters.get("lng")))
+            except (TypeError, ValueError):
+                return self.responder({"status": "error", "message": "Os parâmetros 'lat' e 'lng' devem ser números válidos"})
+
+        # Se CEP for informado, usa o indice local de faixas de CEP (ou o ViaCEP) para preencher cidade e estado
+        if cep_param and (not estado or not cidade_param):
+            municipio = buscar_municipio(cep_digits)
+            if municipio:
+                if not cidade_param:
+                    cidade_param = municipio["cidade"]
+                if not estado:
+                    estado = municipio["uf"]
 
-                viacep_url = f"https://viacep.com.br/ws/{cep_digits}/json/"
-                viacep_resp = requests.get(viacep_url, timeout=8)
+        if cep_param and (not estado or not cidade_param):
+            try:
+                viacep_url = self.VIACEP_URL.format(cep=cep_digits)
+                with self.trace.span("viacep"):
+                    viacep_resp = HTTP_CLIENT.get(viacep_url, timeout=8, prazo=self.prazo)
                 if viacep_resp.status_code >= 400:
-                    return TextResponse(data={
+                    return self.responder({
                         "status": "error",
                         "message": "Não foi possível consultar o ViaCEP no momento.",
                     })
                 viacep_json = viacep_resp.json()
                 if viacep_json.get("erro"):
-                    return TextResponse(data={
+                    return self.responder({
                         "status": "error",
                         "message": "CEP não encontrado no ViaCEP. Verifique e tente novamente."
                     })
@@ -55,22 +122,22 @@ class GetMentalHealthServices(Tool):
                 if not estado:
                     estado = viacep_json.get("uf")
             except Exception:
-                return TextResponse(data={
+                return self.responder({
                     "status": "error",
                     "message": "Erro ao consultar o ViaCEP. Tente novamente mais tarde."
                 })
 
         # Valida obrigatórios após possível preenchimento por CEP
         if not estado:
-            return TextResponse(data={"status": "error", "message": "O parâmetro 'estado' é obrigatório (ou informe um CEP válido)"})
+            return self.responder({"status": "error", "message": "O parâmetro 'estado' é obrigatório (ou informe um CEP válido)"})
             
         if not cidade_param:
-            return TextResponse(data={"status": "error", "message": "O parâmetro 'cidade' é obrigatório (ou informe um CEP válido)"})
+            return self.responder({"status": "error", "message": "O parâmetro 'cidade' é obrigatório (ou informe um CEP válido)"})
 
         # Permite múltiplas cidades separadas por vírgula
         cidades = [c.strip() for c in str(cidade_param).split(',') if str(c).strip()]
         if not cidades:
-            return TextResponse(data={"status": "error", "message": "O parâmetro 'cidade' não pode ser vazio"})
+            return self.responder({"status": "error", "message": "O parâmetro 'cidade' não pode ser vazio"})
 
         # Get optional parameters
         formato = context.parameters.get("formato", "")
@@ -78,41 +145,139 @@ class GetMentalHealthServices(Tool):
         
         # Debug opcional: use 'cidades' (lista) em vez de 'cidade' fora do loop
         # print(estado, cidades, formato, pagamento, tipo)
-        
+
+        if max_results and origem is None and cep_digits:
+            origem = self.origem_do_cep(cep_digits, cidade_param, estado)
 
         try:
-            # Consulta cada cidade e agrega resultados
+            # Consulta as cidades em paralelo e agrega resultados na ordem de entrada; no modo
+            # max_results as locations chegam cruas e so as selecionadas tem os campos copiados
             all_locations = []
             raw_results = []
-            for cidade in cidades:
-                response = self.get_mental_health_services(
-                    estado=estado,
-                    cidade=cidade,
-                    formato=formato,
-                    pagamento="",
-                    tipo=tipo
-                )
-
+            responses = self.consultar_cidades(estado, cidades, formato, tipo, copiar_campos=not max_results)
+            for cidade, response in zip(cidades, responses):
                 if not response:
                     continue
 
                 if isinstance(response, dict) and isinstance(response.get('locations'), list):
-                    all_locations.extend(response.get('locations', []))
+                    if max_results:
+                        all_locations.extend((cidade, location) for location in response['locations'])
+                    else:
+                        all_locations.extend(response.get('locations', []))
                 else:
                     raw_results.append({"cidade": cidade, "response": response})
 
+            # Cidades que o prazo nao deixou consultar aparecem em raw_results como erro de tempo limite
+            parcial = {"parcial": True} if self.prazo.expirado() else {}
+            selecao = {}
+            if max_results and all_locations:
+                selecao = {"total": len(all_locations), "ordem": "distancia" if origem else "relevancia"}
+                all_locations = self.selecionar_locations(all_locations, estado, max_results, origem)
             if all_locations:
-                return TextResponse(data={"status": "success", "action": "com a lista de servicos de saude mental, utilize a tool calcular_distancias_carro para calcular a distancia e tempo de viagem entre a localizacao do usuario e os servicos de saude mental passando a lista de servicos de saude mental no formato: [{name=<servico1> Nome do estabelecimento, lat=xxxxxxx, lng=xxxxxxx}", "locations": all_locations})
+                return self.responder({"status": "success", "action": self.ACTION, "locations": all_locations, **selecao, **parcial})
             if raw_results:
-                return TextResponse(data={"status": "multi", "results": raw_results, "message": "Vamos utilizar o agente de localização para buscar as cidades próximas e os serviços de saúde mental nessas cidades."})
-            return TextResponse(data={"status": "false", "locations": [], "message": "Vamos utilizar o agente de localização para buscar as cidades próximas e os serviços de saúde mental nessas cidades."})                    
+                return self.responder({"status": "multi", "results": raw_results, "message": "Vamos utilizar o agente de localização para buscar as cidades próximas e os serviços de saúde mental nessas cidades.", **parcial})
+            return self.responder({"status": "false", "locations": [], "message": "Vamos utilizar o agente de localização para buscar as cidades próximas e os serviços de saúde mental nessas cidades."})                    
             
         except Exception as e:
-            return TextResponse(data={
+            return self.responder({
                 "status": "error",
                 "message": f"Erro ao consultar o Mapa da Saúde Mental: {str(e)}"
             })
 
+    def responder(self, data: Dict[str, Any]) -> TextResponse:
+        """Log the execution trace line and build the response (with the timing summary when enabled)."""
+        self.trace.log(status="parcial" if data.get("parcial") else data.get("status"),
+                       locations=len(data.get("locations") or []), total=data.get("total"))
+        if self.RESPOSTA_COMPACTA and data.get("locations"):
+            data = {**data, "action": self.ACTION_COMPACTA,
+                    "locations": tabela(data["locations"], agrupar=("cidade", "estado"))}
+        if self.TIMING_NA_RESPOSTA:
+            data["timing"] = self.trace.resumo()
+        return TextResponse(data=data)
+
+    def origem_do_cep(self, cep: str, cidade: str, estado: str) -> Optional[Tuple[float, float]]:
+        """Origin for max_results from the shared CEP cache, else the centroid of the CEP's city in the local gazetteer."""
+        em_cache = CEP_CACHE.get(cep) if len(cep) == 8 else None
+        if em_cache:
+            return em_cache["lat"], em_cache["lng"]
+        # Com varias cidades, o CEP e da primeira
+        location = coordenadas_municipio(str(cidade).split(',')[0].strip(), estado) if cidade and estado else None
+        if location:
+            return location["lat"], location["lng"]
+        return None
+
+    def selecionar_locations(self, candidatos: List[Tuple[str, Dict[str, Any]]], estado: str, max_results: int,
+                             origem: Optional[Tuple[float, float]] = None) -> List[Dict[str, Any]]:
+        """Pick the max_results nearest (or, without an origin, most complete) of the (cidade, location) pairs.
+
+        Uses a bounded heap (heapq.nsmallest/nlargest, stable on ties) instead of sorting every location,
+        and only the selected ones get their fields copied. With an origin each one gets distancia_km.
+        """
+        if origem is None:
+            selecionados = heapq.nlargest(max_results, candidatos, key=lambda par: self.relevancia(par[1]))
+            return [self.location_fields(location, cidade, estado) for cidade, location in selecionados]
+
+        lat, lng = origem
+        distancias = ((self.distancia_km(lat, lng, location), cidade, location) for cidade, location in candidatos)
+        selecionados = heapq.nsmallest(max_results, distancias, key=lambda item: item[0])
+        locations = []
+        for distancia, cidade, location in selecionados:
+            filtered_location = self.location_fields(location, cidade, estado)
+            if math.isfinite(distancia):
+                filtered_location['distancia_km'] = round(distancia, 1)
+            locations.append(filtered_location)
+        return locations
+
+    def relevancia(self, location: Dict[str, Any]) -> int:
+        return sum(1 for field in self.RELEVANCE_FIELDS if location.get(field))
+
+    def distancia_km(self, lat: float, lng: float, location: Dict[str, Any]) -> float:
+        """Great-circle distance from (lat, lng) to the location; infinity when its coordinates are invalid."""
+        try:
+            dest_lat, dest_lng = float(location.get('lat')), float(location.get('long'))
+        except (TypeError, ValueError):
+            return math.inf
+        phi1, phi2 = math.radians(lat), math.radians(dest_lat)
+        a = (math.sin((phi2 - phi1) / 2) ** 2
+             + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(dest_lng - lng) / 2) ** 2)
+        return 2 * 6371 * math.asin(min(1.0, math.sqrt(a)))
+
+    def consultar_cidades(self, estado: str, cidades: List[str], formato: str, tipo: str,
+                          copiar_campos: bool = True) -> List[Dict[str, Any]]:
+        """Query every city concurrently on a bounded pool; results follow the input order.
+
+        Cities still pending when the execution deadline expires are cancelled and reported as timeout errors.
+        """
+        def consultar(cidade):
+            try:
+                return self.get_mental_health_services(
+                    estado=estado,
+                    cidade=cidade,
+                    formato=formato,
+                    pagamento="",
+                    tipo=tipo,
+                    copiar_campos=copiar_campos
+                )
+            except Exception as e:
+                # Falha em uma cidade não interrompe as demais
+                return {"status": "error", "message": f"Erro ao consultar {cidade}: {str(e)}"}
+
+        if len(cidades) == 1:
+            return [consultar(cidades[0])]
+        pool = ThreadPoolExecutor(max_workers=min(self.MAX_WORKERS, len(cidades)))
+        try:
+            futuros = [pool.submit(consultar, cidade) for cidade in cidades]
+            wait(futuros, timeout=self.prazo.restante())
+            return [
+                futuro.result() if futuro.done() and not futuro.cancelled()
+                else {"status": "error", "message": f"Tempo limite excedido antes de consultar {cidade}"}
+                for cidade, futuro in zip(cidades, futuros)
+            ]
+        finally:
+            # Nao espera as consultas em voo: cada uma ja tem o timeout limitado ao prazo
+            pool.shutdown(wait=False, cancel_futures=True)
+
     def filter_service_fields(self, service: Dict[str, Any]) -> Dict[str, Any]:
         """Filter only required fields with case-insensitive key matching."""
         try:
@@ -127,6 +292,43 @@ class GetMentalHealthServices(Tool):
         except Exception:
             return {}
 
+    def location_fields(self, location: Dict[str, Any], cidade: str, estado: str) -> Dict[str, Any]:
+        """Copy the fields kept in the response for one location."""
+        return {
+            'name': location.get('name', ''),
+            'lat': location.get('lat', ''),
+            'long': location.get('long', ''),
+            'cidade': cidade,
+            'estado': estado,
+            'endereco': location.get('endereco', ''),
+            'tipo': location.get('tipo', ''),
+            'pagamento': location.get('pagamento', ''),
+            'formato': location.get('formato', ''),
+            'telefone1': location.get('telefone1', ''),
+            'telefone2': location.get('telefone2', ''),
+            'whatsapp': location.get('whatsapp', ''),
+            'site': location.get('site', ''),
+            'instagram': location.get('instagram', ''),
+            'facebook': location.get('facebook', ''),
+            'email': location.get('email', ''),
+            'youtube': location.get('youtube', ''),
+            'sigla': location.get('sigla', ''),
+            'numero': location.get('numero', ''),
+            'complemento': location.get('complemento', ''),
+            'bairro': location.get('bairro', '')
+        }
+
+    def build_locations_response(self, locations: List[Dict[str, Any]], cidade: str, estado: str) -> Dict[str, Any]:
+        """Build the success payload with the fields kept for each location."""
+        filtered_locations = [self.location_fields(location, cidade, estado) for location in locations]
+
+        return {
+            "status": "success",
+            "action": self.ACTION,
+            "locations": filtered_locations
+        }
+
+    @medir("mapa")
     def get_mental_health_services(
         self,
         estado: str,
@@ -134,8 +336,19 @@ class GetMentalHealthServices(Tool):
         formato: Optional[str] = None,
         pagamento: Optional[str] = "",
         tipo: Optional[str] = None,
-        
+        copiar_campos: bool = True,
     ) -> Dict[str, Any]:
+        # Answer from the local directory snapshot when it covers this state
+        anotar(cidade=cidade, uf=estado)
+        snapshot_locations = consultar_snapshot(estado, cidade, tipo=tipo, formato=formato)
+        anotar(fonte="snapshot" if snapshot_locations is not None else "api")
+        if snapshot_locations is not None:
+            if not snapshot_locations:
+                return {"status": "error", "message": "No locations found"}
+            if not copiar_campos:
+                return {"status": "success", "locations": snapshot_locations}
+            return self.build_locations_response(snapshot_locations, cidade, estado)
+
         # Build query parameters
         params = {
             'estado': estado,
@@ -164,73 +377,17 @@ class GetMentalHealthServices(Tool):
             url = f"{url}?{urlencode(params)}"
 
         try:
-            # Make request with headers
-            response = requests.get(url, headers=self.HEADERS, timeout=10)
+            # Cache stale-while-revalidate compartilhado com a tool buscar_cidades_proximas
+            api_response = MAPA_CACHE.consultar(
+                estado, cidade, lambda prazo=None: self.request_mapa(url, prazo),
+                tipo=tipo, formato=formato, pagamento=pagamento,
+            )
+            if isinstance(api_response, dict) and 'locations' in api_response and not copiar_campos:
+                return {"status": "success", "locations": api_response['locations']}
+            if isinstance(api_response, dict) and 'locations' in api_response:
+                return self.build_locations_response(api_response['locations'], cidade, estado)
+            return api_response
 
-            if response.status_code >= 400:
-                # Tenta extrair payload de erro do WP REST
-                try:
-                    err = response.json()
-                except ValueError:
-                    err = None
-                if isinstance(err, dict) and err.get('code') and err.get('message'):
-                    return {
-                        "status": "error",
-                        "http_status": response.status_code,
-                        "code": err.get('code'),
-                        "message": err.get('message'),
-                        "url": url,
-                    }
-                return {
-                    "status": "error",
-                    "http_status": response.status_code,
-                    "message": f"Erro HTTP {response.status_code} ao consultar a API",
-                    "url": url,
-                }
-            try:
-                api_response = response.json()
-                if 'locations' in api_response:
-                    filtered_locations = []
-                    for location in api_response['locations']:
-                        filtered_location = {
-                            'name': location.get('name', ''),
-                            'lat': location.get('lat', ''),
-                            'long': location.get('long', ''),
-                            'cidade': cidade,
-                            'estado': estado,
-                            'endereco': location.get('endereco', ''),
-                            'tipo': location.get('tipo', ''),
-                            'pagamento': location.get('pagamento', ''),
-                            'formato': location.get('formato', ''),
-                            'telefone1': location.get('telefone1', ''),
-                            'telefone2': location.get('telefone2', ''),
-                            'whatsapp': location.get('whatsapp', ''),
-                            'site': location.get('site', ''),
-                            'instagram': location.get('instagram', ''),
-                            'facebook': location.get('facebook', ''),
-                            'email': location.get('email', ''),
-                            'youtube': location.get('youtube', ''),
-                            'sigla': location.get('sigla', ''),
-                            'numero': location.get('numero', ''),
-                            'complemento': location.get('complemento', ''),
-                            'bairro': location.get('bairro', '')
-                        }
-                        filtered_locations.append(filtered_location)
-                    
-                    return {
-                        "status": "success",
-                        "action": "com a lista de servicos de saude mental, utilize o agente location analyzer e a tool calcular_distancias_carro para calcular a distancia e tempo de viagem entre a localizacao do usuario e os servicos de saude mental passando a lista de servicos de saude mental no formato: [{name=<servico1> Nome do estabelecimento, lat=xxxxxxx, lng=xxxxxxx}",
-                        "locations": filtered_locations
-                        }
-                else:
-                    return api_response
-            except ValueError:
-                return {
-                    "status": "error",
-                    "message": "Resposta inválida da API (não é JSON válido)",
-                    "url": url,
-                }
-        
         except requests.exceptions.Timeout:
             return {
                 "status": "error",
@@ -262,4 +419,40 @@ class GetMentalHealthServices(Tool):
                 "status": "error",
                 "message": f"Erro na requisição: {str(e)}",
                 "url": url,
-            } 
\ No newline at end of file
+            }
+
+    def request_mapa(self, url: str, prazo: Optional[Deadline] = None) -> Dict[str, Any]:
+        """Request the Mapa da Saúde Mental API; HTTP and JSON errors come back as error payloads.
+
+        prazo is the background revalidation's own deadline (mapa_cache); defaults to the execution's.
+        """
+        response = HTTP_CLIENT.get(url, headers=self.HEADERS, timeout=10, prazo=prazo or self.prazo)
+
+        if response.status_code >= 400:
+            # Tenta extrair payload de erro do WP REST
+            try:
+                err = response.json()
+            except ValueError:
+                err = None
+            if isinstance(err, dict) and err.get('code') and err.get('message'):
+                return {
+                    "status": "error",
+                    "http_status": response.status_code,
+                    "code": err.get('code'),
+                    "message": err.get('message'),
+                    "url": url,
+                }
+            return {
+                "status": "error",
+                "http_status": response.status_code,
+                "message": f"Erro HTTP {response.status_code} ao consultar a API",
+                "url": url,
+            }
+        try:
+            return response.json()
+        except ValueError:
+            return {
+                "status": "error",
+                "message": "Resposta inválida da API (não é JSON válido)",
+                "url": url,
+            }
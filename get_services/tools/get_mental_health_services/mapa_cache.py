@@ -0,0 +1,182 @@
+"""
+Cache stale-while-revalidate das consultas ao Mapa da Saude Mental (latlng-results).
+
+Compartilhado entre as tools pelo namespace "mapa" do DiskCache. A chave e
+(estado, cidade, tipo, formato, pagamento) normalizados, entao a mesma cidade e
+tipo sao reaproveitados por todos os usuarios. Entradas frescas sao servidas
+direto; entradas vencidas (ate `retencao`) sao servidas na hora enquanto uma
+thread em segundo plano refaz a consulta. Respostas "No locations found" ficam
+em cache com TTL menor; erros e respostas inesperadas nunca sao gravados.
+A revalidacao tem prazo proprio (PRAZO_REVALIDACAO), independente do prazo da
+execucao que recebeu a entrada vencida: buscar(prazo) recebe esse Deadline.
+consultar_async e a versao para o motor asyncio, com a revalidacao rodando
+como tarefa no event loop e as leituras e escritas no SQLite fora do loop
+(asyncio.to_thread). Cada leitura anota hit/stale/miss no span corrente
+(tracing).
+"""
+import asyncio
+import threading
+
+from deadline import Deadline
+from disk_cache import DiskCache
+from mapa_snapshot import normalizar
+from tracing import anotar
+
+TTL = 6 * 3600
+TTL_NEGATIVO = 30 * 60
+RETENCAO = 7 * 24 * 3600
+# Prazo da revalidacao em segundo plano (o mesmo timeout das requisicoes ao Mapa)
+PRAZO_REVALIDACAO = 30
+
+
+def resposta_negativa(data):
+    return isinstance(data, dict) and data.get("status") == "error" and data.get("message") == "No locations found"
+
+
+def resposta_cacheavel(data):
+    if resposta_negativa(data):
+        return True
+    return isinstance(data, dict) and data.get("status") == "success" and isinstance(data.get("locations"), list)
+
+
+class MapaCache:
+    def __init__(self, ttl=TTL, ttl_negativo=TTL_NEGATIVO, retencao=RETENCAO, max_entries=20000, path=None):
+        self._cache = DiskCache("mapa", ttl=ttl, max_entries=max_entries, path=path, retencao=retencao)
+        self.ttl_negativo = ttl_negativo
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._revalidando = set()
+        self._tarefas = set()
+
+    def chave(self, estado, cidade, tipo="", formato="", pagamento=""):
+        # A ordem dos tipos nao altera o resultado da API
+        tipos = sorted({normalizar(parte) for parte in str(tipo or "").split(",") if parte.strip()})
+        return "|".join([
+            str(estado or "").strip().upper(),
+            normalizar(cidade),
+            ",".join(tipos),
+            normalizar(formato),
+            normalizar(pagamento),
+        ])
+
+    def gravar(self, chave, data):
+        if resposta_cacheavel(data):
+            self._cache.set(chave, data, ttl=self.ttl_negativo if resposta_negativa(data) else None)
+
+    def consultar(self, estado, cidade, buscar, tipo="", formato="", pagamento=""):
+        """
+        Retorna a resposta da API para a consulta, do cache quando possivel.
+        buscar(prazo=None) faz a requisicao e retorna o JSON da API (ou lanca excecao);
+        sem prazo, usa o da execucao.
+        """
+        chave = self.chave(estado, cidade, tipo, formato, pagamento)
+        entrada = self.ler(chave)
+        if entrada is not None:
+            data, expirado = entrada
+            if expirado:
+                self.revalidar(chave, buscar)
+            return data
+
+        data = buscar()
+        self.gravar(chave, data)
+        return data
+
+    async def consultar_async(self, estado, cidade, buscar, tipo="", formato="", pagamento=""):
+        """
+        Versao asyncio de consultar: buscar() e uma corrotina
+        """
+        chave = self.chave(estado, cidade, tipo, formato, pagamento)
+        entrada = await asyncio.to_thread(self.ler, chave)
+        if entrada is not None:
+            data, expirado = entrada
+            if expirado:
+                self.revalidar_async(chave, buscar)
+            return data
+
+        data = await buscar()
+        await asyncio.to_thread(self.gravar, chave, data)
+        return data
+
+    def ler(self, chave):
+        """
+        Retorna (data, expirado) do cache, ou None, contabilizando hits, stale e misses
+        """
+        entrada = self._cache.get_entrada(chave)
+        with self._lock:
+            if entrada is None:
+                self.misses += 1
+                resultado = "miss"
+            elif entrada[1]:
+                self.stale += 1
+                resultado = "stale"
+            else:
+                self.hits += 1
+                resultado = "hit"
+        anotar(cache=resultado)
+        return entrada
+
+    def reservar(self, chave):
+        # No maximo uma revalidacao por chave por vez
+        with self._lock:
+            if chave in self._revalidando:
+                return False
+            self._revalidando.add(chave)
+            return True
+
+    def liberar(self, chave):
+        with self._lock:
+            self._revalidando.discard(chave)
+
+    def revalidar(self, chave, buscar):
+        """
+        Refaz a consulta em segundo plano; no maximo uma revalidacao por chave por vez
+        """
+        if not self.reservar(chave):
+            return
+
+        def atualizar():
+            try:
+                self.gravar(chave, buscar(prazo=Deadline(PRAZO_REVALIDACAO)))
+            except Exception:
+                # Mantem a entrada antiga; a proxima leitura tenta de novo
+                pass
+            finally:
+                self.liberar(chave)
+
+        threading.Thread(target=atualizar, name=f"mapa-swr-{chave}", daemon=True).start()
+
+    def revalidar_async(self, chave, buscar):
+        """
+        Refaz a consulta como tarefa no event loop atual, sem bloquear quem pediu
+        """
+        if not self.reservar(chave):
+            return
+
+        async def atualizar():
+            try:
+                data = await buscar(prazo=Deadline(PRAZO_REVALIDACAO))
+                await asyncio.to_thread(self.gravar, chave, data)
+            except Exception:
+                pass
+            finally:
+                self.liberar(chave)
+                self._tarefas.discard(tarefa)
+
+        # Mantem referencia a tarefa ate terminar (o loop guarda apenas referencias fracas)
+        tarefa = asyncio.ensure_future(atualizar())
+        self._tarefas.add(tarefa)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.stale + self.misses
+            return {
+                "hits": self.hits,
+                "stale": self.stale,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.stale) / total, 3) if total else 0.0,
+            }
+
+
+MAPA_CACHE = MapaCache()
@@ -0,0 +1,235 @@
+"""
+Cliente HTTP assincrono (aiohttp) para o motor asyncio das tools.
+
+Um unico event loop por processo roda em uma thread de fundo (recriado apos
+fork); execute(), que continua sincrono pelo contrato da Tool, submete a
+corrotina do pipeline a esse loop e espera o resultado. Assim, execucoes
+concorrentes do worker compartilham o mesmo loop e a mesma ClientSession, com
+conexoes keep-alive por host, em vez de uma thread bloqueada por socket.
+
+O trabalho bloqueante das corrotinas (leituras e escritas nos caches SQLite,
+carga do gazetteer e do snapshot, ordenacao com NumPy, parse de respostas
+grandes) roda fora do loop, com asyncio.to_thread, no pool de threads do loop
+(MAX_THREADS). O mesmo pool serve o motor com threads: as tools rodam as mesmas
+corrotinas e fazem cada chamada pelo cliente sincrono em uma thread do pool.
+
+Timeouts, retentativas, backoff, circuit breakers, cassete e headers seguem o cliente sincrono
+(http_client.HttpClient). As respostas sao lidas por completo e expostas com a
+mesma interface usada pelas tools (status_code, headers, json(), text), e os
+erros sao relancados como as excecoes equivalentes de requests, para que os
+dois motores compartilhem o tratamento de erros.
+
+aiohttp e opcional: sem ele, disponivel() retorna False e a tool usa o motor
+com threads.
+"""
+import asyncio
+import atexit
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from cassete import corpo
+from deadline import SEM_PRAZO
+from circuit_breaker import STATUS_FALHA, chave_api
+from http_client import HEADERS_PADRAO, STATUS_TRANSITORIOS, HttpClient
+from tracing import registrar_falha, registrar_http
+
+try:
+    import aiohttp
+except ImportError:  # motor assincrono opcional
+    aiohttp = None
+
+# aiohttp >= 3.10 distingue timeout de conexao; nas versoes anteriores ele vira ServerTimeoutError
+TIMEOUT_CONEXAO = getattr(aiohttp, "ConnectionTimeoutError", ()) if aiohttp else ()
+
+# Conexoes simultaneas por host, somando todas as conversas do processo. Diferente do pool do
+# requests (que abre conexoes extras quando esgota), o limite do aiohttp enfileira as chamadas
+LIMITE_POR_HOST = 128
+# Threads do pool do loop (asyncio.to_thread), somando todas as conversas do processo
+MAX_THREADS = 64
+
+
+class RespostaAsync:
+    def __init__(self, status_code, headers, content, url):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+    def close(self):
+        pass
+
+
+class AsyncHttpClient(HttpClient):
+    def __init__(self, limite_por_host=LIMITE_POR_HOST, **kwargs):
+        super().__init__(**kwargs)
+        self.limite_por_host = limite_por_host
+        self._loop = None
+        self._sessao_async = None
+        self._loop_pid = None
+
+    def disponivel(self):
+        return aiohttp is not None
+
+    def loop(self):
+        # Reinicia o loop apos fork: a thread do loop nao existe no processo filho
+        if self._loop is not None and self._loop_pid == os.getpid():
+            return self._loop
+        with self._lock:
+            if self._loop is not None and self._loop_pid == os.getpid():
+                return self._loop
+            loop = asyncio.new_event_loop()
+            loop.set_default_executor(ThreadPoolExecutor(max_workers=MAX_THREADS, thread_name_prefix="async-http"))
+            threading.Thread(target=loop.run_forever, name="async-http-loop", daemon=True).start()
+            if self._loop_pid is None:
+                atexit.register(self.fechar)
+            self._loop = loop
+            self._sessao_async = None
+            self._loop_pid = os.getpid()
+            return loop
+
+    def fechar(self):
+        """
+        Fecha a ClientSession compartilhada (registrado no atexit do processo)
+        """
+        if self._sessao_async is None or self._loop_pid != os.getpid():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._sessao_async.close(), self._loop).result(5)
+        except Exception:
+            pass
+
+    def executar(self, corrotina, timeout=None):
+        """
+        Roda a corrotina no loop compartilhado e bloqueia ate o resultado (para uso em execute())
+        """
+        return asyncio.run_coroutine_threadsafe(corrotina, self.loop()).result(timeout)
+
+    def sessao_async(self):
+        # Sempre chamado de dentro do loop compartilhado, entao nao precisa de lock
+        if self._sessao_async is None or self._sessao_async.closed:
+            conector = aiohttp.TCPConnector(limit=0, limit_per_host=self.limite_por_host, ttl_dns_cache=300)
+            self._sessao_async = aiohttp.ClientSession(
+                connector=conector,
+                headers=HEADERS_PADRAO,
+                cookie_jar=aiohttp.DummyCookieJar(),
+            )
+        return self._sessao_async
+
+    async def request(self, method, url, timeout=None, idempotente=None, tentativas=None, prazo=None,
+                      params=None, data=None, json=None, headers=None):
+        """
+        Versao assincrona de HttpClient.request; retorna RespostaAsync com o corpo ja lido
+        """
+        if idempotente is None:
+            idempotente = method.upper() in ("GET", "HEAD", "OPTIONS")
+        total = max(1, (self.tentativas if tentativas is None else tentativas) if idempotente else 1)
+        prazo = prazo or SEM_PRAZO
+        disjuntor = self.disjuntores.para(url, chave_api(params, headers))
+
+        try:
+            for tentativa in range(total):
+                ultima = tentativa == total - 1
+                # Com prazo, o total da tentativa (conexao + leitura do corpo) tambem fica limitado ao restante
+                limites = aiohttp.ClientTimeout(
+                    total=prazo.restante(),
+                    sock_connect=prazo.limitar(self.connect_timeout),
+                    sock_read=prazo.limitar(self.read_timeout if timeout is None else timeout),
+                )
+                try:
+                    resposta = await self.chamar(disjuntor, method, url, params=params, data=data, json=json,
+                                                 headers=headers, timeout=limites)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    erro = self._traduzir_erro(e)
+                    espera = self.espera(tentativa)
+                    repetivel = isinstance(erro, requests.exceptions.ConnectionError) and prazo.cabe(espera)
+                    if ultima or not repetivel:
+                        raise erro from e
+                    await asyncio.sleep(espera)
+                    continue
+                except aiohttp.ClientError as e:
+                    raise requests.exceptions.RequestException(str(e)) from e
+                if resposta.status_code in STATUS_TRANSITORIOS and not ultima:
+                    espera = self.espera(tentativa, resposta)
+                    if prazo.cabe(espera):
+                        await asyncio.sleep(espera)
+                        continue
+                return resposta
+        except requests.exceptions.RequestException as e:
+            registrar_falha(e)
+            raise
+
+    async def chamar(self, disjuntor, method, url, **kwargs):
+        """
+        Uma tentativa pela ClientSession, registrando sucesso/falha e latencia no circuit breaker do host
+        """
+        if self.cassete is not None and self.cassete.reproduzindo:
+            return self.reproduzir(method, url, **kwargs)
+
+        disjuntor.permitir()
+        inicio = time.monotonic()
+        try:
+            async with self.sessao_async().request(method, url, **kwargs) as resp:
+                resposta = RespostaAsync(resp.status, resp.headers, await resp.read(), str(resp.url))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            disjuntor.registrar(False, time.monotonic() - inicio)
+            if self.cassete is not None:
+                self.cassete.gravar_erro(method, url, self._traduzir_erro(e), **kwargs)
+            raise
+        except BaseException:
+            # Inclui o cancelamento da tarefa (prazo esgotado, hedging): nao conta como falha do host
+            disjuntor.descartar()
+            raise
+        disjuntor.registrar(resposta.status_code not in STATUS_FALHA, time.monotonic() - inicio)
+        registrar_http(resposta.status_code, len(resposta.content))
+        if self.cassete is not None:
+            self.cassete.gravar(method, url, resposta, **kwargs)
+        return resposta
+
+    def reproduzir(self, method, url, **kwargs):
+        # Interacao gravada; erros de rede voltam como as excecoes do aiohttp que request() ja traduz
+        interacao = self.cassete.proxima(method, url, **kwargs)
+        erro = interacao.get("erro")
+        if erro in ("ReadTimeout", "Timeout"):
+            raise asyncio.TimeoutError(interacao.get("mensagem", ""))
+        if erro == "ConnectTimeout" and TIMEOUT_CONEXAO:
+            raise TIMEOUT_CONEXAO(interacao.get("mensagem", ""))
+        if erro:
+            raise aiohttp.ClientConnectionError(interacao.get("mensagem", ""))
+        resposta = RespostaAsync(interacao["status"], CaseInsensitiveDict(interacao.get("headers", {})),
+                                 corpo(interacao), url)
+        registrar_http(resposta.status_code, len(resposta.content))
+        return resposta
+
+    def _traduzir_erro(self, erro):
+        # Mesma semantica do cliente sincrono: falhas de conexao podem ser repetidas, timeouts de leitura nao
+        if isinstance(erro, TIMEOUT_CONEXAO):
+            return requests.exceptions.ConnectTimeout(str(erro))
+        if isinstance(erro, (asyncio.TimeoutError, aiohttp.ServerTimeoutError)):
+            return requests.exceptions.ReadTimeout(str(erro) or "timeout")
+        return requests.exceptions.ConnectionError(str(erro))
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+
+ASYNC_HTTP = AsyncHttpClient()
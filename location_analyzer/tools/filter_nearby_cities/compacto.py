@@ -0,0 +1,45 @@
+"""
+Formato compacto das respostas das tools (RESPOSTA_COMPACTA): menos bytes para
+serializar e menos tokens para o agente ler a cada turno.
+
+- campos vazios ("", None, listas e dicts vazios) sao removidos;
+- listas de registros viram uma tabela {"campos": [...], "linhas": [[...], ...]},
+  so com as colunas que tem algum valor (celulas vazias ficam "");
+- campos com o mesmo valor em todos os registros (cidade, estado) saem uma vez,
+  fora da tabela.
+"""
+
+
+def vazio(valor):
+    return valor is None or (isinstance(valor, (str, list, dict)) and not valor)
+
+
+def sem_vazios(registro):
+    return {chave: valor for chave, valor in registro.items() if not vazio(valor)}
+
+
+def tabela(registros, agrupar=()):
+    """
+    Registros (dicts) em formato colunar. Os campos de `agrupar` com o mesmo valor em todos
+    os registros vao para fora da tabela: {"cidade": ..., "campos": [...], "linhas": [...]}
+    """
+    saida = {}
+    for campo in agrupar:
+        valores = {registro.get(campo) for registro in registros}
+        if len(valores) == 1:
+            valor = valores.pop()
+            if not vazio(valor):
+                saida[campo] = valor
+
+    campos = []
+    for registro in registros:
+        for campo, valor in registro.items():
+            if campo not in saida and campo not in campos and not vazio(valor):
+                campos.append(campo)
+
+    saida["campos"] = campos
+    saida["linhas"] = [
+        ["" if vazio(registro.get(campo)) else registro[campo] for campo in campos]
+        for registro in registros
+    ]
+    return saida
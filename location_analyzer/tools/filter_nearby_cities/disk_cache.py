@@ -0,0 +1,122 @@
+"""
+Cache persistente em SQLite, compartilhado entre as tools e entre processos.
+
+Todas as instancias gravam no mesmo arquivo (por padrao no diretorio temporario,
+ou em VITA_ALERE_CACHE_DIR) e sao separadas por namespace. Cada entrada tem TTL
+e o tamanho de cada namespace e limitado com descarte LRU. Entradas expiradas
+continuam disponiveis via get_entrada por `retencao` segundos, para servir
+dados antigos quando a fonte esta indisponivel. Falhas no cache nunca
+interrompem a tool: leituras viram miss e escritas sao ignoradas.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+CACHE_DIR_ENV = "VITA_ALERE_CACHE_DIR"
+CACHE_FILENAME = "vita_alere_cache.sqlite3"
+
+
+def caminho_padrao():
+    diretorio = os.environ.get(CACHE_DIR_ENV) or tempfile.gettempdir()
+    return os.path.join(diretorio, CACHE_FILENAME)
+
+
+class DiskCache:
+    def __init__(self, namespace, ttl, max_entries=10000, path=None, retencao=0):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.retencao = retencao
+        self.max_entries = max_entries
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _conexao(self):
+        # Reabre a conexao apos fork: conexoes SQLite nao podem ser herdadas
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+
+        conn = sqlite3.connect(self.path or caminho_padrao(), timeout=5, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL,"
+                " chave TEXT NOT NULL,"
+                " valor TEXT NOT NULL,"
+                " expira_em REAL NOT NULL,"
+                " acessado_em REAL NOT NULL,"
+                " PRIMARY KEY (namespace, chave))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_lru ON cache (namespace, acessado_em)")
+        self._conn = conn
+        self._pid = os.getpid()
+        return conn
+
+    def get(self, chave):
+        """
+        Retorna o valor armazenado para a chave, ou None se ausente ou expirado
+        """
+        entrada = self.get_entrada(chave)
+        if entrada is None or entrada[1]:
+            return None
+        return entrada[0]
+
+    def get_entrada(self, chave):
+        """
+        Retorna (valor, expirado) para a chave, incluindo entradas expiradas ainda
+        dentro da retencao, ou None se ausente
+        """
+        agora = time.time()
+        try:
+            with self._lock:
+                conn = self._conexao()
+                row = conn.execute(
+                    "SELECT valor, expira_em FROM cache WHERE namespace = ? AND chave = ?",
+                    (self.namespace, chave),
+                ).fetchone()
+                if row is None or row[1] + self.retencao <= agora:
+                    return None
+                with conn:
+                    conn.execute(
+                        "UPDATE cache SET acessado_em = ? WHERE namespace = ? AND chave = ?",
+                        (agora, self.namespace, chave),
+                    )
+            return json.loads(row[0]), row[1] <= agora
+        except (sqlite3.Error, ValueError):
+            return None
+
+    def set(self, chave, valor, ttl=None):
+        """
+        Grava o valor (serializavel em JSON) e descarta as entradas expiradas alem
+        da retencao e as menos usadas recentemente acima de max_entries
+        """
+        agora = time.time()
+        expira_em = agora + (self.ttl if ttl is None else ttl)
+        try:
+            payload = json.dumps(valor, ensure_ascii=False)
+            with self._lock:
+                conn = self._conexao()
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO cache (namespace, chave, valor, expira_em, acessado_em)"
+                        " VALUES (?, ?, ?, ?, ?)",
+                        (self.namespace, chave, payload, expira_em, agora),
+                    )
+                    conn.execute(
+                        "DELETE FROM cache WHERE namespace = ? AND expira_em <= ?",
+                        (self.namespace, agora - self.retencao),
+                    )
+                    conn.execute(
+                        "DELETE FROM cache WHERE namespace = ? AND chave IN ("
+                        " SELECT chave FROM cache WHERE namespace = ?"
+                        " ORDER BY acessado_em DESC LIMIT -1 OFFSET ?)",
+                        (self.namespace, self.namespace, self.max_entries),
+                    )
+        except (sqlite3.Error, TypeError, ValueError):
+            pass
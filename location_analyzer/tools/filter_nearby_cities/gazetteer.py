@@ -0,0 +1,131 @@
+"""
+Gazetteer local dos municipios brasileiros com centroides e populacao.
+
+Os dados ficam em data/municipios.json em formato colunar (gerado por
+scripts/build_municipios.py) e sao carregados sob demanda, uma unica vez por
+processo, em arrays compactos com um indice por (UF, nome normalizado) e uma
+grade uniforme de lat/lng para consultas por raio. Sem o arquivo (ainda nao
+gerado), o gazetteer fica vazio, as tools usam o Google Geocode e o Overpass,
+e o processo avisa no log.
+"""
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from array import array
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "municipios.json")
+
+# Tamanho da celula da grade espacial (~55 km de latitude)
+CELULA_GRAUS = 0.5
+
+UF_NOMES = {
+    "AC": "Acre", "AL": "Alagoas", "AP": "Amapá", "AM": "Amazonas", "BA": "Bahia",
+    "CE": "Ceará", "DF": "Distrito Federal", "ES": "Espírito Santo", "GO": "Goiás",
+    "MA": "Maranhão", "MT": "Mato Grosso", "MS": "Mato Grosso do Sul", "MG": "Minas Gerais",
+    "PA": "Pará", "PB": "Paraíba", "PR": "Paraná", "PE": "Pernambuco", "PI": "Piauí",
+    "RJ": "Rio de Janeiro", "RN": "Rio Grande do Norte", "RS": "Rio Grande do Sul",
+    "RO": "Rondônia", "RR": "Roraima", "SC": "Santa Catarina", "SP": "São Paulo",
+    "SE": "Sergipe", "TO": "Tocantins",
+}
+
+
+def normalizar_nome(nome):
+    """
+    Remove acentos, hifens, apostrofos e espacos repetidos, em minusculas
+    """
+    sem_acento = unicodedata.normalize("NFKD", str(nome)).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[\s\-'`]+", " ", sem_acento.lower()).strip()
+
+
+class Gazetteer:
+    def __init__(self, ibge, nome, uf, lat, lng, populacao):
+        self.ibge = array("l", ibge)
+        self.nome = list(nome)
+        self.uf = list(uf)
+        self.lat = array("d", lat)
+        self.lng = array("d", lng)
+        self.populacao = array("l", populacao)
+        self._por_nome = {
+            (uf_i.upper(), normalizar_nome(nome_i)): i
+            for i, (nome_i, uf_i) in enumerate(zip(self.nome, self.uf))
+        }
+        self._grade = {}
+        for i in range(len(self.nome)):
+            self._grade.setdefault(self._celula(self.lat[i], self.lng[i]), array("l")).append(i)
+
+    @staticmethod
+    def _celula(lat, lng):
+        return math.floor(lat / CELULA_GRAUS), math.floor(lng / CELULA_GRAUS)
+
+    @classmethod
+    def carregar(cls, path=DATA_PATH):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["ibge"], data["nome"], data["uf"], data["lat"], data["lng"], data["populacao"])
+
+    def __len__(self):
+        return len(self.nome)
+
+    def buscar(self, cidade, uf):
+        """
+        Retorna o indice do municipio pelo nome e sigla da UF, ou None
+        """
+        return self._por_nome.get((str(uf).strip().upper(), normalizar_nome(cidade)))
+
+    def coordenadas(self, cidade, uf):
+        i = self.buscar(cidade, uf)
+        if i is None:
+            return None
+        return {"lat": self.lat[i], "lng": self.lng[i]}
+
+    def candidatos(self, lat, lng, raio_km):
+        """
+        Retorna os indices dos municipios nas celulas da grade que cobrem o raio em torno do ponto;
+        a distancia exata (e o corte em raio_km) fica com quem chama, em uma unica conta vetorizada
+        """
+        if not self._grade:
+            return []
+        delta_lat = raio_km / 111.32
+        delta_lng = raio_km / (111.32 * max(math.cos(math.radians(lat)), 0.01))
+        lat_min, lng_min = self._celula(lat - delta_lat, lng - delta_lng)
+        lat_max, lng_max = self._celula(lat + delta_lat, lng + delta_lng)
+
+        indices = []
+        for ci in range(lat_min, lat_max + 1):
+            for cj in range(lng_min, lng_max + 1):
+                indices.extend(self._grade.get((ci, cj), ()))
+        return indices
+
+    def registro(self, i):
+        return {
+            "nome": self.nome[i],
+            "uf_sigla": self.uf[i],
+            "uf_nome": UF_NOMES.get(self.uf[i], self.uf[i]),
+            "populacao": self.populacao[i],
+        }
+
+
+_gazetteer = None
+_lock = threading.Lock()
+
+
+def gazetteer():
+    global _gazetteer
+    if _gazetteer is None:
+        with _lock:
+            if _gazetteer is None:
+                try:
+                    _gazetteer = Gazetteer.carregar()
+                except (OSError, ValueError, KeyError):
+                    _gazetteer = Gazetteer([], [], [], [], [], [])
+                if not len(_gazetteer):
+                    print("[Gazetteer] data/municipios.json ausente ou vazio: coordenadas pelo Google Geocode e "
+                          "municipios proximos pelo Overpass (gere com scripts/build_municipios.py)")
+    return _gazetteer
+
+
+def coordenadas_municipio(cidade, uf):
+    return gazetteer().coordenadas(cidade, uf)
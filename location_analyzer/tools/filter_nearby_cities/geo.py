@@ -0,0 +1,45 @@
+"""
+Distancias de grande circulo (haversine) vetorizadas com NumPy.
+
+Uma origem contra N pontos em uma unica chamada, para ordenar candidatos por
+proximidade antes de qualquer chamada de rede.
+"""
+import numpy as np
+
+RAIO_TERRA_KM = 6371.0
+
+
+def coordenadas_array(valores):
+    """
+    Converte uma sequencia de coordenadas (numeros ou strings) em float64, com NaN para invalidas
+    """
+    saida = np.empty(len(valores), dtype=np.float64)
+    for i, valor in enumerate(valores):
+        try:
+            saida[i] = float(valor)
+        except (TypeError, ValueError):
+            saida[i] = np.nan
+    return saida
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """
+    Distancia em km de (lat, lng) ate cada ponto de (lats, lngs); NaN para coordenadas invalidas
+    """
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lngs = np.radians(np.asarray(lngs, dtype=np.float64))
+    phi1 = np.radians(lat)
+
+    a = (np.sin((lats - phi1) / 2.0) ** 2
+         + np.cos(phi1) * np.cos(lats) * np.sin((lngs - np.radians(lng)) / 2.0) ** 2)
+    return 2.0 * RAIO_TERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def ordenar_por_distancia(lat, lng, lats, lngs):
+    """
+    Retorna (indices, distancias) com os pontos do mais proximo ao mais distante;
+    pontos com coordenadas invalidas ficam no fim
+    """
+    distancias = haversine_km(lat, lng, coordenadas_array(lats), coordenadas_array(lngs))
+    ordem = np.argsort(distancias, kind="stable")
+    return ordem, distancias
@@ -0,0 +1,136 @@
+"""
+Requisicoes "hedged" entre mirrors equivalentes de um mesmo servico.
+
+A chamada (uma corrotina por mirror) comeca no mirror mais saudavel; se nao
+houver resposta valida em `delay` segundos (ou se ele falhar), dispara o
+proximo, e assim por diante. O primeiro sucesso vence e as tentativas
+perdedoras sao canceladas.
+
+MirrorHealth mantem, por processo, a latencia e a taxa de erro recentes (EWMA)
+de cada mirror e define a ordem de tentativa. So tentativas concluidas entram
+nas estatisticas: uma perdedora cancelada nao conta como erro nem como latencia.
+Com `prazo` (deadline.Deadline), nenhum mirror novo e disparado depois que o
+prazo acaba e a espera termina com PrazoEsgotado.
+"""
+import asyncio
+import threading
+import time
+
+from deadline import SEM_PRAZO, PrazoEsgotado
+
+
+class MirrorHealth:
+    def __init__(self, alpha=0.3, latencia_inicial=1.0, peso_erro=5.0):
+        self.alpha = alpha
+        self.latencia_inicial = latencia_inicial
+        self.peso_erro = peso_erro
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, mirror, latencia, sucesso):
+        with self._lock:
+            stats = self._stats.get(mirror)
+            if stats is None:
+                self._stats[mirror] = {"latencia": latencia, "erro": 0.0 if sucesso else 1.0, "chamadas": 1}
+                return
+            stats["latencia"] += self.alpha * (latencia - stats["latencia"])
+            stats["erro"] += self.alpha * ((0.0 if sucesso else 1.0) - stats["erro"])
+            stats["chamadas"] += 1
+
+    def score(self, mirror):
+        """
+        Custo esperado do mirror (menor e melhor): latencia penalizada pela taxa de erro
+        """
+        with self._lock:
+            stats = self._stats.get(mirror)
+        if stats is None:
+            return self.latencia_inicial
+        return stats["latencia"] * (1.0 + self.peso_erro * stats["erro"])
+
+    def ordenar(self, mirrors):
+        # sorted e estavel: mirrors sem historico mantem a ordem configurada
+        return sorted(mirrors, key=self.score)
+
+    def snapshot(self):
+        with self._lock:
+            return {mirror: dict(stats) for mirror, stats in self._stats.items()}
+
+
+def espera_hedge(delay, restantes, prazo):
+    # Atraso ate o proximo mirror (sem limite se nao ha mais mirrors), cortado pelo fim do prazo
+    espera = delay if restantes else None
+    restante = prazo.restante()
+    if restante is None:
+        return espera
+    return restante if espera is None else min(espera, restante)
+
+
+def descartar_resultado(tarefa):
+    # Le a excecao da tentativa descartada, evitando o aviso de excecao nunca lida
+    if not tarefa.cancelled():
+        tarefa.exception()
+
+
+async def hedged_call(mirrors, fn, delay, health, prazo=None):
+    """
+    Executa fn(mirror), uma corrotina, com hedging entre os mirrors.
+    Retorna (resultado, mirror) do primeiro sucesso, ou (None, ultima_excecao) se todos falharem.
+    """
+    ordem = health.ordenar(mirrors)
+    prazo = prazo or SEM_PRAZO
+    pendentes = {}
+    proximo = 0
+    ultimo_erro = None
+
+    async def tentar(mirror):
+        inicio = time.monotonic()
+        try:
+            resultado = await fn(mirror)
+        except asyncio.CancelledError:
+            # Perdedora cancelada: perder a corrida nao e falha e o tempo ate o cancelamento
+            # nao e a latencia do mirror, entao nada e registrado
+            raise
+        except Exception:
+            health.registrar(mirror, time.monotonic() - inicio, False)
+            raise
+        health.registrar(mirror, time.monotonic() - inicio, True)
+        return resultado
+
+    def lancar():
+        nonlocal proximo
+        mirror = ordem[proximo]
+        proximo += 1
+        pendentes[asyncio.ensure_future(tentar(mirror))] = mirror
+
+    try:
+        if ordem and not prazo.expirado():
+            lancar()
+        while pendentes:
+            espera = espera_hedge(delay, proximo < len(ordem), prazo)
+            concluidos, _ = await asyncio.wait(list(pendentes), timeout=espera,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not concluidos and (prazo.expirado() or proximo >= len(ordem)):
+                return None, PrazoEsgotado("prazo da execucao esgotado")
+            if not concluidos:
+                # Nenhuma resposta dentro do atraso: dispara o proximo mirror em paralelo
+                lancar()
+                continue
+
+            for tarefa in concluidos:
+                mirror = pendentes.pop(tarefa)
+                if tarefa.exception() is None:
+                    return tarefa.result(), mirror
+                ultimo_erro = tarefa.exception()
+
+            # Falha rapida: nao espera o atraso para tentar o proximo
+            if proximo < len(ordem) and not prazo.expirado():
+                lancar()
+
+        if ultimo_erro is None and prazo.expirado():
+            ultimo_erro = PrazoEsgotado("prazo da execucao esgotado")
+        return None, ultimo_erro
+    finally:
+        for tarefa in pendentes:
+            # Uma tarefa cancelada pode terminar com erro (ex.: timeout do aiohttp no mesmo instante)
+            tarefa.add_done_callback(descartar_resultado)
+            tarefa.cancel()
@@ -4,149 +4,438 @@ from weni.responses import TextResponse
 import requests
 import re
 import math
-import time
+import asyncio
+from urllib.parse import urlsplit
+from itertools import islice
+
+from async_http import ASYNC_HTTP
+from cep_index import buscar_municipio
+from compacto import sem_vazios, tabela
+from deadline import SEM_PRAZO, Deadline
+from disk_cache import DiskCache
+from gazetteer import coordenadas_municipio, gazetteer
+from geo import haversine_km, ordenar_por_distancia
+from hedge import MirrorHealth, hedged_call
+from http_client import HTTP_CLIENT
+from mapa_cache import MAPA_CACHE
+from mapa_snapshot import consultar_snapshot
+from route_cache import ROUTE_CACHE
+from tracing import SEM_TRACE, Trace, anotar, medir, registrar_falha
+
+# Cache CEP -> (cidade, uf, lat, lng) compartilhado com a tool calcular_distancias_carro
+CEP_CACHE = DiskCache("cep", ttl=30 * 24 * 3600, max_entries=50000)
+
+# Municipios proximos por celula da grade (ver FilterNearbyCities.celula_overpass); entradas expiradas
+# continuam sendo servidas por mais 180 dias enquanto os mirrors do Overpass estiverem falhando
+OVERPASS_CACHE = DiskCache("overpass", ttl=30 * 24 * 3600, max_entries=20000, retencao=180 * 24 * 3600)
+
+# Latencia e taxa de erro recentes de cada mirror do Overpass, compartilhadas entre execucoes do worker
+OVERPASS_HEALTH = MirrorHealth()
+
+
+class OverpassError(Exception):
+    pass
 
 
 class FilterNearbyCities(Tool):
+    # Limite de chamadas simultaneas ao Mapa Saude Mental e ao Google Routes por execucao
+    MAX_WORKERS = 8
+
+    # Cidades candidatas verificadas em ORDEM_VARREDURA ("distancia" ao usuario, ou "pontuacao": distancia
+    # ponderada pela populacao), parando quando CIDADES_ALVO cidades com servicos forem encontradas;
+    # None verifica todas as candidatas
+    CIDADES_ALVO = 3
+    ORDEM_VARREDURA = "distancia"
+    # Servicos por cidade na resposta (os mais proximos do usuario)
+    SERVICOS_POR_CIDADE = 2
+
+    # Rotas reais (Google Routes) por execucao: so os ROTAS_MAX servicos mais proximos em linha reta
+    # (rotas ja em cache nao contam); os demais recebem uma estimativa, a linha reta vezes FATOR_DESVIO
+    # a VELOCIDADE_ESTIMADA_KMH. None calcula a rota de todos
+    ROTAS_MAX = 10
+    FATOR_DESVIO = 1.3
+    VELOCIDADE_ESTIMADA_KMH = 50
+
+    # Os dois motores rodam o mesmo pipeline de corrotinas no loop de async_http: o asyncio faz as chamadas
+    # pelo aiohttp (quando instalado); False usa o motor com threads (cliente sincrono em threads do loop)
+    ASYNC_ENGINE = True
+
+    # Orcamento total de uma execucao; as etapas usam o que sobrar e, esgotado, a tool responde
+    # com o que ja tiver (marcado como parcial)
+    PRAZO_SEGUNDOS = 25
+    # Prazo da execucao atual (criado em execute); metodos chamados fora dela nao tem prazo
+    prazo = SEM_PRAZO
+
+    # Spans da execucao atual (tracing); a linha de log JSON sai sempre, o resumo na resposta so com esta flag
+    TIMING_NA_RESPOSTA = False
+    trace = SEM_TRACE
+
+    # Resposta no formato compacto (compacto.py): sem campos vazios, servicos de cada cidade em tabela
+    # (campos + linhas), estado repetido uma vez so e a instrucao de acao curta
+    RESPOSTA_COMPACTA = False
+    ACAO = ("com a lista de cidades proximas que possuem servicos de saude mental, utilize o agente "
+            "Get Services para buscar o servico que o usuario procura nessas cidades.")
+    ACAO_PARCIAL = ("o tempo limite foi atingido antes de verificar os servicos; com a lista de cidades proximas, "
+                    "utilize o agente Get Services para buscar o servico que o usuario procura nessas cidades.")
+    ACAO_COMPACTA = "busque o servico desejado nessas cidades com o agente Get Services"
+
+    # Campos de cada servico na resposta, na ordem
+    CAMPOS_SERVICO = (
+        "name", "lat", "long", "cidade", "estado", "endereco", "tipo", "pagamento", "formato", "servico",
+        "telefone1", "telefone2", "whatsapp", "sigla", "numero", "complemento", "bairro",
+    )
+
+    OVERPASS_ENDPOINTS = [
+        "https://overpass-api.de/api/interpreter",
+        "https://overpass.kumi.systems/api/interpreter",
+        "https://overpass.openstreetmap.ru/api/interpreter",
+    ]
+    # Segundos sem resposta do mirror atual antes de disparar o proximo em paralelo
+    OVERPASS_HEDGE_DELAY = 2.0
+    # Tamanho da celula do cache do Overpass (~5,5 km); a consulta e centrada na celula
+    OVERPASS_CELULA_GRAUS = 0.05
+
+    # Tipos da busca ampla ao Mapa Saude Mental (chave do cache compartilhado com get_mental_health_services)
+    MAPA_TIPOS = (
+        "buscas-por-estados,ambulatório saúde mental,atenção básica,caps,centro de referência,hospital,"
+        "hospital psiquiátrico,terceiro setor,upa,serviço escola,centro de especialidades,"
+        "socioassistencial,trabalhos voluntários"
+    )
+    MAPA_URL = "https://mapasaudemental.com.br/wp-json/latlng/v1/latlng-results"
+    MAPA_HEADERS = {
+        "accept": "*/*",
+        "accept-language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7",
+        "referer": "https://mapasaudemental.com.br/sobre-o-mapa/",
+        "user-agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/140.0.0.0 Safari/537.36",
+        "sec-ch-ua": '"Chromium";v="140", "Not=A?Brand";v="24", "Google Chrome";v="140"',
+        "sec-ch-ua-mobile": "?0",
+        "sec-ch-ua-platform": '"Linux"',
+        "sec-fetch-dest": "empty",
+        "sec-fetch-mode": "cors",
+        "sec-fetch-site": "same-origin",
+        "priority": "u=1, i",
+        "Cookie": "_ga=GA1.1.1033524720.1758152382; _ga_G2CXLE7Z8E=GS2.1.s1759174007$o5$g0$t1759174007$j60$l0$h0; visits=180564006"
+    }
+    ROUTES_URL = "https://routes.googleapis.com/directions/v2:computeRoutes"
+    VIACEP_URL = "https://viacep.com.br/ws/{cep}/json/"
+    GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+    OVERPASS_HEADERS = {"User-Agent": "Weni-Agent/1.0 (contato@inspiria.studio)",
+                        "Content-Type": "application/x-www-form-urlencoded"}
+
     def execute(self, context: Context) -> TextResponse:
+        self.prazo = Deadline(self.PRAZO_SEGUNDOS)
+        self.trace = Trace("FilterNearbyCities")
+
         cep = context.parameters.get("cep", "")
         places_key = context.credentials.get("places_apikey", "")
         routes_key = context.credentials.get("test_apikey", "")  # Chave para Google Routes API
 
         if not cep:
-            return TextResponse(data="CEP nao fornecido.")
+            return self.responder("CEP nao fornecido.")
         if not places_key:
-            return TextResponse(data="Chave da API do Google Maps nao fornecida.")
+            return self.responder("Chave da API do Google Maps nao fornecida.")
 
         cep = re.sub(r'\D', '', cep)
         #print(f"[DEBUG] CEP processado: {cep}")
-        coords, estado = self.get_coordinates_by_cep(cep, places_key)
+        return self.responder(ASYNC_HTTP.executar(self.executar_pipeline(cep, places_key, routes_key)))
+
+    def responder(self, resultado):
+        """
+        Registra a linha de trace da execucao e monta a resposta (compacta e com o resumo de tempos, se ativados)
+        """
+        if isinstance(resultado, dict):
+            status = "parcial" if resultado.get("parcial") else resultado.get("status")
+        else:
+            status = "mensagem"
+        self.trace.log(motor="asyncio" if self.motor_async() else "threads", status=status)
+        if self.RESPOSTA_COMPACTA and isinstance(resultado, dict):
+            resultado = self.compactar(resultado)
+        if self.TIMING_NA_RESPOSTA and isinstance(resultado, dict):
+            resultado["timing"] = self.trace.resumo()
+        return TextResponse(data=resultado)
+
+    async def executar_pipeline(self, cep, places_key, routes_key):
+        """
+        CEP -> coordenadas -> municipios proximos -> servicos por cidade -> rotas, como corrotinas
+        no loop compartilhado (async_http); as chamadas independentes (cidades e rotas) rodam
+        concorrentes. Retorna o payload da resposta (dict de sucesso ou mensagem de erro).
+        """
+        coords, estado = await self.get_coordinates_by_cep(cep, places_key)
         #print(f"[DEBUG] Coordenadas obtidas: {coords}, Estado: {estado}")
         
         if not coords:
-            return TextResponse(data="Nao foi possivel obter coordenadas a partir do CEP.")
+            return "Nao foi possivel obter coordenadas a partir do CEP."
 
         lat = coords["lat"]
         lng = coords["lng"]
         #print(f"[DEBUG] Lat: {lat}, Lng: {lng}")
 
-        cidades = self.buscar_cidades_por_overpass(lat, lng, estado)
+        cidades = await asyncio.to_thread(self.buscar_cidades_locais, lat, lng, estado)
+        if cidades is None:
+            # Gazetteer local indisponivel: consulta o Overpass
+            cidades = await self.buscar_cidades_por_overpass(lat, lng, estado)
         #print(f"[DEBUG] Cidades encontradas pelo Overpass: {len(cidades) if isinstance(cidades, list) else 'erro'}")
         if isinstance(cidades, str):
-            return TextResponse(data=cidades)
+            return cidades
         elif not cidades:
-            return TextResponse(data="Nenhuma cidade encontrada em ate 50 km.")
+            return "Nenhuma cidade encontrada em ate 50 km."
 
         # Filtrar cidades que possuem servicos de saude mental
-        # Passa as coordenadas do usuário e a chave da API de rotas se disponível
-        cidades_com_servicos = self.filtrar_cidades_com_servicos(
+        # Passa as coordenadas do usuário (ordenacao por proximidade) e a chave da API de rotas se disponível
+        cidades_com_servicos = await self.filtrar_cidades_com_servicos(
             cidades, 
-            user_coords=coords if routes_key else None,
+            user_coords=coords,
             routes_api_key=routes_key
         )
-        
+        return self.resposta_cidades(cidades_com_servicos, cidades)
+
+    def motor_async(self):
+        return self.ASYNC_ENGINE and ASYNC_HTTP.disponivel()
+
+    async def http(self, method, url, **kwargs):
+        """
+        Requisicao upstream das corrotinas do pipeline: pelo aiohttp no motor asyncio, ou pelo
+        cliente sincrono (HTTP_CLIENT) em uma thread do pool do loop no motor com threads
+        """
+        if self.motor_async():
+            return await ASYNC_HTTP.request(method, url, **kwargs)
+        return await asyncio.to_thread(HTTP_CLIENT.request, method, url, **kwargs)
+
+    def resposta_cidades(self, cidades_com_servicos, cidades=None):
+        """
+        Payload final. Se o prazo acabou antes de verificar todas as cidades ou rotas, a resposta
+        traz o que ficou pronto com "parcial": True; sem nenhuma cidade verificada, devolve as
+        cidades proximas encontradas, ainda sem servicos.
+        """
+        parcial = self.prazo.expirado()
+        if not cidades_com_servicos and not (parcial and cidades):
+            return "Nenhuma cidade proxima possui servicos de saude mental disponiveis."
+
         if not cidades_com_servicos:
-            return TextResponse(data="Nenhuma cidade proxima possui servicos de saude mental disponiveis.")
+            return {
+                "status": "success",
+                "parcial": True,
+                "action": self.ACAO_PARCIAL,
+                "cidades_proximas": [
+                    {"cidade": cidade["nome"], "distancia_km": cidade["distancia_km"]} if "distancia_km" in cidade
+                    else {"cidade": cidade["nome"]}
+                    for cidade in cidades
+                ]
+            }
 
-        return TextResponse(data={
+        resposta = {
             "status": "success",
-            "action": "com a lista de cidades proximas que possuem servicos de saude mental, utilize o agente Get Services para buscar o servico que o usuario procura nessas cidades.",
+            "action": self.ACAO,
             "cidades_proximas": cidades_com_servicos
-        })
+        }
+        if parcial:
+            # Cidades ainda nao verificadas ficam de fora e servicos podem vir sem distancia
+            resposta["parcial"] = True
+        return resposta
 
-    def get_coordinates_by_cep(self, cep, api_key):
-        try:
-            via_url = f"https://viacep.com.br/ws/{cep}/json/"
-            response = requests.get(via_url)
-            data = response.json()
-            if "erro" in data:
-                return None
+    def compactar(self, resposta):
+        """
+        Resposta no formato compacto: servicos de cada cidade em tabela, sem a cidade quando e a
+        propria cidade da lista e com o estado uma vez so no topo quando todos sao do mesmo estado
+        """
+        cidades = []
+        for cidade in resposta["cidades_proximas"]:
+            compacta = sem_vazios({chave: valor for chave, valor in cidade.items() if chave != "servicos"})
+            if cidade.get("servicos"):
+                servicos = tabela(cidade["servicos"], agrupar=("cidade", "estado"))
+                if servicos.get("cidade") == cidade.get("cidade"):
+                    del servicos["cidade"]
+                compacta["servicos"] = servicos
+            cidades.append(compacta)
+
+        estados = {cidade["servicos"].get("estado") for cidade in cidades if "servicos" in cidade}
+        compacta = {chave: valor for chave, valor in resposta.items() if chave != "cidades_proximas"}
+        compacta["action"] = self.ACAO_COMPACTA
+        if len(estados) == 1 and None not in estados:
+            compacta["estado"] = estados.pop()
+            for cidade in cidades:
+                cidade.get("servicos", {}).pop("estado", None)
+        compacta["cidades_proximas"] = cidades
+        return compacta
+
+    @medir("cep")
+    async def get_coordinates_by_cep(self, cep, api_key):
+        em_cache = await asyncio.to_thread(CEP_CACHE.get, cep) if len(cep) == 8 else None
+        anotar(cache="hit" if em_cache else "miss")
+        if em_cache:
+            return {"lat": em_cache["lat"], "lng": em_cache["lng"]}, em_cache["uf"]
 
-            cidade = data.get("localidade", "")
-            estado = data.get("uf", "")
+        try:
+            cidade, estado = await self.resolver_municipio(cep)
             if not cidade or not estado:
-                return None
+                return None, None
 
-            query = f"{cidade}, {estado}, Brasil"
-            geo_url = "https://maps.googleapis.com/maps/api/geocode/json"
-            geo_response = requests.get(geo_url, params={"address": query, "key": api_key})
-            geo_data = geo_response.json()
-            if geo_data.get("status") == "OK":
-                location = geo_data["results"][0]["geometry"]["location"]
-                return {"lat": location["lat"], "lng": location["lng"]}, estado
-            else:
+            location = await asyncio.to_thread(coordenadas_municipio, cidade, estado)
+            if not location:
+                location = await self.geocodificar_municipio(cidade, estado, api_key)
+            if not location:
                 return None, None
-        except Exception:
+
+            if len(cep) == 8:
+                await asyncio.to_thread(CEP_CACHE.set, cep, {"cidade": cidade, "uf": estado,
+                                                             "lat": location["lat"], "lng": location["lng"]})
+            return {"lat": location["lat"], "lng": location["lng"]}, estado
+        except Exception as e:
+            registrar_falha(e)
             return None, None
 
-    def buscar_cidades_por_overpass(self, lat, lng, estado):
-        endpoints = [
-            "https://overpass-api.de/api/interpreter",
-            "https://overpass.kumi.systems/api/interpreter",
-            "https://overpass.openstreetmap.ru/api/interpreter",
-        ]
+    @medir("geocode")
+    async def geocodificar_municipio(self, cidade, estado, api_key):
+        """
+        Centroide do municipio via Google Geocode, usado quando o nome nao esta no gazetteer local
+        """
+        query = f"{cidade}, {estado}, Brasil"
+        geo_response = await self.http("GET", self.GEOCODE_URL, params={"address": query, "key": api_key},
+                                       timeout=10, prazo=self.prazo)
+        geo_data = geo_response.json()
+        if geo_data.get("status") == "OK":
+            return geo_data["results"][0]["geometry"]["location"]
+        return None
+
+    async def resolver_municipio(self, cep):
+        """
+        Resolve cidade e UF do CEP pelo indice local de faixas, usando o ViaCEP como fallback
+        """
+        municipio = await asyncio.to_thread(buscar_municipio, cep)
+        if municipio:
+            return municipio["cidade"], municipio["uf"]
+        return await self.consultar_viacep(cep)
+
+    @medir("viacep")
+    async def consultar_viacep(self, cep):
+        response = await self.http("GET", self.VIACEP_URL.format(cep=cep), timeout=10, prazo=self.prazo)
+        data = response.json()
+        if "erro" in data:
+            return None, None
+        return data.get("localidade", ""), data.get("uf", "")
 
-        # Query: restringe ao Brasil por area e busca relations admin_level 8 num raio
-        query = f"""
-        [out:json][timeout:60];
-        area["ISO3166-1"="BR"][admin_level=2]->.br;
-        relation
-          ["boundary"="administrative"]
-          ["admin_level"="8"]
-          (around:50000,{lat},{lng})
-          (area.br);
-        out tags center;
+    @medir("gazetteer")
+    def buscar_cidades_locais(self, lat, lng, estado, raio_km=50):
+        """
+        Busca municipios a ate raio_km pelo indice espacial do gazetteer local.
+        Retorna None quando o gazetteer nao foi gerado, para cair no Overpass.
         """
+        indice = gazetteer()
+        if not len(indice):
+            # Visivel na linha de trace: esta execucao vai ao Overpass por falta do gazetteer
+            anotar(indice="ausente")
+            return None
 
-        headers = {"User-Agent": "Weni-Agent/1.0 (contato@inspiria.studio)",
-                   "Content-Type": "application/x-www-form-urlencoded"}
+        # A grade so separa os candidatos; a distancia de todos sai de uma unica chamada vetorizada
+        candidatos = indice.candidatos(lat, lng, raio_km)
+        distancias = haversine_km(lat, lng, [indice.lat[i] for i in candidatos],
+                                  [indice.lng[i] for i in candidatos])
+        cidades = []
+        for i, dist in zip(candidatos, distancias):
+            if dist <= raio_km:
+                cidade = indice.registro(i)
+                cidade["distancia_km"] = round(float(dist), 2)
+                cidades.append(cidade)
+        # Mesma selecao do resultado do Overpass: as 10 mais populosas, da mais proxima a mais distante
+        cidades.sort(key=lambda x: -(x.get("populacao", 0) or 0))
+        return sorted(cidades[:10], key=lambda x: x["distancia_km"])
+
+    @medir("cidades_overpass")
+    async def buscar_cidades_por_overpass(self, lat, lng, estado):
+        """
+        Municipios a ate 50 km via Overpass, com cache por celula geografica: CEPs vizinhos
+        compartilham a mesma consulta (centrada na celula) e, se os mirrors falharem
+        (ex.: HTTP 429/504), entradas expiradas continuam sendo servidas.
+        """
+        chave, centro_lat, centro_lng = self.celula_overpass(lat, lng)
+        entrada = await asyncio.to_thread(OVERPASS_CACHE.get_entrada, chave)
+        anotar(cache="miss" if entrada is None else "stale" if entrada[1] else "hit")
+        if entrada and not entrada[1]:
+            candidatos = entrada[0]
+        else:
+            candidatos = await self.consultar_candidatos_overpass(centro_lat, centro_lng, estado)
+            if isinstance(candidatos, str):
+                if not entrada:
+                    return candidatos
+                candidatos = entrada[0]
+            elif candidatos:
+                await asyncio.to_thread(OVERPASS_CACHE.set, chave, candidatos)
+        return await asyncio.to_thread(self.cidades_dos_candidatos, lat, lng, candidatos)
+
+    def cidades_dos_candidatos(self, lat, lng, candidatos):
+        """
+        Os 10 candidatos mais populosos com a distancia ao usuario, do mais proximo ao mais distante
+        """
+        if not candidatos:
+            return []
 
-        last_err = None
-        data = None
+        # Distancia dos centros ao usuario em uma unica chamada vetorizada
+        topo = candidatos[:10]
+        cidades = []
+        distancias = haversine_km(lat, lng, [c["lat"] for c in topo], [c["lng"] for c in topo])
+        for candidato, dist_km in zip(topo, distancias):
+            cidade = dict(candidato)
+            cidade["distancia_km"] = round(float(dist_km), 2)
+            cidades.append(cidade)
 
-        for overpass_url in endpoints:
-            try:
-                resp = requests.post(overpass_url, data={"data": query},
-                                     headers=headers, timeout=45)
-                # Tratamento de erros comuns
-                if resp.status_code == 429:
-                    last_err = "HTTP 429 (rate limit)"
-                    continue
-                if resp.status_code == 504:
-                    last_err = "HTTP 504 (gateway timeout)"
-                    continue
-                resp.raise_for_status()
-                data = resp.json()
-                break
-            except requests.exceptions.Timeout:
-                last_err = "timeout"
-                continue
-            except requests.exceptions.RequestException as e:
-                last_err = str(e)
-                continue
+        # Candidatos finais (os 10 mais populosos) ordenados por proximidade real do usuario
+        return sorted(cidades, key=lambda x: x["distancia_km"])
 
+    def celula_overpass(self, lat, lng):
+        """
+        Retorna (chave, lat, lng do centro) da celula da grade de OVERPASS_CELULA_GRAUS que contem o ponto
+        """
+        passo = self.OVERPASS_CELULA_GRAUS
+        i = math.floor(lat / passo)
+        j = math.floor(lng / passo)
+        return f"{passo}:{i}:{j}", round((i + 0.5) * passo, 5), round((j + 0.5) * passo, 5)
+
+    async def consultar_candidatos_overpass(self, lat, lng, estado):
+        """
+        Consulta o Overpass e retorna os municipios deduplicados, do mais ao menos populoso,
+        com o centro de cada um; ou a mensagem de erro (string) se nenhum mirror respondeu
+        """
+        data, last_err = await self.consultar_overpass(self.query_overpass(lat, lng))
         if data is None:
             return f"Erro ao consultar Overpass: {last_err or 'desconhecido'}"
 
         elementos = data.get("elements", [])
         if not elementos:
             # Plano B: repetir sem o filtro de area (as vezes o servidor falha no indice de area)
-            query2 = f"""
-            [out:json][timeout:60];
-            relation
-              ["boundary"="administrative"]
-              ["admin_level"="8"]
-              (around:50000,{lat},{lng});
-            out tags center;
-            """
-            try:
-                resp2 = requests.post(endpoints[0], data={"data": query2},
-                                      headers=headers, timeout=45)
-                if resp2.ok:
-                    elementos = resp2.json().get("elements", [])
-            except Exception:
-                pass
+            data2, _ = await self.consultar_overpass(self.query_overpass(lat, lng, filtro_area=False))
+            if data2 is not None:
+                elementos = data2.get("elements", [])
+        return await asyncio.to_thread(self.processar_elementos_overpass, elementos, estado)
+
+    def query_overpass(self, lat, lng, filtro_area=True):
+        """
+        Relations admin_level 8 num raio de 50 km; com filtro_area, restritas ao Brasil por area
+        (o plano B repete sem o filtro, pois as vezes o servidor falha no indice de area)
+        """
+        if filtro_area:
+            return f"""
+        [out:json][timeout:60];
+        area["ISO3166-1"="BR"][admin_level=2]->.br;
+        relation
+          ["boundary"="administrative"]
+          ["admin_level"="8"]
+          (around:50000,{lat},{lng})
+          (area.br);
+        out tags center;
+        """
+        return f"""
+        [out:json][timeout:60];
+        relation
+          ["boundary"="administrative"]
+          ["admin_level"="8"]
+          (around:50000,{lat},{lng});
+        out tags center;
+        """
 
+    def processar_elementos_overpass(self, elementos, estado):
+        """
+        Municipios deduplicados dos elementos do Overpass, do mais ao menos populoso, com o centro de cada um
+        """
         if not elementos:
             return []
 
@@ -160,7 +449,6 @@ class FilterNearbyCities(Tool):
             if not nome or clat is None or clng is None:
                 continue
 
-            #dist_km = round(self.haversine(lat, lng, clat, clng), 2)
             uf_sigla, uf_nome = self._extrai_uf(tags)
             # Tenta obter populacao a partir dos tags do Overpass (quando disponivel)
             pop_raw = (tags.get("population") or "").strip()
@@ -174,205 +462,352 @@ class FilterNearbyCities(Tool):
                 "uf_sigla": uf_sigla,
                 "uf_nome": uf_nome or estado,
                 "populacao": populacao,
+                "lat": clat,
+                "lng": clng,
             })
 
-            
-
         # Dedup por (nome, uf_sigla ou uf_nome)
         vistos = set()
         unicas = []
-        # Ordena por maior populacao (quando conhecida); desempate por menor distancia
+        # Ordena por maior populacao (quando conhecida)
         for c in sorted(cidades, key=lambda x: (-(x.get("populacao", 0) or 0))):
             chave = (c["nome"], c["uf_sigla"] or c["uf_nome"])
             if chave not in vistos:
                 vistos.add(chave)
                 unicas.append(c)
 
-        return unicas[:10]
+        return unicas
 
-    def haversine(self, lat1, lon1, lat2, lon2):
-        R = 6371
-        phi1 = math.radians(lat1)
-        phi2 = math.radians(lat2)
-        delta_phi = math.radians(lat2 - lat1)
-        delta_lambda = math.radians(lon2 - lon1)
-
-        a = math.sin(delta_phi / 2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    async def consultar_overpass(self, query):
+        """
+        Envia a query aos mirrors do Overpass com hedging: comeca pelo mirror mais saudavel e
+        dispara o proximo apos OVERPASS_HEDGE_DELAY segundos sem resposta (ou imediatamente se falhar).
+        Retorna (data, None) com o primeiro JSON valido, ou (None, ultimo_erro).
+        """
+        async def consultar(overpass_url):
+            # Um span por mirror disparado (roda na tarefa do hedging)
+            with self.trace.span("overpass", mirror=urlsplit(overpass_url).netloc):
+                try:
+                    resp = await self.http("POST", overpass_url, data={"data": query},
+                                           headers=self.OVERPASS_HEADERS, timeout=45, prazo=self.prazo)
+                except requests.exceptions.Timeout:
+                    raise OverpassError("timeout")
+                except requests.exceptions.RequestException as e:
+                    raise OverpassError(str(e))
+                return await asyncio.to_thread(self.interpretar_resposta_overpass, resp)
+
+        data, resultado = await hedged_call(self.OVERPASS_ENDPOINTS, consultar, delay=self.OVERPASS_HEDGE_DELAY,
+                                            health=OVERPASS_HEALTH, prazo=self.prazo)
+        if data is None:
+            return None, str(resultado) if resultado else None
+        return data, None
 
-        return R * c
+    def interpretar_resposta_overpass(self, resp):
+        """
+        JSON da resposta de um mirror, ou OverpassError para que o hedging tente o proximo
+        """
+        # Tratamento de erros comuns
+        if resp.status_code == 429:
+            raise OverpassError("HTTP 429 (rate limit)")
+        if resp.status_code == 504:
+            raise OverpassError("HTTP 504 (gateway timeout)")
+        try:
+            resp.raise_for_status()
+            return resp.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise OverpassError(str(e))
 
-    def verificar_servicos_cidade(self, cidade, estado_sigla):
+    @medir("mapa")
+    async def verificar_servicos_cidade(self, cidade, estado_sigla, origem=None):
         """
         Busca servicos de saude mental na API do Mapa Saude Mental e retorna até 2 serviços
+        (os mais próximos da origem, quando informada)
         """
+        anotar(cidade=cidade, uf=estado_sigla)
         try:
-            # Normalizar nome da cidade para URL
-            cidade_normalizada = cidade.lower().replace(' ', '+').replace('ã', 'a').replace('á', 'a').replace('â', 'a').replace('à', 'a').replace('é', 'e').replace('ê', 'e').replace('í', 'i').replace('ó', 'o').replace('ô', 'o').replace('õ', 'o').replace('ú', 'u').replace('ç', 'c')
-            
-            url = "https://mapasaudemental.com.br/wp-json/latlng/v1/latlng-results"
-            # Usar parâmetros já codificados para evitar dupla codificação
-            url_with_params = f"{url}?formato=presencial&pagamento=&tipo=buscas-por-estados%2Cambulat%C3%B3rio+sa%C3%BAde+mental%2Caten%C3%A7%C3%A3o+b%C3%A1sica%2Ccaps%2Ccentro+de+refer%C3%AAncia%2Chospital%2Chospital+psiqui%C3%A1trico%2Cterceiro+setor%2Cupa%2Cservi%C3%A7o+escola%2Ccentro+de+especialidades%2Csocioassistencial%2Ctrabalhos+volunt%C3%A1rios&mapa=saude+mental%2Cdiversidade%2Ctecnologia%2Cmulher%2Cfavelas&estado={estado_sigla.lower()}&cidade={cidade_normalizada}&nocache={int(time.time() * 1000)}"
-            
-            headers = {
-                "accept": "*/*",
-                "accept-language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7",
-                "referer": "https://mapasaudemental.com.br/sobre-o-mapa/",
-                "user-agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/140.0.0.0 Safari/537.36",
-                "sec-ch-ua": '"Chromium";v="140", "Not=A?Brand";v="24", "Google Chrome";v="140"',
-                "sec-ch-ua-mobile": "?0",
-                "sec-ch-ua-platform": '"Linux"',
-                "sec-fetch-dest": "empty",
-                "sec-fetch-mode": "cors",
-                "sec-fetch-site": "same-origin",
-                "priority": "u=1, i",
-                "Cookie": "_ga=GA1.1.1033524720.1758152382; _ga_G2CXLE7Z8E=GS2.1.s1759174007$o5$g0$t1759174007$j60$l0$h0; visits=180564006"
-            }
-            
-            response = requests.get(url_with_params, headers=headers, timeout=30)
-            data = response.json()
-            
-            # Verifica se a resposta indica que nao ha servicos
-            if data.get("status") == "error" and data.get("message") == "No locations found":
-                return []
-            
-            # Extrai os serviços da resposta
-            servicos = []
-            if data.get("status") == "success" and "locations" in data and isinstance(data["locations"], list):
-                for servico in data["locations"][:2]:  # Limita a 2 serviços
-                    servico_info = {
-                        "name": servico.get("name", ""),
-                        "lat": servico.get("lat", ""),
-                        "long": servico.get("long", ""),
-                        "cidade": servico.get("cidade", ""),
-                        "estado": servico.get("estado", ""),
-                        "endereco": servico.get("endereco", ""),
-                        "tipo": servico.get("tipo", ""),
-                        "pagamento": servico.get("pagamento", ""),
-                        "formato": servico.get("formato", ""),
-                        "servico": servico.get("servico", ""),
-                        "telefone1": servico.get("telefone1", ""),
-                        "telefone2": servico.get("telefone2", ""),
-                        "whatsapp": servico.get("whatsapp", ""),
-                        "sigla": servico.get("sigla", ""),
-                        "numero": servico.get("numero", ""),
-                        "complemento": servico.get("complemento", ""),
-                        "bairro": servico.get("bairro", "")
-                    }
-                    servicos.append(servico_info)
-            
-            return servicos
-            
+            # Snapshot local do diretorio (sync job); API ao vivo quando a UF nao esta coberta
+            data = await asyncio.to_thread(self.dados_do_snapshot, cidade, estado_sigla)
+            anotar(fonte="snapshot" if data is not None else "api")
+            if data is None:
+                data = await self.consultar_mapa_cidade(cidade, estado_sigla)
+            return await asyncio.to_thread(self.selecionar_servicos, data, origem)
         except Exception as e:
             # Em caso de erro na consulta, retorna lista vazia
+            registrar_falha(e)
             return []
 
-    def filtrar_cidades_com_servicos(self, cidades, user_coords=None, routes_api_key=None):
+    def dados_do_snapshot(self, cidade, estado_sigla):
+        """
+        Resposta no formato da API montada a partir do snapshot local, ou None se a UF nao esta coberta
+        """
+        locations_snapshot = consultar_snapshot(estado_sigla, cidade, formato="presencial")
+        if locations_snapshot is None:
+            return None
+        if not locations_snapshot:
+            return {"status": "error", "message": "No locations found"}
+        return {"status": "success", "locations": locations_snapshot}
+
+    def selecionar_servicos(self, data, origem=None):
+        """
+        Extrai ate SERVICOS_POR_CIDADE servicos da resposta da API (os mais proximos da origem, quando informada)
+        """
+        # Verifica se a resposta indica que nao ha servicos
+        if data.get("status") == "error" and data.get("message") == "No locations found":
+            return []
+        
+        # Extrai os serviços da resposta
+        servicos = []
+        if data.get("status") == "success" and "locations" in data and isinstance(data["locations"], list):
+            locations = data["locations"]
+            if origem and len(locations) > self.SERVICOS_POR_CIDADE:
+                ordem, _ = ordenar_por_distancia(
+                    origem["lat"], origem["lng"],
+                    [servico.get("lat") for servico in locations],
+                    [servico.get("long") for servico in locations],
+                )
+                locations = [locations[i] for i in ordem[:self.SERVICOS_POR_CIDADE]]
+            for servico in locations[:self.SERVICOS_POR_CIDADE]:
+                servico_info = {campo: servico.get(campo, "") for campo in self.CAMPOS_SERVICO}
+                servicos.append(servico_info)
+        
+        return servicos
+
+    async def consultar_mapa_cidade(self, cidade, estado_sigla):
+        """
+        Consulta a API do Mapa Saude Mental (busca presencial em todos os tipos) para uma cidade,
+        passando pelo cache stale-while-revalidate compartilhado
+        """
+        return await MAPA_CACHE.consultar_async(
+            estado_sigla, cidade,
+            lambda prazo=None: self.requisitar_mapa_cidade(cidade, estado_sigla, prazo),
+            tipo=self.MAPA_TIPOS, formato="presencial",
+        )
+
+    def url_mapa_cidade(self, cidade, estado_sigla):
+        # Normalizar nome da cidade para URL
+        cidade_normalizada = cidade.lower().replace(' ', '+').replace('ã', 'a').replace('á', 'a').replace('â', 'a').replace('à', 'a').replace('é', 'e').replace('ê', 'e').replace('í', 'i').replace('ó', 'o').replace('ô', 'o').replace('õ', 'o').replace('ú', 'u').replace('ç', 'c')
+        
+        url = self.MAPA_URL
+        # Usar parâmetros já codificados para evitar dupla codificação
+        url_with_params = f"{url}?formato=presencial&pagamento=&tipo=buscas-por-estados%2Cambulat%C3%B3rio+sa%C3%BAde+mental%2Caten%C3%A7%C3%A3o+b%C3%A1sica%2Ccaps%2Ccentro+de+refer%C3%AAncia%2Chospital%2Chospital+psiqui%C3%A1trico%2Cterceiro+setor%2Cupa%2Cservi%C3%A7o+escola%2Ccentro+de+especialidades%2Csocioassistencial%2Ctrabalhos+volunt%C3%A1rios&mapa=saude+mental%2Cdiversidade%2Ctecnologia%2Cmulher%2Cfavelas&estado={estado_sigla.lower()}&cidade={cidade_normalizada}"
+        
+        return url_with_params
+
+    async def requisitar_mapa_cidade(self, cidade, estado_sigla, prazo=None):
+        # prazo: o da revalidacao em segundo plano (mapa_cache); sem ele, o da execucao
+        response = await self.http("GET", self.url_mapa_cidade(cidade, estado_sigla), headers=self.MAPA_HEADERS,
+                                   timeout=30, prazo=prazo or self.prazo)
+        # Respostas de cidades grandes passam de 100 KB: o JSON e lido fora do loop
+        return await asyncio.to_thread(response.json)
+
+    @medir("servicos")
+    async def filtrar_cidades_com_servicos(self, cidades, user_coords=None, routes_api_key=None, max_workers=None):
         """
         Filtra a lista de cidades retornando apenas aquelas que possuem servicos de saude mental
-        e adiciona os serviços encontrados a cada cidade, incluindo distâncias se coordenadas do usuário fornecidas
+        e adiciona os serviços encontrados a cada cidade, incluindo distâncias se coordenadas do usuário fornecidas.
+
+        As cidades sao verificadas na ordem de varredura (ordenar_para_varredura) e, com
+        CIDADES_ALVO, so ficam em voo as consultas que ainda podem faltar para chegar ao alvo:
+        a varredura para nas primeiras CIDADES_ALVO cidades com servicos, sem consultar as
+        demais. Cada consulta e cada rota e uma tarefa, e um semaforo limita as chamadas em voo
+        a max_workers (padrao MAX_WORKERS); as rotas de uma cidade sao disparadas assim que seus
+        serviços chegam, a menos que a varredura possa encontrar mais de ROTAS_MAX servicos: ai
+        as rotas esperam o fim da varredura e so os mais proximos sao roteados (planejar_rotas).
+        A saida segue a ordem de varredura das cidades e a ordem dos serviços.
+        Quando o prazo da execucao acaba, as tarefas pendentes sao canceladas e a saida traz
+        apenas o que ja terminou (cidades sem servicos verificados ficam de fora, rotas nao
+        calculadas ficam sem distancia).
+        """
+        calcular_rotas = bool(user_coords and routes_api_key)
+        cidades = self.ordenar_para_varredura(cidades)
+        rotear_na_chegada = calcular_rotas and self.rotas_cabem_no_limite(cidades)
+        candidatas = ((i, cidade) for i, cidade in enumerate(cidades) if self.uf_consulta(cidade))
+        limite = asyncio.Semaphore(max_workers or self.MAX_WORKERS)
+        servicos_por_cidade = {}
+        distancias = {}
+        encontradas = 0
+
+        async def limitado(corrotina):
+            try:
+                async with limite:
+                    return await corrotina
+            finally:
+                # Cancelada ainda na fila do semaforo, a corrotina nunca chegou a rodar
+                corrotina.close()
+
+        async def rota(i, j, servico):
+            distancias[(i, j)] = await limitado(self.calcular_distancia_servico(
+                user_coords["lat"], user_coords["lng"], servico["lat"], servico["long"], routes_api_key))
+
+        em_voo = {}
+        rotas = []
+        while True:
+            vagas = (self.CIDADES_ALVO - encontradas if self.CIDADES_ALVO else len(cidades)) - len(em_voo)
+            for i, cidade in islice(candidatas, max(0, vagas)):
+                tarefa = asyncio.ensure_future(limitado(self.verificar_servicos_cidade(
+                    cidade["nome"], self.uf_consulta(cidade), origem=user_coords)))
+                em_voo[tarefa] = i
+            if not em_voo:
+                break
+            prontas, _ = await asyncio.wait(em_voo, timeout=self.prazo.restante(),
+                                            return_when=asyncio.FIRST_COMPLETED)
+            if not prontas:
+                break  # prazo esgotado
+            for tarefa in prontas:
+                i = em_voo.pop(tarefa)
+                servicos = tarefa.result()
+                servicos_por_cidade[i] = servicos
+                encontradas += bool(servicos)
+                if rotear_na_chegada:
+                    rotas.extend(asyncio.ensure_future(rota(i, j, servico)) for j, servico in enumerate(servicos))
+        anotar(candidatas=len(cidades), verificadas=len(servicos_por_cidade), com_servicos=encontradas)
+
+        if calcular_rotas and not rotear_na_chegada:
+            pendentes, prontas = await asyncio.to_thread(self.planejar_rotas, servicos_por_cidade, user_coords)
+            distancias.update(prontas)
+            rotas.extend(asyncio.ensure_future(rota(i, j, servico)) for i, j, servico in pendentes)
+
+        pendentes = set(em_voo)
+        if rotas:
+            _, pendentes_rotas = await asyncio.wait(rotas, timeout=self.prazo.restante())
+            pendentes |= pendentes_rotas
+        for tarefa in pendentes:
+            tarefa.cancel()
+        return self.montar_cidades_com_servicos(cidades, servicos_por_cidade, distancias)
+
+    def ordenar_para_varredura(self, cidades):
+        """
+        Candidatas na ordem em que sao verificadas: distancia ao usuario ou, com ORDEM_VARREDURA =
+        "pontuacao", distancia dividida pelo log10 da populacao (cidades maiores, um pouco mais
+        distantes, vem antes de vilarejos vizinhos)
+        """
+        if self.ORDEM_VARREDURA == "pontuacao":
+            return sorted(cidades, key=lambda c: c.get("distancia_km", math.inf)
+                          / math.log10((c.get("populacao") or 0) + 10))
+        return sorted(cidades, key=lambda c: c.get("distancia_km", math.inf))
+
+    def rotas_cabem_no_limite(self, cidades):
+        """
+        True se a varredura nao pode encontrar mais de ROTAS_MAX servicos: as rotas entao sao
+        calculadas assim que cada cidade responde, sem esperar o fim da varredura
+        """
+        if self.ROTAS_MAX is None:
+            return True
+        cidades_maximas = min(len(cidades), self.CIDADES_ALVO or len(cidades))
+        return cidades_maximas * self.SERVICOS_POR_CIDADE <= self.ROTAS_MAX
+
+    def planejar_rotas(self, servicos_por_cidade, origem):
+        """
+        Percorre os servicos encontrados do mais proximo ao mais distante da origem em linha reta:
+        rotas em cache sao usadas direto, os ROTAS_MAX primeiros sem cache vao para o Routes e os
+        demais recebem estimar_rota. Retorna ([(i, j, servico) a rotear], {(i, j): rota pronta})
+        """
+        chaves = [(i, j) for i, servicos in servicos_por_cidade.items() for j in range(len(servicos))]
+        servicos = [servicos_por_cidade[i][j] for i, j in chaves]
+        ordem, distancias_km = ordenar_por_distancia(origem["lat"], origem["lng"],
+                                                     [servico["lat"] for servico in servicos],
+                                                     [servico["long"] for servico in servicos])
+        pendentes, prontas = [], {}
+        for k in ordem:
+            (i, j), servico = chaves[k], servicos[k]
+            em_cache = ROUTE_CACHE.get(origem["lat"], origem["lng"], servico["lat"], servico["long"])
+            if em_cache:
+                prontas[(i, j)] = self.formatar_rota(em_cache["distance_meters"], em_cache["duration_seconds"])
+            elif self.ROTAS_MAX is None or len(pendentes) < self.ROTAS_MAX:
+                pendentes.append((i, j, servico))
+            elif math.isfinite(distancias_km[k]):
+                prontas[(i, j)] = self.estimar_rota(float(distancias_km[k]))
+        anotar(rotas=len(pendentes), estimadas=sum(1 for rota in prontas.values() if rota.get("estimado")))
+        return pendentes, prontas
+
+    def estimar_rota(self, distancia_km):
+        """
+        Rota estimada a partir da distancia em linha reta (sem chamada ao Routes), marcada com "estimado"
+        """
+        metros = int(distancia_km * 1000 * self.FATOR_DESVIO)
+        rota = self.formatar_rota(metros, int(metros / (self.VELOCIDADE_ESTIMADA_KMH / 3.6)))
+        rota["estimado"] = True
+        return rota
+
+    def uf_consulta(self, cidade):
+        # Usar a sigla do estado se disponivel, senao usar o nome completo
+        return cidade.get("uf_sigla") or cidade.get("uf_nome", "")
+
+    def montar_cidades_com_servicos(self, cidades, servicos_por_cidade, distancias):
+        """
+        Cidades com servicos, na ordem de entrada, com a distancia de cada servico quando calculada
         """
         cidades_com_servicos = []
-        
         for i, cidade in enumerate(cidades):
-            # Usar a sigla do estado se disponivel, senao usar o nome completo
-            estado_para_consulta = cidade.get("uf_sigla") or cidade.get("uf_nome", "")
-            
-            if not estado_para_consulta:
+            servicos = servicos_por_cidade.get(i)
+            if not servicos:
                 continue
-                
-            # Buscar serviços da cidade
-            servicos = self.verificar_servicos_cidade(cidade["nome"], estado_para_consulta)
-            if servicos:  # Se encontrou serviços
-                # Criar estrutura simplificada da cidade
-                cidade_com_servicos = {
-                    "cidade": cidade["nome"]
-                }
-                
-                # Se temos coordenadas do usuário e chave da API, calcular distâncias
-                if user_coords and routes_api_key:
-                    servicos_com_distancia = []
-                    for servico in servicos:
-                        # Calcular distância usando Google Routes API
-                        distancia_info = self.calcular_distancia_servico(
-                            user_coords["lat"], user_coords["lng"],
-                            servico["lat"], servico["long"],
-                            routes_api_key
-                        )
-                        
-                        # Criar estrutura completa do serviço
-                        servico_info = {
-                            "name": servico["name"],
-                            "lat": servico["lat"],
-                            "long": servico["long"],
-                            "cidade": servico["cidade"],
-                            "estado": servico["estado"],
-                            "endereco": servico["endereco"],
-                            "tipo": servico["tipo"],
-                            "pagamento": servico["pagamento"],
-                            "formato": servico["formato"],
-                            "servico": servico["servico"],
-                            "telefone1": servico["telefone1"],
-                            "telefone2": servico["telefone2"],
-                            "whatsapp": servico["whatsapp"],
-                            "sigla": servico["sigla"],
-                            "numero": servico["numero"],
-                            "complemento": servico["complemento"],
-                            "bairro": servico["bairro"]
-                        }
-                        
-                        # Adicionar informações de distância se disponível
-                        if distancia_info:
-                            servico_info["distancia"] = distancia_info["distance_text"]
-                            servico_info["tempo_viagem"] = distancia_info["duration_text"]
-                        
-                        servicos_com_distancia.append(servico_info)
-                    
-                    cidade_com_servicos["servicos"] = servicos_com_distancia
-                else:
-                    # Sem distâncias, retornar estrutura completa
-                    servicos_completos = []
-                    for servico in servicos:
-                        servico_info = {
-                            "name": servico["name"],
-                            "lat": servico["lat"],
-                            "long": servico["long"],
-                            "cidade": servico["cidade"],
-                            "estado": servico["estado"],
-                            "endereco": servico["endereco"],
-                            "tipo": servico["tipo"],
-                            "pagamento": servico["pagamento"],
-                            "formato": servico["formato"],
-                            "servico": servico["servico"],
-                            "telefone1": servico["telefone1"],
-                            "telefone2": servico["telefone2"],
-                            "whatsapp": servico["whatsapp"],
-                            "sigla": servico["sigla"],
-                            "numero": servico["numero"],
-                            "complemento": servico["complemento"],
-                            "bairro": servico["bairro"]
-                        }
-                        servicos_completos.append(servico_info)
-                    
-                    cidade_com_servicos["servicos"] = servicos_completos
-                
-                cidades_com_servicos.append(cidade_com_servicos)
-        
+
+            # Criar estrutura simplificada da cidade
+            cidade_com_servicos = {
+                "cidade": cidade["nome"]
+            }
+            if "distancia_km" in cidade:
+                cidade_com_servicos["distancia_km"] = cidade["distancia_km"]
+
+            servicos_completos = []
+            for j, servico in enumerate(servicos):
+                servico_info = dict(servico)
+
+                # Adicionar informações de distância se disponível
+                distancia_info = distancias.get((i, j))
+                if distancia_info:
+                    servico_info["distancia"] = distancia_info["distance_text"]
+                    servico_info["tempo_viagem"] = distancia_info["duration_text"]
+                    if distancia_info.get("estimado"):
+                        servico_info["distancia_estimada"] = True
+
+                servicos_completos.append(servico_info)
+
+            cidade_com_servicos["servicos"] = servicos_completos
+            cidades_com_servicos.append(cidade_com_servicos)
+
         return cidades_com_servicos
 
-    def calcular_distancia_servico(self, origin_lat, origin_lng, dest_lat, dest_lng, api_key):
+    @medir("rota")
+    async def calcular_distancia_servico(self, origin_lat, origin_lng, dest_lat, dest_lng, api_key):
         """
         Calcula a distancia de carro usando a Google Maps Routes API
         """
-        url = "https://routes.googleapis.com/directions/v2:computeRoutes"
+        em_cache = await asyncio.to_thread(ROUTE_CACHE.get, origin_lat, origin_lng, dest_lat, dest_lng)
+        anotar(cache="hit" if em_cache else "miss")
+        if em_cache:
+            return self.formatar_rota(em_cache["distance_meters"], em_cache["duration_seconds"])
+
+        try:
+            response = await self.http("POST", self.ROUTES_URL, headers=self.headers_rota(api_key),
+                                       json=self.payload_rota(origin_lat, origin_lng, dest_lat, dest_lng),
+                                       timeout=15, idempotente=True, prazo=self.prazo)
+            return await asyncio.to_thread(self.interpretar_rota, response, origin_lat, origin_lng,
+                                           dest_lat, dest_lng)
+        
+        except requests.exceptions.Timeout:
+            print(f"Timeout ao calcular distancia")
+            return None
         
-        headers = {
+        except requests.exceptions.RequestException as e:
+            print(f"Erro de conexao ao calcular distancia: {str(e)}")
+            return None
+        
+        except Exception as e:
+            registrar_falha(e)
+            print(f"Erro inesperado ao calcular distancia: {str(e)}")
+            return None
+
+    def headers_rota(self, api_key):
+        return {
             "Content-Type": "application/json",
             "X-Goog-Api-Key": api_key,
             "X-Goog-FieldMask": "routes.duration,routes.distanceMeters,routes.polyline.encodedPolyline"
         }
-        
-        payload = {
+
+    def payload_rota(self, origin_lat, origin_lng, dest_lat, dest_lng):
+        return {
             "origin": {
                 "location": {
                     "latLng": {
@@ -401,78 +836,73 @@ class FilterNearbyCities(Tool):
             "units": "METRIC"
         }
 
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=15)
+    def interpretar_rota(self, response, origin_lat, origin_lng, dest_lat, dest_lng):
+        """
+        Rota formatada a partir da resposta do computeRoutes (gravando no cache), ou None
+        """
+        if response.status_code == 200:
+            data = response.json()
             
-            if response.status_code == 200:
-                data = response.json()
+            if "routes" in data and len(data["routes"]) > 0:
+                route = data["routes"][0]
                 
-                if "routes" in data and len(data["routes"]) > 0:
-                    route = data["routes"][0]
-                    
-                    distance_meters = route.get("distanceMeters", 0)
-                    duration_seconds = route.get("duration", "0s")
-                    
-                    # Converter distancia para texto legivel
-                    if distance_meters >= 1000:
-                        distance_text = f"{distance_meters/1000:.1f} km"
-                    else:
-                        distance_text = f"{distance_meters} metros"
-                    
-                    # Converter duracao para texto legivel
-                    if isinstance(duration_seconds, str):
-                        # Se já está em formato string, extrair apenas o valor numérico
-                        import re
-                        match = re.search(r'(\d+)', duration_seconds)
-                        if match:
-                            duration_seconds = int(match.group(1))
-                        else:
-                            duration_seconds = 0
-                    
-                    # Converter segundos para minutos
-                    minutes = duration_seconds // 60
-                    if minutes >= 60:
-                        hours = minutes // 60
-                        remaining_minutes = minutes % 60
-                        duration_text = f"{hours}h {remaining_minutes}min" if remaining_minutes > 0 else f"{hours}h"
+                distance_meters = route.get("distanceMeters", 0)
+                duration_seconds = route.get("duration", "0s")
+                
+                # Converter duracao para segundos
+                if isinstance(duration_seconds, str):
+                    # Se já está em formato string, extrair apenas o valor numérico
+                    match = re.search(r'(\d+)', duration_seconds)
+                    if match:
+                        duration_seconds = int(match.group(1))
                     else:
-                        duration_text = f"{minutes}min"
-                    
-                    return {
-                        "distance_meters": distance_meters,
-                        "distance_text": distance_text,
-                        "duration_text": duration_text
-                    }
-                else:
-                    return None
-            
-            elif response.status_code == 400:
-                print(f"Erro na requisicao: Parametros invalidos")
-                return None
-            
-            elif response.status_code == 403:
-                print(f"Erro na requisicao: Chave da API invalida ou sem permissoes")
-                return None
-            
-            elif response.status_code == 429:
-                print(f"Erro na requisicao: Limite de requisicoes excedido")
-                return None
-            
+                        duration_seconds = 0
+                
+                ROUTE_CACHE.set(origin_lat, origin_lng, dest_lat, dest_lng, distance_meters, duration_seconds)
+                return self.formatar_rota(distance_meters, duration_seconds)
             else:
-                print(f"Erro na requisicao: HTTP {response.status_code}")
                 return None
         
-        except requests.exceptions.Timeout:
-            print(f"Timeout ao calcular distancia")
+        elif response.status_code == 400:
+            print(f"Erro na requisicao: Parametros invalidos")
             return None
         
-        except requests.exceptions.RequestException as e:
-            print(f"Erro de conexao ao calcular distancia: {str(e)}")
+        elif response.status_code == 403:
+            print(f"Erro na requisicao: Chave da API invalida ou sem permissoes")
             return None
         
-        except Exception as e:
-            print(f"Erro inesperado ao calcular distancia: {str(e)}")
+        elif response.status_code == 429:
+            print(f"Erro na requisicao: Limite de requisicoes excedido")
             return None
+        
+        else:
+            print(f"Erro na requisicao: HTTP {response.status_code}")
+            return None
+
+    def formatar_rota(self, distance_meters, duration_seconds):
+        """
+        Converte distancia (m) e duracao (s) de uma rota em texto legivel
+        """
+        # Converter distancia para texto legivel
+        if distance_meters >= 1000:
+            distance_text = f"{distance_meters/1000:.1f} km"
+        else:
+            distance_text = f"{distance_meters} metros"
+
+        # Converter segundos para minutos
+        minutes = duration_seconds // 60
+        if minutes >= 60:
+            hours = minutes // 60
+            remaining_minutes = minutes % 60
+            duration_text = f"{hours}h {remaining_minutes}min" if remaining_minutes > 0 else f"{hours}h"
+        else:
+            duration_text = f"{minutes}min"
+
+        return {
+            "distance_meters": distance_meters,
+            "distance_text": distance_text,
+            "duration_text": duration_text
+        }
 
     def _extrai_uf(self, tags):
         iso = tags.get("ISO3166-2")
@@ -0,0 +1,130 @@
+"""
+Snapshot local do diretorio do Mapa da Saude Mental, com indices em memoria.
+
+O snapshot (data/mapa_saude_mental.json, ou o arquivo indicado em
+VITA_ALERE_MAPA_SNAPSHOT) e gerado por scripts/sync_mapa_saude_mental.py, com um
+bloco por UF e a data da ultima sincronizacao de cada uma. As consultas sao
+respondidas pelos indices (UF, cidade normalizada), tipo e formato; quando a UF
+nao esta no snapshot ou esta mais velha que MAX_IDADE, retornam None para que a
+tool consulte a API ao vivo. O arquivo e recarregado quando muda no disco.
+Sem snapshot (ainda nao sincronizado), todas as consultas vao a API e o
+processo avisa uma vez no log.
+"""
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+
+SNAPSHOT_ENV = "VITA_ALERE_MAPA_SNAPSHOT"
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "mapa_saude_mental.json")
+
+# Idade maxima de uma UF no snapshot para responder sem consultar a API
+MAX_IDADE = 7 * 24 * 3600
+# Intervalo minimo entre verificacoes de alteracao do arquivo
+RECARGA_INTERVALO = 60
+
+
+def normalizar(texto):
+    """
+    Minusculas, sem acentos, com '+', hifens e espacos repetidos reduzidos a um espaco
+    """
+    sem_acento = unicodedata.normalize("NFKD", str(texto or "")).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[\s+\-]+", " ", sem_acento.lower()).strip()
+
+
+def _valores(campo):
+    # Campos como tipo e formato podem trazer varios valores separados por virgula
+    return {normalizar(parte) for parte in str(campo or "").split(",") if parte.strip()}
+
+
+class MapaSnapshot:
+    def __init__(self, estados):
+        self.locations = []
+        self.sincronizado_em = {}
+        self._por_cidade = {}
+        self._por_tipo = {}
+        self._por_formato = {}
+
+        for uf, bloco in estados.items():
+            uf = uf.upper()
+            self.sincronizado_em[uf] = bloco.get("sincronizado_em") or 0
+            for location in bloco.get("locations", []):
+                i = len(self.locations)
+                self.locations.append(location)
+                self._por_cidade.setdefault((uf, normalizar(location.get("cidade"))), []).append(i)
+                for tipo in _valores(location.get("tipo")):
+                    self._por_tipo.setdefault(tipo, set()).add(i)
+                for formato in _valores(location.get("formato")):
+                    self._por_formato.setdefault(formato, set()).add(i)
+
+    @classmethod
+    def carregar(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("estados", {}))
+
+    def idade(self, estado):
+        """
+        Segundos desde a ultima sincronizacao da UF, ou None se ela nao esta no snapshot
+        """
+        sincronizado_em = self.sincronizado_em.get(str(estado).upper())
+        if not sincronizado_em:
+            return None
+        return time.time() - sincronizado_em
+
+    def consultar(self, estado, cidade, tipo=None, formato=None, max_idade=MAX_IDADE):
+        """
+        Retorna os servicos da cidade (registros da API) filtrados por tipo e formato,
+        ou None quando a UF nao pode ser respondida pelo snapshot
+        """
+        idade = self.idade(estado)
+        if idade is None or idade > max_idade:
+            return None
+
+        indices = self._por_cidade.get((str(estado).upper(), normalizar(cidade)), [])
+        for valor, indice in ((tipo, self._por_tipo), (formato, self._por_formato)):
+            pedidos = _valores(valor)
+            if pedidos:
+                permitidos = set().union(*(indice.get(p, set()) for p in pedidos))
+                indices = [i for i in indices if i in permitidos]
+        return [self.locations[i] for i in indices]
+
+
+_snapshot = None
+_assinatura = None
+_verificado_em = 0.0
+_avisado = False
+_lock = threading.Lock()
+
+
+def snapshot():
+    global _snapshot, _assinatura, _verificado_em, _avisado
+    agora = time.monotonic()
+    if _snapshot is not None and agora - _verificado_em < RECARGA_INTERVALO:
+        return _snapshot
+
+    with _lock:
+        if _snapshot is not None and agora - _verificado_em < RECARGA_INTERVALO:
+            return _snapshot
+        path = os.environ.get(SNAPSHOT_ENV) or DATA_PATH
+        try:
+            stat = os.stat(path)
+            assinatura = (path, stat.st_mtime_ns, stat.st_size)
+            if assinatura != _assinatura:
+                _snapshot = MapaSnapshot.carregar(path)
+                _assinatura = assinatura
+        except (OSError, ValueError, AttributeError):
+            if _snapshot is None:
+                _snapshot = MapaSnapshot({})
+        if not _snapshot.sincronizado_em and not _avisado:
+            print(f"[MapaSnapshot] {path} ausente ou vazio: consultas pela API do Mapa da Saude Mental "
+                  "(sincronize com scripts/sync_mapa_saude_mental.py)")
+            _avisado = True
+        _verificado_em = agora
+    return _snapshot
+
+
+def consultar_snapshot(estado, cidade, tipo=None, formato=None):
+    return snapshot().consultar(estado, cidade, tipo=tipo, formato=formato)
@@ -0,0 +1,167 @@
+"""
+Spans de tempo por etapa de uma execucao de tool, com uma linha de log JSON por execucao.
+
+execute() cria um Trace; cada etapa e cada chamada upstream roda dentro de
+trace.span(nome, **atributos), que mede a duracao e o status (ok, ou o nome da
+excecao que escapou). Dentro do span, anotar() acrescenta atributos ao span
+corrente: o cliente HTTP registra status HTTP, bytes recebidos, tentativas e o
+erro quando a chamada falha, e os caches registram hit/stale/miss. No fim,
+trace.log() imprime a execucao inteira em uma linha JSON e trace.resumo()
+devolve os tempos agregados por etapa, para anexar a resposta. @medir(nome)
+envolve um metodo (funcao ou corrotina) da tool em um span de self.trace.
+
+VITA_ALERE_TRACE_LOG=0 desliga a linha de log (ex.: benchmarks).
+
+O span corrente fica em um contextvar, entao spans abertos em threads do pool
+ou em tarefas asyncio registram no mesmo Trace, e anotar() ve apenas o span
+da propria thread/tarefa.
+"""
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+LOG_ATIVO = os.environ.get("VITA_ALERE_TRACE_LOG", "1") != "0"
+
+_SPAN_ATUAL = contextvars.ContextVar("span_atual", default=None)
+
+
+class Span:
+    def __init__(self, nome, inicio, atributos):
+        self.nome = nome
+        self.inicio = inicio
+        self.duracao = None
+        self.status = "ok"
+        self.atributos = atributos
+
+    def anotar(self, **atributos):
+        self.atributos.update(atributos)
+
+    def dict(self, origem):
+        return {
+            "nome": self.nome,
+            "inicio_ms": round((self.inicio - origem) * 1000, 1),
+            "duracao_ms": round((self.duracao or 0.0) * 1000, 1),
+            "status": self.status,
+            **self.atributos,
+        }
+
+
+class Trace:
+    def __init__(self, tool=None):
+        # tool=None: spans medidos mas nao guardados (metodos chamados fora de execute())
+        self.tool = tool
+        self.id = uuid.uuid4().hex[:16]
+        self.inicio = time.monotonic()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, nome, **atributos):
+        span = Span(nome, time.monotonic(), atributos)
+        token = _SPAN_ATUAL.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = type(e).__name__
+            raise
+        finally:
+            span.duracao = time.monotonic() - span.inicio
+            _SPAN_ATUAL.reset(token)
+            if self.tool is not None:
+                with self._lock:
+                    self.spans.append(span)
+
+    def duracao_ms(self):
+        return round((time.monotonic() - self.inicio) * 1000, 1)
+
+    def resumo(self):
+        """
+        Tempos agregados por nome de span: chamadas, total e maximo (ms)
+        """
+        etapas = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            ms = (span.duracao or 0.0) * 1000
+            etapa = etapas.setdefault(span.nome, {"chamadas": 0, "total_ms": 0.0, "max_ms": 0.0})
+            etapa["chamadas"] += 1
+            etapa["total_ms"] += ms
+            etapa["max_ms"] = max(etapa["max_ms"], ms)
+        for etapa in etapas.values():
+            etapa["total_ms"] = round(etapa["total_ms"], 1)
+            etapa["max_ms"] = round(etapa["max_ms"], 1)
+        return {"trace_id": self.id, "duracao_ms": self.duracao_ms(), "etapas": etapas}
+
+    def log(self, **atributos):
+        """
+        Imprime a execucao (spans em ordem de inicio) como uma unica linha JSON
+        """
+        if not LOG_ATIVO:
+            return
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.inicio)
+        print(json.dumps({
+            "evento": "trace",
+            "tool": self.tool,
+            "trace_id": self.id,
+            "duracao_ms": self.duracao_ms(),
+            **atributos,
+            "spans": [span.dict(self.inicio) for span in spans],
+        }, ensure_ascii=False, default=str))
+
+
+def medir(nome):
+    """
+    Decorador de metodo: roda o metodo dentro de self.trace.span(nome)
+    """
+    def decorador(metodo):
+        if inspect.iscoroutinefunction(metodo):
+            @functools.wraps(metodo)
+            async def medido(self, *args, **kwargs):
+                with self.trace.span(nome):
+                    return await metodo(self, *args, **kwargs)
+        else:
+            @functools.wraps(metodo)
+            def medido(self, *args, **kwargs):
+                with self.trace.span(nome):
+                    return metodo(self, *args, **kwargs)
+        return medido
+    return decorador
+
+
+def anotar(**atributos):
+    """
+    Acrescenta atributos ao span corrente (sem efeito fora de um span)
+    """
+    span = _SPAN_ATUAL.get()
+    if span is not None:
+        span.anotar(**atributos)
+
+
+def registrar_http(status_code, tamanho):
+    # Chamado pelos clientes HTTP a cada tentativa: ultimo status, bytes somados e numero de tentativas
+    span = _SPAN_ATUAL.get()
+    if span is None:
+        return
+    span.atributos["http_status"] = status_code
+    span.atributos["bytes"] = span.atributos.get("bytes", 0) + tamanho
+    span.atributos["tentativas"] = span.atributos.get("tentativas", 0) + 1
+    if status_code >= 400:
+        span.status = f"http_{status_code}"
+
+
+def registrar_falha(erro):
+    # Erro tratado dentro do span (a excecao nao escapa, entao o span nao o veria)
+    span = _SPAN_ATUAL.get()
+    if span is not None:
+        span.status = type(erro).__name__
+        span.atributos["erro"] = str(erro)[:200]
+
+
+SEM_TRACE = Trace()
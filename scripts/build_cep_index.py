@@ -0,0 +1,96 @@
+"""
+Gera data/cep_faixas.json (indice offline de faixas de CEP) para as tools.
+
+Entrada: CSV com cabecalho cep_inicial,cep_final,ibge,municipio,uf, uma linha
+por faixa de CEP do municipio (ex.: exportacao da Busca Faixa de CEP dos Correios).
+Faixas contiguas do mesmo municipio sao unidas; sobreposicoes entre municipios
+diferentes abortam a geracao.
+
+Uso:
+    python scripts/build_cep_index.py faixas.csv
+"""
+import csv
+import json
+import os
+import sys
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOL_DIRS = [
+    "location_analyzer/tools/filter_nearby_cities",
+    "get_services/tools/calculate_driving_distance",
+    "get_services/tools/get_mental_health_services",
+]
+
+
+def _cep_int(valor):
+    digitos = "".join(ch for ch in valor if ch.isdigit())
+    if len(digitos) != 8:
+        raise ValueError(f"CEP invalido: {valor!r}")
+    return int(digitos)
+
+
+def ler_faixas(path):
+    faixas = []
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        for linha in csv.DictReader(f):
+            inicio = _cep_int(linha["cep_inicial"])
+            fim = _cep_int(linha["cep_final"])
+            if fim < inicio:
+                raise ValueError(f"Faixa invertida: {linha}")
+            municipio = (int(linha["ibge"]), linha["municipio"].strip(), linha["uf"].strip().upper())
+            faixas.append((inicio, fim, municipio))
+    faixas.sort()
+    return faixas
+
+
+def montar_indice(faixas):
+    municipios = []
+    posicao = {}
+    inicio, fim, municipio = [], [], []
+
+    for ini, fi, mun in faixas:
+        if mun not in posicao:
+            posicao[mun] = len(municipios)
+            municipios.append(list(mun))
+        idx = posicao[mun]
+
+        if fim and ini <= fim[-1] + 1:
+            if municipio[-1] == idx:
+                fim[-1] = max(fim[-1], fi)
+                continue
+            if ini <= fim[-1]:
+                raise ValueError(f"Faixas sobrepostas entre municipios: {municipios[municipio[-1]]} e {list(mun)}")
+
+        inicio.append(ini)
+        fim.append(fi)
+        municipio.append(idx)
+
+    return {
+        "versao": 1,
+        "gerado_em": date.today().isoformat(),
+        "municipios": municipios,
+        "inicio": inicio,
+        "fim": fim,
+        "municipio": municipio,
+    }
+
+
+def main(argv):
+    if len(argv) != 2:
+        print(__doc__)
+        return 1
+
+    indice = montar_indice(ler_faixas(argv[1]))
+    payload = json.dumps(indice, ensure_ascii=False, separators=(",", ":"))
+    for tool_dir in TOOL_DIRS:
+        destino = os.path.join(ROOT, tool_dir, "data", "cep_faixas.json")
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        with open(destino, "w", encoding="utf-8") as f:
+            f.write(payload)
+        print(f"{destino}: {len(indice['inicio'])} faixas, {len(indice['municipios'])} municipios")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
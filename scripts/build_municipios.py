@@ -0,0 +1,117 @@
+"""
+Gera data/municipios.json (gazetteer de municipios com centroide e populacao).
+
+Por padrao consulta o Overpass (relations admin_level=8 no Brasil, a mesma
+fonte usada pela tool buscar_cidades_proximas). Alternativamente aceita um CSV
+com cabecalho codigo_ibge,nome,latitude,longitude,codigo_uf[,populacao].
+
+Uso:
+    python scripts/build_municipios.py
+    python scripts/build_municipios.py --csv municipios.csv
+"""
+import csv
+import json
+import os
+import sys
+from datetime import date
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOL_DIRS = [
+    "location_analyzer/tools/filter_nearby_cities",
+    "get_services/tools/calculate_driving_distance",
+    "get_services/tools/get_mental_health_services",
+]
+
+OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+OVERPASS_QUERY = """
+[out:json][timeout:900];
+area["ISO3166-1"="BR"][admin_level=2]->.br;
+relation
+  ["boundary"="administrative"]
+  ["admin_level"="8"]
+  (area.br);
+out tags center;
+"""
+
+# Codigo IBGE da UF (dois primeiros digitos do codigo do municipio) -> sigla
+UF_POR_CODIGO = {
+    11: "RO", 12: "AC", 13: "AM", 14: "RR", 15: "PA", 16: "AP", 17: "TO",
+    21: "MA", 22: "PI", 23: "CE", 24: "RN", 25: "PB", 26: "PE", 27: "AL", 28: "SE", 29: "BA",
+    31: "MG", 32: "ES", 33: "RJ", 35: "SP",
+    41: "PR", 42: "SC", 43: "RS",
+    50: "MS", 51: "MT", 52: "GO", 53: "DF",
+}
+
+
+def _inteiro(valor):
+    digitos = "".join(ch for ch in str(valor or "") if ch.isdigit())
+    return int(digitos) if digitos else 0
+
+
+def municipios_overpass():
+    resp = requests.post(OVERPASS_URL, data={"data": OVERPASS_QUERY},
+                         headers={"User-Agent": "Weni-Agent/1.0 (contato@inspiria.studio)"},
+                         timeout=960)
+    resp.raise_for_status()
+    for el in resp.json().get("elements", []):
+        tags = el.get("tags", {}) or {}
+        centro = el.get("center") or {}
+        ibge = _inteiro(tags.get("IBGE:GEOCODIGO"))
+        uf = UF_POR_CODIGO.get(ibge // 100000)
+        if not tags.get("name") or not uf or centro.get("lat") is None or centro.get("lon") is None:
+            continue
+        yield ibge, tags["name"], uf, centro["lat"], centro["lon"], _inteiro(tags.get("population"))
+
+
+def municipios_csv(path):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        for linha in csv.DictReader(f):
+            uf = UF_POR_CODIGO.get(_inteiro(linha["codigo_uf"]))
+            if not uf:
+                continue
+            yield (_inteiro(linha["codigo_ibge"]), linha["nome"].strip(), uf,
+                   float(linha["latitude"]), float(linha["longitude"]),
+                   _inteiro(linha.get("populacao")))
+
+
+def montar_gazetteer(registros):
+    # Um registro por codigo IBGE, ordenado pelo codigo
+    por_codigo = {}
+    for registro in registros:
+        por_codigo[registro[0]] = registro
+    colunas = {"ibge": [], "nome": [], "uf": [], "lat": [], "lng": [], "populacao": []}
+    for ibge in sorted(por_codigo):
+        _, nome, uf, lat, lng, populacao = por_codigo[ibge]
+        colunas["ibge"].append(ibge)
+        colunas["nome"].append(nome)
+        colunas["uf"].append(uf)
+        colunas["lat"].append(round(lat, 6))
+        colunas["lng"].append(round(lng, 6))
+        colunas["populacao"].append(populacao)
+    return {"versao": 1, "gerado_em": date.today().isoformat(), **colunas}
+
+
+def main(argv):
+    if len(argv) == 3 and argv[1] == "--csv":
+        registros = municipios_csv(argv[2])
+    elif len(argv) == 1:
+        registros = municipios_overpass()
+    else:
+        print(__doc__)
+        return 1
+
+    dados = montar_gazetteer(registros)
+    payload = json.dumps(dados, ensure_ascii=False, separators=(",", ":"))
+    for tool_dir in TOOL_DIRS:
+        destino = os.path.join(ROOT, tool_dir, "data", "municipios.json")
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        with open(destino, "w", encoding="utf-8") as f:
+            f.write(payload)
+        print(f"{destino}: {len(dados['ibge'])} municipios")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
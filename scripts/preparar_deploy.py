@@ -0,0 +1,117 @@
+"""
+Prepara as tabelas offline das tools antes do deploy e confere que estao prontas.
+
+Cada tool e empacotada a partir da sua pasta (source.path no agent_definition),
+entao os arquivos em data/ vao junto no pacote. Este passo gera o que falta em
+todas as pastas de tool e termina com erro se alguma tabela estiver ausente,
+vazia ou (no caso do snapshot do Mapa) velha demais, para que nenhum pacote
+saia com as consultas locais desligadas:
+
+- data/cep_faixas.json: scripts/build_cep_index.py com o CSV de --faixas
+  (sem --faixas, mantem o indice ja gerado);
+- data/municipios.json: scripts/build_municipios.py, pelo CSV de
+  --municipios-csv ou pelo Overpass quando o gazetteer ainda nao existe;
+- data/mapa_saude_mental.json: scripts/sync_mapa_saude_mental.py (incremental).
+
+Uso:
+    python scripts/preparar_deploy.py [--faixas faixas.csv] [--municipios-csv municipios.csv]
+    python scripts/preparar_deploy.py --verificar
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import build_cep_index
+import build_municipios
+import sync_mapa_saude_mental
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Mesmo limite de mapa_snapshot.MAX_IDADE: UFs mais velhas vao a API ao vivo
+MAPA_MAX_IDADE = 7 * 24 * 3600
+
+
+def _carregar(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def conferir_cep_faixas(path):
+    data = _carregar(path)
+    if not data or not data.get("inicio"):
+        return "ausente ou vazio"
+    return None
+
+
+def conferir_municipios(path):
+    data = _carregar(path)
+    if not data or not data.get("ibge"):
+        return "ausente ou vazio"
+    return None
+
+
+def conferir_mapa(path):
+    data = _carregar(path)
+    estados = (data or {}).get("estados") or {}
+    if not estados:
+        return "ausente ou vazio"
+    agora = time.time()
+    faltando = [uf for uf in sync_mapa_saude_mental.UFS if uf not in estados]
+    velhas = [uf for uf, bloco in estados.items() if agora - (bloco.get("sincronizado_em") or 0) > MAPA_MAX_IDADE]
+    if faltando or velhas:
+        return f"UFs ausentes: {','.join(faltando) or '-'}; com mais de 7 dias: {','.join(sorted(velhas)) or '-'}"
+    return None
+
+
+TABELAS = [
+    ("cep_faixas.json", build_cep_index.TOOL_DIRS, conferir_cep_faixas),
+    ("municipios.json", build_municipios.TOOL_DIRS, conferir_municipios),
+    ("mapa_saude_mental.json", sync_mapa_saude_mental.TOOL_DIRS, conferir_mapa),
+]
+
+
+def conferir():
+    problemas = []
+    for nome, tool_dirs, conferir_tabela in TABELAS:
+        for tool_dir in tool_dirs:
+            path = os.path.join(ROOT, tool_dir, "data", nome)
+            problema = conferir_tabela(path)
+            print(f"{os.path.relpath(path, ROOT)}: {problema or 'ok'}")
+            if problema:
+                problemas.append(path)
+    return problemas
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faixas", help="CSV de faixas de CEP para scripts/build_cep_index.py")
+    parser.add_argument("--municipios-csv", help="CSV de municipios para scripts/build_municipios.py")
+    parser.add_argument("--verificar", action="store_true", help="so confere as tabelas, sem gerar nada")
+    args = parser.parse_args(argv[1:])
+
+    if not args.verificar:
+        if args.faixas and build_cep_index.main(["build_cep_index.py", args.faixas]):
+            return 1
+        gazetteer = os.path.join(ROOT, build_municipios.TOOL_DIRS[0], "data", "municipios.json")
+        if args.municipios_csv:
+            if build_municipios.main(["build_municipios.py", "--csv", args.municipios_csv]):
+                return 1
+        elif conferir_municipios(gazetteer) and build_municipios.main(["build_municipios.py"]):
+            return 1
+        if sync_mapa_saude_mental.main(["sync_mapa_saude_mental.py"]):
+            return 1
+
+    problemas = conferir()
+    if problemas:
+        print(f"{len(problemas)} tabela(s) fora do ponto: o deploy sairia com consultas locais desligadas")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
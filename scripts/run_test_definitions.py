@@ -0,0 +1,126 @@
+"""
+Roda os testes do test_definition.yaml de uma tool localmente, gravando ou
+reproduzindo as respostas upstream em uma cassete (cassete.py).
+
+Com --gravar, as chamadas vao a rede e as respostas sao gravadas (use as
+credenciais reais em --credenciais); sem ele, a cassete e reproduzida sem
+nenhum acesso a rede, entao a suite roda em milissegundos e sempre com as mesmas
+respostas (as credenciais podem ser quaisquer valores: as chaves nao fazem parte
+da gravacao). O cache persistente vai para um diretorio temporario vazio, para
+que todas as chamadas passem pela cassete.
+
+Para cada teste, o resultado e comparado com expected_output (strings por
+igualdade; dicts pelas chaves esperadas; listas com cada item esperado presente)
+e o tempo de execucao e mostrado. Termina com erro se algum teste divergir ou
+se faltar gravacao para alguma requisicao.
+
+Uso:
+    python scripts/run_test_definitions.py PASTA_DA_TOOL [--gravar] [--cassete ARQUIVO]
+        [--credenciais NOME=VALOR ...] [--testes NOME ...] [--mostrar]
+
+Sem --cassete, usa test_definition.cassete.json na pasta da tool.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def confere(esperado, obtido):
+    if isinstance(esperado, dict):
+        return isinstance(obtido, dict) and all(
+            chave in obtido and confere(valor, obtido[chave]) for chave, valor in esperado.items()
+        )
+    if isinstance(esperado, list):
+        return isinstance(obtido, list) and all(
+            any(confere(item, candidato) for candidato in obtido) for item in esperado
+        )
+    return esperado == obtido
+
+
+def carregar_tool(pasta):
+    # Os modulos das tools tem os mesmos nomes: uma tool por processo
+    sys.path.insert(0, pasta)
+    import main
+    from weni import Tool
+
+    classes = [obj for obj in vars(main).values()
+               if isinstance(obj, type) and issubclass(obj, Tool) and obj is not Tool]
+    if len(classes) != 1:
+        raise SystemExit(f"esperada uma Tool em {pasta}/main.py, encontradas {len(classes)}")
+    return main, classes[0]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("tool", help="pasta da tool (com main.py e test_definition.yaml)")
+    parser.add_argument("--gravar", action="store_true", help="chama a rede e grava as respostas")
+    parser.add_argument("--cassete", help="arquivo da cassete (padrao: test_definition.cassete.json da tool)")
+    parser.add_argument("--credenciais", nargs="+", default=[], metavar="NOME=VALOR")
+    parser.add_argument("--testes", nargs="+", help="roda apenas estes testes")
+    parser.add_argument("--mostrar", action="store_true", help="imprime a resposta de cada teste")
+    args = parser.parse_args(argv[1:])
+
+    pasta = os.path.abspath(args.tool)
+    caminho_cassete = os.path.abspath(args.cassete or os.path.join(pasta, "test_definition.cassete.json"))
+    if not args.gravar and not os.path.exists(caminho_cassete):
+        print(f"cassete {caminho_cassete} nao existe; grave com --gravar")
+        return 2
+    credenciais = dict(valor.partition("=")[::2] for valor in args.credenciais)
+
+    # Antes de importar a tool: o cliente HTTP e os caches leem estas variaveis na importacao
+    os.environ["VITA_ALERE_CASSETE"] = caminho_cassete
+    os.environ["VITA_ALERE_CASSETE_MODO"] = "gravar" if args.gravar else "reproduzir"
+    os.environ["VITA_ALERE_CACHE_DIR"] = tempfile.mkdtemp(prefix="test_definitions_")
+    os.environ.setdefault("VITA_ALERE_TRACE_LOG", "0")
+    modulo, classe = carregar_tool(pasta)
+    from cassete import CASSETE
+
+    with open(os.path.join(pasta, "test_definition.yaml"), encoding="utf-8") as f:
+        testes = yaml.safe_load(f).get("tests", {})
+
+    divergentes = 0
+    inicio_total = time.perf_counter()
+    for nome, teste in testes.items():
+        if args.testes and nome not in args.testes:
+            continue
+        contexto = modulo.Context(credentials=credenciais, parameters=teste.get("parameters", {}), globals={},
+                                  contact={}, project={}, constants={})
+        ausentes_antes = len(CASSETE.ausentes)
+        inicio = time.perf_counter()
+        # A Tool devolve (resultado, ...) com o payload em resultado["result"]
+        resultado = classe(contexto)[0].get("result")
+        duracao = (time.perf_counter() - inicio) * 1000
+
+        esperado = teste.get("expected_output")
+        if len(CASSETE.ausentes) > ausentes_antes:
+            situacao = "sem gravacao"
+            divergentes += 1
+        elif esperado is None:
+            situacao = "executado"
+        elif confere(esperado, resultado):
+            situacao = "ok"
+        else:
+            situacao = "diverge"
+            divergentes += 1
+        print(f"{nome:<12} {situacao:<13} {duracao:>9.1f} ms")
+        if args.mostrar or situacao == "diverge":
+            print(json.dumps(resultado, ensure_ascii=False, indent=2, default=str))
+        for chave in CASSETE.ausentes[ausentes_antes:]:
+            print(f"    sem gravacao: {chave}")
+
+    if caminho_cassete.startswith(ROOT + os.sep):
+        caminho_cassete = os.path.relpath(caminho_cassete, ROOT)
+    print(f"{'total':<12} {'':<13} {(time.perf_counter() - inicio_total) * 1000:>9.1f} ms "
+          f"({'gravado em' if args.gravar else 'cassete'} {caminho_cassete})")
+    return 1 if divergentes else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
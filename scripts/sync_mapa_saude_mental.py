@@ -0,0 +1,127 @@
+"""
+Sincroniza o snapshot local do diretorio do Mapa da Saude Mental (por UF).
+
+Baixa os servicos de cada UF com a mesma busca ampla (todos os tipos e mapas)
+usada pela tool buscar_cidades_proximas, sem filtro de cidade. A sincronizacao
+e incremental: UFs sincronizadas ha menos de --max-idade horas sao mantidas,
+e o bloco de uma UF so e substituido quando o conteudo muda (hash). Cada UF
+registra sincronizado_em; UFs que falharem mantem o bloco anterior.
+
+Uso:
+    python scripts/sync_mapa_saude_mental.py [--max-idade HORAS] [--saida ARQUIVO] [UF ...]
+
+Sem --saida, grava data/mapa_saude_mental.json nas tools que consultam o Mapa.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOL_DIRS = [
+    "get_services/tools/get_mental_health_services",
+    "location_analyzer/tools/filter_nearby_cities",
+]
+
+URL = "https://mapasaudemental.com.br/wp-json/latlng/v1/latlng-results"
+PARAMS = {
+    "formato": "",
+    "pagamento": "",
+    "tipo": "buscas-por-estados,ambulatório saúde mental,atenção básica,caps,centro de referência,"
+            "hospital,hospital psiquiátrico,terceiro setor,upa,serviço escola,centro de especialidades,"
+            "socioassistencial,trabalhos voluntários",
+    "mapa": "saude mental,diversidade,tecnologia,mulher,favelas",
+}
+HEADERS = {
+    "Accept": "*/*",
+    "User-Agent": "Vita Alere Assistant/1.0",
+}
+UFS = [
+    "AC", "AL", "AP", "AM", "BA", "CE", "DF", "ES", "GO", "MA", "MT", "MS", "MG", "PA",
+    "PB", "PR", "PE", "PI", "RJ", "RN", "RS", "RO", "RR", "SC", "SP", "SE", "TO",
+]
+
+
+def baixar_uf(uf):
+    resp = requests.get(URL, params={**PARAMS, "estado": uf.lower()}, headers=HEADERS, timeout=120)
+    resp.raise_for_status()
+    data = resp.json()
+    if data.get("status") == "error" and data.get("message") == "No locations found":
+        return []
+    if data.get("status") != "success" or not isinstance(data.get("locations"), list):
+        raise ValueError(f"resposta inesperada: {str(data)[:200]}")
+    return data["locations"]
+
+
+def carregar(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"versao": 1, "estados": {}}
+
+
+def gravar(path, snapshot):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporario = f"{path}.tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(temporario, path)
+
+
+def sincronizar(snapshot, ufs, max_idade):
+    estados = snapshot.setdefault("estados", {})
+    agora = time.time()
+    alterado = False
+    for uf in ufs:
+        bloco = estados.get(uf)
+        if bloco and agora - bloco.get("sincronizado_em", 0) < max_idade:
+            print(f"{uf}: atualizado ha {(agora - bloco['sincronizado_em']) / 3600:.1f} h, mantido")
+            continue
+        try:
+            locations = baixar_uf(uf)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"{uf}: falha ({e}), mantendo bloco anterior")
+            continue
+
+        conteudo = hashlib.sha1(json.dumps(locations, sort_keys=True).encode("utf-8")).hexdigest()
+        if bloco and bloco.get("hash") == conteudo:
+            bloco["sincronizado_em"] = time.time()
+            print(f"{uf}: sem alteracoes ({len(locations)} servicos)")
+        else:
+            estados[uf] = {"sincronizado_em": time.time(), "hash": conteudo, "locations": locations}
+            print(f"{uf}: {len(locations)} servicos")
+        alterado = True
+
+    if alterado:
+        snapshot["gerado_em"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    return alterado
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-idade", type=float, default=24, help="horas antes de sincronizar uma UF de novo")
+    parser.add_argument("--saida", help="arquivo do snapshot (padrao: data/ das tools)")
+    parser.add_argument("ufs", nargs="*", help="UFs a sincronizar (padrao: todas)")
+    args = parser.parse_args(argv[1:])
+
+    destinos = [args.saida] if args.saida else [
+        os.path.join(ROOT, tool_dir, "data", "mapa_saude_mental.json") for tool_dir in TOOL_DIRS
+    ]
+    ufs = [uf.upper() for uf in args.ufs] or UFS
+
+    snapshot = carregar(destinos[0])
+    if sincronizar(snapshot, ufs, args.max_idade * 3600) or not os.path.exists(destinos[0]):
+        for destino in destinos:
+            gravar(destino, snapshot)
+            print(f"{destino}: gravado")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))